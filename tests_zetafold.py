@@ -2,12 +2,34 @@
 from __future__ import print_function
 
 import argparse
+from math import log, exp
+import json
+import os
+import pickle
+import random
+import sys
+import threading
+import time
+import numpy as np
 
 #from zetafold.output_helpers import *
 from zetafold.partition import *
+from zetafold.batch_partition import partition_batch, partition_over_params, get_params_for_log_values
+from zetafold.polynomial_partition import partition_polynomial
+from zetafold.forward_derivs import forward_log_derivs
+from zetafold.reverse_derivs import Adjoints
+from zetafold.observable_derivs import get_observable_log_derivs, forward_observable_log_derivs, get_unpaired_pair_weights
+from zetafold.cost_model import estimate_cost
+from zetafold.sampling import BoltzmannSampler
+from zetafold.ensemble import StructureEnsemble, get_unique_pair_tables
+from zetafold.recursions.contribs_records import contrib_dtype, get_traced_contribs, set_traced_contribs
+from zetafold.util.run_monitor import CancellationToken, PartitionCancelled, PartitionTimeout
 from zetafold.util.output_util import *
-from zetafold.parameters import get_params_from_file
+from zetafold.util.deriv_check import check_log_derivs, check_grad
+from zetafold.parameters import get_params, get_params_from_file, get_params_snapshot, find_params_file, load_params_file, parse_params_file, get_params_cache_file, get_latest_params_file
 from zetafold.score_structure import score_structure
+from zetafold.derivatives import DerivativeArrays
+from zetafold.base_pair_types import get_base_pair_type_for_tag
 
 def test_zetafold( verbose = False, use_simple_recursions = False ):
 
@@ -124,6 +146,16 @@ def test_zetafold( verbose = False, use_simple_recursions = False ):
     output_test( p, Z_ref,[0,2], bpp_ref, deriv_parameters, log_deriv_ref )
     assert( set(p.struct_enumerate) == set(['......', '(.)...', '(....)', '...(.)', '(.)(.)']) )
 
+    print( 'Semiring tests...' )
+    p_count = partition( sequence, params = test_params, semiring = 'counting', verbose = verbose, use_simple_recursions = use_simple_recursions )
+    assert_equal( p_count.Z, 5 ) # five structures above
+    p_count_states = partition( sequence, params = test_params, semiring = 'counting_states', verbose = verbose, use_simple_recursions = use_simple_recursions )
+    assert_equal( p_count_states.Z, 6 ) # and (.)(.) can also coaxially stack
+    p_max = partition( sequence, params = test_params, semiring = 'max_product', mfe = True, verbose = verbose, use_simple_recursions = use_simple_recursions )
+    Z_hairpin = C_init * l**2 *l_BP/Kd
+    assert_equal( p_max.Z, max( 1, Z_hairpin, C_init * l**5 * l_BP/Kd, Z_hairpin**2, Z_hairpin**2 * K_coax ) )
+    assert( p_max.bps_MFE == [(0,2),(3,5)] )
+
     print( 'Stringent test of structure-constrained scores & derivs' )
     Z_tot_ref = p.Z
     Z_enumerate = []
@@ -181,6 +213,312 @@ def test_zetafold( verbose = False, use_simple_recursions = False ):
     bpp_ref = ( C_init * l**2 *l_BP/Kd * (1 + C_init * l**2 *l_BP/Kd)  + (C_init * l**2 *l_BP/Kd)**2 * K_coax ) / Z_ref
     output_test( p, Z_ref, [1,3], bpp_ref  )
 
+    print( 'Batched partition function, for sequences of different lengths...' )
+    sequences_list = [ 'CNGCNG', 'NyNyxNx', ['xy','yz','zx'], 'CNG' ]
+    deriv_params = ['Kd_CG','C_init','l','l_BP','C_eff_stacked_pair','K_coax','l_coax']
+    p_batch = partition_batch( sequences_list, params = test_params, calc_bpp = True, deriv_params = deriv_params, suppress_all_output = True )
+    for n,sequences in enumerate( sequences_list ):
+        p = partition( sequences, params = test_params, calc_bpp = True, deriv_params = deriv_params, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+        assert_equal( p_batch.Z[n], p.Z )
+        assert_equal( p_batch.bpp[n][1][2], p.bpp[1][2] )
+        for log_deriv,log_deriv_ref in zip( p_batch.log_derivs[n], p.log_derivs ): assert_equal( log_deriv, log_deriv_ref )
+
+    print( 'Batched partition function, for different parameter sets...' )
+    sequence = 'CNGCNG'
+    log_params = [ [ log( K_coax ) ], [ log( 2*K_coax ) ], [ log( 0.5*K_coax ) ] ]
+    p_batch = partition_over_params( sequence, log_params = log_params, param_tags = ['K_coax'], params = test_params, deriv_params = deriv_params, suppress_all_output = True )
+    for n,K_coax_val in enumerate( [ K_coax, 2*K_coax, 0.5*K_coax ] ):
+        Z_ref = (1 + C_init * l**2 *l_BP/Kd)**2  + C_init * l**5 * l_BP/Kd + (C_init * l**2 *l_BP/Kd)**2 * K_coax_val
+        assert_equal( p_batch.Z[n], Z_ref )
+        assert_equal( p_batch.log_derivs[n][ deriv_params.index('K_coax') ], (C_init * l**2 *l_BP/Kd)**2 * K_coax_val / Z_ref )
+    assert_equal( test_params.K_coax, K_coax )
+
+    print( 'Batched partition function matches partition() for circles, coaxial stacks, and multiple strands...' )
+    for ( sequences_list, circle, params_tag ) in [ ( [ 'GGCAAAGCCUU', 'CCGGAAUCCGG' ], True, 'minimal' ), # circles, with coaxial stacks
+                                                    ( [ 'GCAGUCAGCUGC', 'GGGAAACCC' ], False, 'minimal' ),  # coaxial stacks, padded
+                                                    ( [ ['GGCAAGCC','GGCUUGCC'], ['GGCAAGCC','GGCUUGCCAA'], 'GGCAAGCCGGCUUGCCAA' ], False, '' ) ]: # strands, padded
+        p_batch = partition_batch( sequences_list, circle = circle, params = params_tag, calc_bpp = True, deriv_params = [], suppress_all_output = True )
+        assert( p_batch.log_derivs.shape == ( len( sequences_list ), len( p_batch.deriv_params ) ) )
+        if params_tag == 'minimal': assert( max( p_batch.log_derivs[ :, p_batch.deriv_params.index( 'K_coax' ) ] ) > 0.1 )
+        for n,sequences in enumerate( sequences_list ):
+            p = partition( sequences, circle = circle, params = params_tag, calc_bpp = True, deriv_params = [], suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+            assert_equal( p_batch.Z[n], p.Z )
+            assert( max( abs( p_batch.bpp[n][i][j] - p.bpp[i][j] ) for i in range( p.N ) for j in range( p.N ) ) < 1.0e-6 )
+            assert( max( abs( p_batch.log_derivs[n] - np.array( p.log_derivs ) ) ) < 1.0e-6 )
+    log_params = [ [ log( K_coax ), log( l ) ], [ log( 2*K_coax ), log( 0.5*l ) ] ]
+    p_batch = partition_over_params( 'GGCAAAGCCUU', log_params = log_params, param_tags = ['K_coax','l'], params = test_params, circle = True, deriv_params = [], suppress_all_output = True )
+    for n,x in enumerate( log_params ):
+        p = partition( 'GGCAAAGCCUU', circle = True, params = get_params_for_log_values( test_params, ['K_coax','l'], x ), deriv_params = [], suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+        assert_equal( p_batch.Z[n], p.Z )
+        assert( max( abs( p_batch.log_derivs[n] - np.array( p.log_derivs ) ) ) < 1.0e-6 )
+
+    print( 'Partition function as polynomial in 1/Kd...' )
+    p_poly = partition_polynomial( sequence, param = 'Kd', params = test_params, suppress_all_output = True )
+    coeffs_ref = [ 1.0, 2 * C_init * l**2 * l_BP + C_init * l**5 * l_BP, (C_init * l**2 * l_BP)**2 * (1 + K_coax) ]
+    for coeff,coeff_ref in zip( p_poly.coeffs, coeffs_ref ): assert_equal( coeff, coeff_ref )
+    assert( not any( p_poly.coeffs[ 3: ] ) )
+    Z_ref = (1 + C_init * l**2 *l_BP/(2*Kd))**2  + C_init * l**5 * l_BP/(2*Kd) + (C_init * l**2 *l_BP/(2*Kd))**2 * K_coax
+    assert_equal( p_poly.get_Z( 2*Kd ), Z_ref )
+    assert_equal( p_poly.get_mean_count( 2*Kd ), ( coeffs_ref[1]/(2*Kd) + 2 * coeffs_ref[2]/(2*Kd)**2 ) / Z_ref )
+    assert_equal( test_params.base_pair_types[0].Kd, Kd )
+
+    print( 'Cost model for scheduling folds...' )
+    cost = estimate_cost( sequence, params = test_params, calc_bpp = True )
+    assert( cost.seconds > 0.0 and cost.peak_bytes > 0 )
+    assert_equal( cost.seconds, sum( cost.phase_seconds.values() ) )
+    cost_long = estimate_cost( sequence * 10, params = test_params, calc_bpp = True )
+    assert( cost_long.seconds > cost.seconds and cost_long.peak_bytes > cost.peak_bytes )
+
+    print( 'Progress reports, cancellation and timeout...' )
+    progress = []
+    p = partition( sequence, params = test_params, progress_callback = progress.append, suppress_all_output = True )
+    assert( len( progress ) == len( sequence ) - 1 )
+    assert( progress[-1].cells_done == progress[-1].num_cells and progress[-1].fraction_done == 1.0 )
+    cancel_token = CancellationToken()
+    try:
+        partition( sequence, params = test_params, progress_callback = lambda progress: cancel_token.cancel(), cancel_token = cancel_token, suppress_all_output = True )
+        assert( False )
+    except PartitionCancelled as e:
+        assert( e.progress.offset == 1 )
+    try:
+        partition( sequence, params = test_params, progress_callback = lambda progress: time.sleep( 0.01 ), timeout = 0.005, suppress_all_output = True )
+        assert( False )
+    except PartitionTimeout as e:
+        assert( e.progress.offset == 1 )
+
+    print( 'Profiling of recursions...' )
+    p = partition( sequence, params = test_params, calc_bpp = True, profile = True, suppress_all_output = True )
+    num_cells = len( sequence ) * ( len( sequence ) - 1 ) # calc_bpp fills all (i,j)
+    assert( p.stats[ 'update_Z_BP' ][ 'calls' ] == num_cells )
+    assert( p.stats[ 'update_Z_BPq' ][ 'calls' ] == num_cells * len( test_params.base_pair_types ) )
+    assert( p.stats[ 'update_Z_linear' ][ 'zero_skips' ] <= p.stats[ 'update_Z_linear' ][ 'inner_iterations' ] )
+    assert( p.stats[ 'update_Z_cut' ][ 'inner_iterations' ] == len( sequence ) * num_cells // 2 ) # cut points c from i to j-1
+    assert( json.loads( p.stats.to_json() )[ 'get_bpp_matrix' ][ 'calls' ] == 1 )
+    assert_equal( p.Z, (1 + C_init * l**2 *l_BP/Kd)**2  + C_init * l**5 * l_BP/Kd + (C_init * l**2 *l_BP/Kd)**2 * K_coax )
+
+    print( 'Memory report...' )
+    p = partition( sequence, params = test_params, calc_bpp = True, suppress_all_output = True )
+    memory_report = p.get_memory_report( target_N = 2 * len( sequence ) )
+    assert( memory_report.total_bytes > 0 )
+    assert( memory_report.projected_total_bytes > 4 * memory_report.total_bytes )
+    assert( memory_report.get_bytes_by_field()[ 'bpp' ] > 0 )
+    phases = [ phase for ( phase, before, after ) in memory_report.peak_rss ]
+    assert( phases[ :2 ] == [ 'initialize', 'fill' ] and 'get_bpp_matrix' in phases )
+
+    print( 'Boltzmann sampling into pair tables...' )
+    sequence = 'CNGGC'
+    p = partition( sequence, params = test_params, n_stochastic = 10, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    assert( p.stochastic_pair_tables.shape == ( 10, len( sequence ) ) and len( p.struct_stochastic ) == 10 )
+    n_samples = 20000
+    ( pair_tables, probabilities ) = p.sample_structures( n_samples, seed = 1 )
+    assert( ( p.sample_structures( n_samples, seed = 1 )[0] == pair_tables ).all() )
+    random.seed( 2 ) # unseeded sampling still follows the module-level random after a seeded call
+    pair_tables_unseeded = p.sample_structures( 1000 )[0]
+    random.seed( 2 )
+    assert( ( p.sample_structures( 1000 )[0] == pair_tables_unseeded ).all() and not ( pair_tables_unseeded == pair_tables[ :1000 ] ).all() )
+    p_workers = partition( sequence, params = test_params, n_stochastic = 250, n_workers = 2, seed = 1, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    assert( ( p_workers.stochastic_pair_tables == pair_tables[ :250 ] ).all() ) # same samples for any n_workers
+    bpp_ref = C_init*l**2*l_BP/Kd /(  1+C_init*l**2*l_BP/Kd * ( 2 + l ))
+    assert( abs( float( ( pair_tables[:,0] == 2 ).sum() ) / n_samples - bpp_ref ) < 0.02 )
+    assert( abs( probabilities[ pair_tables[:,0] == 2 ] - bpp_ref ).max() < 1.0e-10 ) # probability of structure (0,2)
+
+    print( 'Unique structures, pairing frequencies, centroid and MEA from pair tables...' )
+    ensemble = StructureEnsemble( pair_tables )
+    ( unique_pair_tables, counts, inverse ) = ensemble.get_unique()
+    assert( ( unique_pair_tables[ inverse ] == pair_tables ).all() and counts.sum() == n_samples )
+    assert( ( get_unique_pair_tables( pair_tables, np.zeros( n_samples, dtype = np.uint64 ) )[1] == counts ).all() ) # every hash colliding
+    secstructs = ensemble.get_secstructs( unique_pair_tables )
+    assert( sorted( secstructs ) == [ '(.)..', '(..).', '..(.)', '.....' ] )
+    assert( counts[ secstructs.index( '(.)..' ) ] == ( pair_tables[:,0] == 2 ).sum() )
+    assert_equal( ensemble.get_pairing_frequencies()[ 0, 2 ], float( counts[ secstructs.index( '(.)..' ) ] ) / n_samples )
+    assert( ensemble.get_secstructs( ensemble.get_centroid()[ None, : ] ) == [ '.....' if bpp_ref < 0.5 else '(.)..' ] )
+    assert( ensemble.get_secstructs( ensemble.get_mea( gamma = 0.01 )[0][ None, : ] ) == [ '.....' ] )
+    assert( ( ensemble.get_mea( gamma = 100.0 )[0] == unique_pair_tables[ 0 ] ).all() ) # most frequent base pair
+    assert( p_workers.struct_stochastic == ensemble.get_secstructs( pair_tables[ :250 ] ) )
+
+    print( 'Backtracking with an explicit stack, below the recursion limit...' )
+    sequence = 'GGGGGGAAACCCCCC'
+    p = partition( sequence, params = test_params, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit( 100 )
+    try:     p_bps = enumerative_backtrack( p )
+    finally: sys.setrecursionlimit( recursion_limit )
+    p_count = partition( sequence, params = test_params, semiring = 'counting_states', suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    assert_equal( len( p_bps ), p_count.Z )
+    p_count = partition( sequence, params = test_params, semiring = 'counting', suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    assert_equal( len( set( tuple( sorted( p_bp[1] ) ) for p_bp in p_bps ) ), p_count.Z ) # 924 structures, 3685 states
+    assert_equal( sum( p_bp[0] for p_bp in p_bps ), 1.0 )
+
+    print( 'Contributions and sampling from several threads on one Partition...' )
+    p = partition( sequence, params = test_params, calc_bpp = True, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    Q_before = [ Z.val( 0, len( sequence ) - 1 ) for Z in p.Z_all ]
+    pair_tables = {}
+    threads = [ threading.Thread( target = lambda seed: pair_tables.__setitem__( seed, BoltzmannSampler( p, seed ).sample( 100 )[0] ), args = ( seed, ) ) for seed in range( 4 ) ]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    p_serial = partition( sequence, params = test_params, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    for seed in range( 4 ): assert( ( pair_tables[ seed ] == BoltzmannSampler( p_serial, seed ).sample( 100 )[0] ).all() )
+    assert( not p.options.calc_contrib and Q_before == [ Z.val( 0, len( sequence ) - 1 ) for Z in p.Z_all ] )
+
+    print( 'Contributions as typed records, pickled and loaded into another Partition...' )
+    ( pair_tables, probabilities ) = p_serial.sample_structures( 100, seed = 1 )
+    traced_contribs = pickle.loads( pickle.dumps( get_traced_contribs( p_serial ), 2 ) )
+    assert( len( traced_contribs.records ) > 0 and traced_contribs.records.dtype.names[ 3: ] == contrib_dtype.names )
+    assert_equal( sum( contrib[0] for contrib in p_serial.Z_final.get_contribs( p_serial, 0 ) ), p_serial.Z )
+    if not use_simple_recursions:
+        p_loaded = partition( sequence, params = test_params, suppress_all_output = True )
+        set_traced_contribs( p_loaded, traced_contribs )
+        assert( p_loaded.Z_final.contribs_updated[ 0 ] and p_loaded.Z_final.contribs[ 0 ].dtype == contrib_dtype )
+        assert( ( p_loaded.sample_structures( 100, seed = 1 )[0] == pair_tables ).all() )
+        table = p_loaded.sampler.get_table( p_loaded.Z_final, 0 ) # built from the records, matrices looked up by index
+        weights = p_loaded.Z_final.contribs[ 0 ][ 'weight' ]
+        assert( table.probability == ( weights / weights.sum() ).tolist() )
+        assert( all( p_loaded.sampler.matrices[ m ] in p_loaded.Z_all for branches in table.branches for ( m, i, j ) in branches ) )
+
+    print( 'Streaming structures in order of free energy: top k and energy band...' )
+    sequence = 'GGGAAACCCAAAGGAAACC'
+    p = partition( sequence, mfe = True, max_structures = 5, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    p_all = sorted( [ p_bp[0] for p_bp in enumerative_backtrack( p ) ], reverse = True )
+    p_best_first = [ p_structure for ( bps, p_structure ) in p.suboptimal_structures() ]
+    assert( len( p_best_first ) == len( p_all ) and max( abs( p1 - p2 ) for ( p1, p2 ) in zip( p_best_first, p_all ) ) < 1.0e-12 )
+    assert( p.struct_suboptimal[ 0 ] == p.struct_MFE and len( p.struct_suboptimal ) == 5 )
+    assert_equal( p.dG_suboptimal[ 0 ], p.dG_MFE )
+    energy_band = 2.0
+    p_min = p_all[ 0 ] * exp( -energy_band / KT_IN_KCAL )
+    assert( len( list( p.suboptimal_structures( energy_band = energy_band ) ) ) == sum( 1 for p_structure in p_all if p_structure >= p_min ) )
+
+    print( 'Log derivatives of all parameters from shared arrays...' )
+    p = partition( sequence, calc_bpp = True, deriv_params = [], suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    assert( p.deriv_params == p.params.parameter_tags and None not in p.log_derivs )
+    arrays = DerivativeArrays( p )
+    bpp = sum( arrays.get_bpp( base_pair_type )[ 0 ] for base_pair_type in p.params.base_pair_types )
+    assert( max( abs( bpp[i][j] - p.bpp[i][j] ) for i in range( p.N ) for j in range( p.N ) ) < 1.0e-12 )
+    for ( parameter, log_deriv ) in zip( p.deriv_params, p.log_derivs ):
+        if parameter[:3] == 'Kd_': assert_equal( log_deriv, -arrays.get_bpp( get_base_pair_type_for_tag( p.params, parameter[3:] ) )[ 0 ].sum() )
+    base_pair_types = p.params.base_pair_types
+    stacked_pairs = arrays.get_stacked_pair_tensor()[ 0 ]
+    assert( stacked_pairs.shape == ( len( base_pair_types ), len( base_pair_types ) ) )
+    for ( a, b ) in [ ( a, b ) for a in range( len( base_pair_types ) ) for b in range( len( base_pair_types ) ) if stacked_pairs[ a, b ] > 0.0 ][:4]:
+        ( bpt1, bpt2 ) = ( base_pair_types[ a ], base_pair_types[ b ] )
+        motif_prob = sum( p.params.C_eff_stack[ bpt1 ][ bpt2 ] * p.Z_BPq[ bpt1.flipped ].val( j, i ) * p.Z_BPq[ bpt2 ].val( i+1, j-1 ) / p.Z
+                          for i in range( p.N ) for j in range( p.N ) if ( j - i ) % p.N >= 3 and p.ligated[ i ] and p.ligated[ (j-1) % p.N ] and
+                          bpt1.flipped.is_match( sequence[ j ], sequence[ i ] ) and bpt2.is_match( sequence[ (i+1) % p.N ], sequence[ (j-1) % p.N ] ) )
+        assert_equal( stacked_pairs[ a, b ], motif_prob )
+
+    print( 'Forward-mode log derivatives, carried through the dynamic programming as tangents...' )
+    for ( log_deriv, log_deriv_forward ) in zip( p.log_derivs, p.get_forward_log_derivs( p.deriv_params ) ): assert_equal( log_deriv, log_deriv_forward )
+    ( log_derivs_forward, Z ) = forward_log_derivs( 'CNGGC', [ 'Kd', 'l' ], circle = True, params = 'minimal', suppress_all_output = True )
+    assert_equal( Z, partition( 'CNGGC', circle = True, params = 'minimal', suppress_all_output = True ).Z )
+    assert_equal( log_derivs_forward[ 1 ], 5.0 ) # every structure of a circle of 5 has 5 linkages in loops
+
+    print( 'Reverse-mode (adjoint) log derivatives, from an outside sweep over the filled matrices...' )
+    p_adjoint = partition( sequence, deriv_params = [], deriv_method = 'adjoint', suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    assert( not p_adjoint.calc_all_elements )
+    for ( log_deriv, log_deriv_adjoint ) in zip( p.log_derivs, p_adjoint.log_derivs ): assert_equal( log_deriv, log_deriv_adjoint )
+    adjoints = Adjoints( p, [ 'l' ] )
+    assert( max( abs( sum( adjoints.get_cell_log_deriv( p.Z_BPq[ bpt ], i, j ) for bpt in p.base_pair_types ) - p.bpp[i][j] ) for i in range( p.N ) for j in range( i+1, p.N ) ) < 1.0e-12 )
+    if not use_simple_recursions: # sweep reads the cached contribution records, with their parameter factors
+        assert( p.Z_final.contribs_updated[ 0 ] and p.Z_final.contribs[ 0 ].dtype == contrib_dtype )
+        assert( Adjoints( p, [ 'l' ] ).log_derivs == adjoints.log_derivs )
+    p_adjoint = partition( ['GAGCAAGCUCGAC','GUCGAGC'], deriv_params = [], deriv_method = 'adjoint', suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    for ( log_deriv_adjoint, log_deriv_forward ) in zip( p_adjoint.log_derivs, p_adjoint.get_forward_log_derivs( p_adjoint.deriv_params ) ): assert_equal( log_deriv_adjoint, log_deriv_forward )
+
+    print( 'Hessian of log Z is the covariance of feature counts (Fisher information)...' )
+    hessian = p.get_log_hessian( [ 'l', 'l_BP' ] )
+    assert( hessian.shape == ( 2, 2 ) and hessian[ 0, 1 ] == hessian[ 1, 0 ] )
+    p_poly = partition_polynomial( sequence, param = 'l', suppress_all_output = True )
+    counts = np.arange( len( p_poly.coeffs ) )
+    distribution = p_poly.get_feature_distribution( p_poly.val )
+    assert_equal( hessian[ 0, 0 ], np.dot( distribution, counts**2 ) - np.dot( distribution, counts )**2 )
+    try:
+        partition_polynomial( sequence, param = 'C_eff_stacked_pair', suppress_all_output = True ) # default params do not tie C_eff_stack
+        assert( False )
+    except ValueError as e: assert( 'C_eff_stack_WC_GU' in str( e ) )
+    hessp_params = [ 'l', 'l_BP', 'Kd', 'C_init', 'C_eff_stack_WC_WC' ]
+    v = np.array( [ 0.3, -1.2, 0.7, 2.0, -0.5 ] )
+    hessp = p.get_log_hessian_vector_product( hessp_params, v ) # one CrossTangent fill, no Hessian
+    for ( hessp_val, hessian_dot_v ) in zip( hessp, p.get_log_hessian( hessp_params ).dot( v ) ): assert_equal( hessp_val, hessian_dot_v, 1.0e-10 )
+
+    print( 'Log derivatives of unpaired and base pair probabilities, from an outside sweep carrying each observable...' )
+    jacobian = p.get_unpaired_log_derivs( [ 'l', 'Kd' ] )
+    assert( jacobian.shape == ( p.N, 2 ) )
+    hessian = p.get_log_hessian( [ 'l', 'Kd' ] )
+    assert_equal( jacobian[ :, 0 ].sum(), 2.0 * hessian[ 1, 0 ] ) # sum of unpaired probabilities = N - 2 x number of pairs = N + 2 d( log Z )/d( log Kd )
+    bpp_jacobian = p.get_bpp_log_derivs( [ ( 0, j ) for j in range( 1, p.N ) ], [ 'l', 'Kd' ] )
+    assert_equal( bpp_jacobian[ :, 1 ].sum(), -jacobian[ 0, 1 ] )
+    weights = [ float( i % 3 ) for i in range( p.N ) ]
+    gradient = p.get_unpaired_log_derivs( [ 'l', 'Kd' ], weights )
+    assert_equal( gradient[ 0 ], np.dot( weights, jacobian[ :, 0 ] ) )
+    pair_weights = get_unpaired_pair_weights( p.N, weights )
+    ( values, jacobian ) = get_observable_log_derivs( p, pair_weights )
+    ( values_forward, jacobian_forward ) = forward_observable_log_derivs( sequence, pair_weights, p.params.parameter_tags, False, p.params, None, None, False, use_simple_recursions )
+    assert_equal( values[ 0 ], values_forward[ 0 ], 1.0e-10 )
+    for ( log_deriv, log_deriv_forward ) in zip( jacobian[ 0 ], jacobian_forward[ 0 ] ): assert( abs( log_deriv - log_deriv_forward ) < 1.0e-10 )
+
+    print( 'Central-difference check of log derivatives, on copies of the parameters, over a process pool...' )
+    sequence_AU_GU = 'GGUAUACCAAAGGUAAGCUAAACC'
+    p_AU_GU = partition( sequence_AU_GU, deriv_params = [], suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    parameter_values = list( p_AU_GU.params.parameter_values )
+    log_Z = lambda params: log( partition( sequence_AU_GU, params = params, suppress_all_output = True, use_simple_recursions = use_simple_recursions ).Z )
+    numerical = check_log_derivs( log_Z, p_AU_GU.params, p_AU_GU.deriv_params, p_AU_GU.log_derivs, n_sample = 4, seed = 160, n_workers = 2 )
+    checked = [ n for ( n, val ) in enumerate( numerical ) if val != None ]
+    assert( [ p_AU_GU.deriv_params[ n ] for n in checked ] == [ 'Kd_AU', 'Kd_GU', 'l', 'C_eff_stack_WC_WC' ] and list( p_AU_GU.params.parameter_values ) == parameter_values )
+    assert( min( abs( p_AU_GU.log_derivs[ n ] ) for n in checked ) > 0.01 ) # no 0 == 0 comparisons
+    try:
+        check_grad( lambda x: 1.0, [ 0.0 ], [ ( 'analytic', [ 0.5 ] ) ], [ 'a' ], n_workers = 1 ) # numerical derivative is 0
+        assert( False )
+    except AssertionError as e: assert( 'mismatch' in str( e ) )
+
+    print( 'Parameter vector with precompiled tying, same as setting tags one at a time...' )
+    ( params_by_tag, params_by_vector ) = ( get_params( '', suppress_all_output = True ), get_params( '', suppress_all_output = True ) )
+    x = np.log( params_by_tag.parameter_values + 1.0 )
+    for ( param, log_val ) in zip( params_by_tag.parameter_tags, x ): params_by_tag.set_parameter( param, np.exp( log_val ) )
+    params_by_vector.set_from_log_vector( x )
+    get_C_eff_stack_table = lambda params: [ [ params.C_eff_stack[ bpt1 ][ bpt2 ] for bpt2 in params.base_pair_types ] for bpt1 in params.base_pair_types ]
+    assert( [ bpt.Kd for bpt in params_by_vector.base_pair_types ] == [ bpt.Kd for bpt in params_by_tag.base_pair_types ] )
+    assert( get_C_eff_stack_table( params_by_vector ) == get_C_eff_stack_table( params_by_tag ) and params_by_vector.l_coax == params_by_tag.l_coax )
+    for overlapping_tags in [ [ 'C_eff_stack_WC_WC' ], [ 'C_eff_stacked_pair', 'C_eff_stack_WC_WC' ], [ 'C_eff_stack_WC_WC', 'C_eff_stacked_pair' ] ]:
+        ( params_by_tag, params_by_vector ) = ( get_params( 'v0.17', suppress_all_output = True ), get_params( 'v0.17', suppress_all_output = True ) )
+        for params in [ params_by_tag, params_by_vector ]: params.set_parameter( 'C_eff_stacked_pair', 5.0 ) # overlaps C_eff_stack_WC_WC, and comes later
+        x = [ log( 123.0 + n ) for n in range( len( overlapping_tags ) ) ]
+        for ( param, log_val ) in zip( overlapping_tags, x ): params_by_tag.set_parameter( param, exp( log_val ) )
+        params_by_vector.set_from_log_vector( x, overlapping_tags )
+        assert( get_C_eff_stack_table( params_by_vector ) == get_C_eff_stack_table( params_by_tag ) )
+        bpt_CG = get_base_pair_type_for_tag( params_by_vector, 'CG' )
+        assert_equal( params_by_vector.C_eff_stack[ bpt_CG ][ bpt_CG ], params_by_vector.get_parameter_value( overlapping_tags[ -1 ] ) )
+
+    print( 'Read-only parameter snapshots, shared by folds without copying back and forth...' )
+    params_by_tag.K_coax = 2.0
+    p_no_coax = partition( sequence, params = params_by_tag, no_coax = True, suppress_all_output = True, use_simple_recursions = use_simple_recursions )
+    assert( params_by_tag.K_coax == 2.0 and p_no_coax.params.K_coax == 0.0 and p_no_coax.params.frozen )
+    snapshot = params_by_tag.get_snapshot()
+    assert( snapshot.get_snapshot() is snapshot and pickle.loads( pickle.dumps( snapshot ) ) == snapshot and snapshot != params_by_tag.get_snapshot( l = 2.0 ) )
+    assert( snapshot.C_eff_stack_table.shape == ( len( snapshot.base_pair_types ), len( snapshot.base_pair_types ) ) and get_C_eff_stack_table( snapshot ) == snapshot.C_eff_stack_table.tolist() )
+    params_copy = snapshot.get_mutable_copy()
+    bpt = params_copy.base_pair_types[ 0 ]
+    bpt.Kd = 1.0
+    params_copy.C_eff_stack[ bpt ][ bpt.flipped ] = 1.0
+    assert( bpt.flipped in params_copy.base_pair_types and ( np.array( get_C_eff_stack_table( params_copy ) ) != snapshot.C_eff_stack_table ).sum() == 1 )
+    assert( snapshot.base_pair_types[ 0 ].Kd != 1.0 and params_copy.get_snapshot() != snapshot and params_copy.get_mutable_copy().get_snapshot() == params_copy.get_snapshot() )
+    try:
+        snapshot.base_pair_types[ 0 ].Kd = 1.0
+        assert( False )
+    except AttributeError: pass
+
+    print( 'Parameter registry and compiled params cache, each params file parsed once...' )
+    snapshot = get_params_snapshot( 'minimal', suppress_all_output = True )
+    assert( get_params_snapshot( 'minimal', suppress_all_output = True ) is snapshot and snapshot.frozen )
+    params_file = find_params_file( 'minimal' )
+    assert( get_params_snapshot( os.path.relpath( params_file ), suppress_all_output = True ) is snapshot ) # registry is keyed by file, not by tag
+    assert( get_params_snapshot( '', suppress_all_output = True ) is get_params_snapshot( os.path.basename( get_latest_params_file() )[ 9:-7 ], suppress_all_output = True ) )
+    assert( load_params_file( params_file ) == snapshot == parse_params_file( params_file ).get_snapshot() )
+    cache_file = get_params_cache_file( params_file )
+    if os.path.exists( cache_file ): # compiled cache is data, and a damaged one is just parsed again
+        assert( json.load( open( cache_file ) )[ 'parameter_tags' ] == snapshot.parameter_tags )
+        open( cache_file, 'w' ).write( 'not JSON' )
+        assert( load_params_file( params_file ) == snapshot and json.load( open( cache_file ) )[ 'parameter_tags' ] == snapshot.parameter_tags )
+    assert( get_params_from_file( 'minimal' ).get_snapshot() == snapshot and not get_params_from_file( 'minimal' ).frozen )
+
     # test secstruct
     assert( secstruct_from_bps( [(0,5),(1,4)],7 ) == '((..)).' )
     assert( bps_from_secstruct(  '((..)).' ) == [(0,5),(1,4)] )
@@ -18,11 +18,12 @@ parser.add_argument("--jobs","-j", type=int, default=4, help='Number of jobs to
 parser.add_argument("--outfile","-out","-o", type=str, help='Outfile to save loss/variables during training')
 parser.add_argument("--final_params_file",type=str,default='final.params',help="Name of params file for outputting final",nargs='*')
 parser.add_argument("--use_derivs","-d", action='store_true', help='Use analytical derivatives during training')
+parser.add_argument("--deriv_method",type=str,default='analytic',choices=['analytic','adjoint','forward'],help="How to compute derivatives: closed-form expressions, outside sweep, or refill with tangents")
 parser.add_argument("--init_params",help="Initial values for parameters (default are values in params file)",nargs='*')
 parser.add_argument("--init_log_params",help="Initial values for log parameters (alternative to init_params)",nargs='*')
 parser.add_argument("--no_coax", action='store_true', default=False, help='Turn off coaxial stacking')
 parser.add_argument("--deriv_check", action='store_true', default=False, help='Run numerical vs. analytical deriv check')
-parser.add_argument("--method",type=str,default='BFGS',help="Minimization routine")
+parser.add_argument("--method",type=str,default='BFGS',help="Minimization routine (Newton-CG, trust-ncg, trust-krylov and trust-exact also use the Hessian; not dogleg, which needs it positive definite)")
 args     = parser.parse_args()
 
 # set up parameter file
@@ -64,13 +65,22 @@ else:
 pool = Pool( args.jobs )
 
 loss = lambda x:free_energy_gap(      x,params,train_parameters,training_examples,pool,args.outfile)
-grad = lambda x:free_energy_gap_deriv(x,params,train_parameters,training_examples,pool)
+grad = lambda x:free_energy_gap_deriv(x,params,train_parameters,training_examples,pool,args.deriv_method)
 jac = grad if args.use_derivs else None
+hess = None
+hessp = None
+if args.method in [ 'Newton-CG', 'trust-ncg', 'trust-krylov', 'trust-exact' ]:
+    # second-order methods need derivatives. The Hessian of the dG gap is a difference of two covariances, so
+    #  it is indefinite in general -- these methods cope with that, but dogleg requires positive definite.
+    #  All but trust-exact only need Hessian-vector products, which cost O(P) per operation, not O(P^2).
+    jac  = grad
+    if args.method == 'trust-exact': hess  = lambda x:free_energy_gap_hessian(x,params,train_parameters,training_examples,pool)
+    else:                            hessp = lambda x,v:free_energy_gap_hessp(x,v,params,train_parameters,training_examples,pool)
 
 if args.deriv_check: train_deriv_check( x0, loss, grad, train_parameters )
 
 create_outfile( args.outfile, params, train_parameters )
-result = minimize( loss, x0, method = args.method, jac = jac )
+result = minimize( loss, x0, method = args.method, jac = jac, hess = hess, hessp = hessp )
 final_loss = loss( result.x )
 
 print(result)
@@ -11,10 +11,14 @@ if __name__ =='__main__':
     parser.add_argument("-params","--parameters",type=str, default='', help='Parameter file to use [default: '', which triggers latest version]')
     parser.add_argument("-struct","--structure",type=str, default=None, help='force specific structure in dot-parens notation')
     parser.add_argument("--force_base_pairs",type=str, default=None, help='force base pairs (but allow any others) in dot-parens notation')
-    parser.add_argument("--mfe", action='store_true', default=False, help='Get minimal free energy structure (approximately, backtracking through partition)')
+    parser.add_argument("--mfe", action='store_true', default=False, help='Get minimal free energy structure (exact, from max-product dynamic programming)')
     parser.add_argument("--bpp", action='store_true', default=False, help='Get base pairing probability')
     parser.add_argument("--stochastic", type=int, default=0, help='Number of Boltzman-weighted stochastic structures to retrieve')
+    parser.add_argument("--n_workers", type=int, default=1, help='Number of worker processes for stochastic structures')
+    parser.add_argument("--seed", type=int, default=None, help='Seed for stochastic structures (same structures for any --n_workers)')
     parser.add_argument("--enumerate",action='store_true', default=False, help='Backtrack to get all structures and their Boltzmann weights')
+    parser.add_argument("--energy_band", type=float, default=None, help='Get structures within this free energy (kcal/mol) of the MFE, in order of free energy')
+    parser.add_argument("--max_structures", type=int, default=None, help='Get this many most probable structures, in order of free energy')
     parser.add_argument("--calc_deriv", action='store_true', default=False, help='Calculate derivative with respect to all parameters')
     parser.add_argument("--no_coax", action='store_true', default=False, help='Turn off coaxial stacking')
     parser.add_argument("-v","--verbose", action='store_true', default=False, help='output dynamic programming matrices')
@@ -22,11 +26,12 @@ if __name__ =='__main__':
     parser.add_argument("--calc_Kd_deriv_DP", action='store_true', default=False, help='Calculate derivative with respect to Kd_BP inline with dynamic programming [rarely used]')
     parser.add_argument( "--deriv_params",help="Parameters for which to calculate derivatives. Default: None, or all params if --calc_deriv",nargs='*')
     parser.add_argument("--deriv_check", action='store_true', default=False, help='Run numerical vs. analytical deriv check')
+    parser.add_argument("--semiring",type=str, default='sum_product', choices=['sum_product','max_product','counting','counting_states'], help='Semiring for dynamic programming: partition function, MFE weight, number of structures, or number of states')
     args     = parser.parse_args()
 
     if ( args.calc_deriv or args.deriv_check ) and args.deriv_params == None: args.deriv_params = []
 
     if args.sequences != None: # run tests
-        p = partition( args.sequences, circle = args.circle, params = args.parameters, verbose = args.verbose, mfe = args.mfe, calc_bpp = args.bpp, n_stochastic = int(args.stochastic), do_enumeration = args.enumerate, structure = args.structure, force_base_pairs = args.force_base_pairs, deriv_params = args.deriv_params, no_coax = args.no_coax, use_simple_recursions = args.simple, deriv_check = args.deriv_check )
+        p = partition( args.sequences, circle = args.circle, params = args.parameters, verbose = args.verbose, mfe = args.mfe, calc_bpp = args.bpp, n_stochastic = int(args.stochastic), n_workers = args.n_workers, seed = args.seed, do_enumeration = args.enumerate, energy_band = args.energy_band, max_structures = args.max_structures, structure = args.structure, force_base_pairs = args.force_base_pairs, deriv_params = args.deriv_params, no_coax = args.no_coax, use_simple_recursions = args.simple, deriv_check = args.deriv_check, semiring = args.semiring )
     else:
         test_zetafold( verbose = args.verbose, use_simple_recursions = args.simple )
@@ -1,5 +1,8 @@
 from .recursions.explicit_recursions import *
-import random
+from .sampling import get_sampler
+from .util.constants import KT_IN_KCAL
+from math import exp
+import itertools
 import sys
 
 
@@ -10,52 +13,42 @@ def backtrack( self, contribs_input, mode = 'mfe' ):
       mfe = backtrack, following maximum boltzmann weight. note that this is not *quite* MFE
       stochastic  = choose track based on boltzmann weights
       enumerative = follow all tracks!
-    '''
-    #print_contribs( contribs_input )
-    if len( contribs_input ) == 0: return []
-    contrib_sum = sum( contrib[0] for contrib in contribs_input )
-    if   mode == 'enumerative':
-        contribs = [ contrib for contrib in contribs_input ] # like a deepcopy
-    elif mode == 'mfe':         contribs = [ max_contrib(contribs_input) ]
-    elif mode == 'stochastic' : contribs = [ get_random_contrib( contribs_input ) ]
-    p_bps = [] # list of tuples of (p_structure, bps_structure) for each structure
-    N = self.N
-
-    for contrib in contribs: # each option ('contribution' to this partition function of this sub-region)
-        if ( contrib[0] == 0.0 ): continue
-        p_contrib = contrib[0]/contrib_sum
-        p_bps_contrib = [ [p_contrib,[]] ]
-
-        # each 'branch'; e.g., C_eff(i,k) Z_BP(k+1, j) has a C_eff and a Z_BP branch
-        for backtrack_info in contrib[1]:
-            ( Z_backtrack, i, j )  = backtrack_info
-            if ( i == j ): continue
-            for base_pair_type in self.params.base_pair_types:
-                if Z_backtrack == self.Z_BPq[ base_pair_type ]:
-                    base_pair = [i%N,j%N]
-                    base_pair.sort()
-                    # TODO: could also add type of base pair here -- we have the info!
-                    p_bps_contrib = [ [p_bp[0], p_bp[1]+[tuple( base_pair )] ] for p_bp in p_bps_contrib ]
-            backtrack_contribs = Z_backtrack.get_contribs(self,i%N,j%N)
-            p_bps_component = backtrack( self, backtrack_contribs, mode )
-            if len( p_bps_component ) == 0: continue
-            # put together all branches
-            p_bps_contrib_new = []
-            for p_bps1 in p_bps_contrib:
-                for p_bps2 in p_bps_component:
-                    p_bps_contrib_new.append( [p_bps1[0]*p_bps2[0], p_bps1[1]+p_bps2[1]] )
-            p_bps_contrib = p_bps_contrib_new
+    Returns list of [p_structure, bps_structure] for each structure.
 
-        p_bps += p_bps_contrib
-    return p_bps
+    Tracebacks use the tables cached for each cell in BoltzmannSampler (sampling.py) and an explicit
+     stack, so there is no Python recursion, and after the first traceback through a cell, mfe and
+     stochastic tracebacks cost O(1) per cell visited.
+    '''
+    sampler = get_sampler( self )
+    table = sampler.get_contribs_table( contribs_input )
+    if table.num_contribs == 0: return []
+    if mode == 'enumerative': return [ [p, bps] for (bps, p) in sampler.enumerate( table ) ]
+    (bps, p) = sampler.draw( table, mode )
+    return [ [p, bps] ]
 
 ##################################################################################################
-def mfe( self, Z_final_contrib ):
-    p_bps = backtrack( self, Z_final_contrib, mode = 'mfe' )
-    assert( len(p_bps) == 1 )
-    p,bps = p_bps[0]
+def mfe( self, i = 0 ):
+    '''
+    Minimum free energy structure, following the backpointers stored during dynamic programming in
+     the max-product semiring, starting from Z_final(i). Only one contribution is kept per (i,j), so
+     this is O(N), and there is no need to recompute contributions.
+    Returns (bps, Q_MFE), where Q_MFE is the Boltzmann weight of the MFE structure.
+    '''
+    assert( self.options.semiring.max_product )
+    Z_BPq_matrices = list( self.Z_BPq.values() )
+    N = self.N
+    bps = []
+    backtrack_info_stack = list( self.Z_final.get_backpointer( i ) )
+    while len( backtrack_info_stack ) > 0:
+        ( Z_backtrack, m, n ) = backtrack_info_stack.pop()
+        if ( m == n ): continue
+        if Z_backtrack in Z_BPq_matrices:
+            base_pair = [m%N,n%N]
+            base_pair.sort()
+            bps.append( tuple( base_pair ) )
+        backtrack_info_stack += Z_backtrack.get_backpointer( m%N, n%N )
     bps.sort()
-    return (bps,p)
+    return (bps, self.Z_final.val(i))
 
 ##################################################################################################
 def boltzmann_sample( self, Z_final_contrib ):
@@ -65,28 +58,28 @@ def boltzmann_sample( self, Z_final_contrib ):
 
 ##################################################################################################
 def enumerative_backtrack( self ):
-    return backtrack( self, self.Z_final.get_contribs(self,0), 'enumerative' )
-
+    sampler = get_sampler( self )
+    return [ [p, bps] for (bps, p) in sampler.enumerate( sampler.get_table( self.Z_final, 0 ) ) ]
 
 ##################################################################################################
-def get_random_contrib( contribs ):
-    # Random sample weighted by probability. Must be a simple function for this.
-    contrib_cumsum = [ contribs[0][0] ]
-    for contrib in contribs[1:]: contrib_cumsum.append( contrib_cumsum[-1] + contrib[0] )
-    r = random.random() * contrib_cumsum[ -1 ]
-    for (idx,psum) in enumerate( contrib_cumsum ):
-        if r < psum: return contribs[idx]
-
-def max_contrib(contribs):
-    max_contrib_val = None
-    best_contrib = None
-    for c in contribs:
-        if max_contrib_val is None or \
-           c[0] > max_contrib_val:
-            best_contrib = c
-            max_contrib_val = c[0]
-    return best_contrib
+def suboptimal_structures( self, energy_band = None, max_structures = None ):
+    '''
+    Generator over structures in order of decreasing probability (increasing free energy), as ( bps, p ),
+     streamed from a best-first traceback (enumerate_best_first() in sampling.py):
+      energy_band    = stop at structures more than energy_band (kcal/mol) above the MFE structure
+      max_structures = stop after this many structures (the top k)
+    Free energy of a structure is dG - KT log( p ). As in enumerative_backtrack(), a structure that can be
+     built in several ways (e.g., with or without a coaxial stack) comes out once for each.
+    '''
+    p_max = self.get_max_product_partition()
+    p_min = 0.0
+    if energy_band != None and p_max.Z > 0.0:
+        p_min = ( p_max.Z / self.Z ) * exp( -energy_band / KT_IN_KCAL ) * ( 1.0 - 1.0e-9 ) # round-off at the edge of the band
+    structures = get_sampler( self ).enumerate_best_first( p_max, p_min = p_min )
+    if max_structures != None: structures = itertools.islice( structures, max_structures )
+    return structures
 
+##################################################################################################
 def print_contrib( contrib ):
     sys.stdout.write('[')
     print '%s:' % contrib[0],
@@ -1,4 +1,6 @@
 class BasePairType:
+    frozen = False # read-only, in a parameters snapshot
+
     def __init__( self, nt1, nt2, Kd, match_lowercase = False ):
         '''
         Two sequence characters that get matched to base pair, e.g., 'C' and 'G';
@@ -12,6 +14,12 @@ class BasePairType:
         self.match_lowercase = ( nt1 == '*' and nt2 == '*' and match_lowercase )
         self.flipped = self # needs up be updated later.
 
+    def __setattr__( self, name, val ):
+        if self.__dict__.get( 'frozen' ): raise AttributeError( 'base pair type in parameters snapshot is read-only: %s' % name )
+        self.__dict__[ name ] = val
+
+    __hash__ = object.__hash__ # same hash as by default (identity), without looking for __eq__ and __cmp__ first -- keys of C_eff_stack
+
     def is_match( self, s1, s2 ):
         if self.match_lowercase: return ( s1.islower() and s2.islower() and s1 == s2 )
         return ( s1 == self.nt1 and s2 == self.nt2 )
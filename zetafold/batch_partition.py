@@ -0,0 +1,281 @@
+from __future__ import print_function
+import numpy as np
+from .parameters import get_params, get_params_snapshot, get_Kd_array, get_C_eff_stack_table
+from .derivatives import DerivativeArrays, get_log_derivs_from_arrays
+from .util.sequence_util import initialize_sequence_and_ligated, initialize_all_ligated
+from .util.constants import KT_IN_KCAL
+from .util.assert_equal import assert_equal
+from .recursions.batch_recursions import update_Z_BPq, update_Z_BP, update_Z_cut, update_Z_coax, update_C_eff_basic, update_C_eff_no_BP_singlet, update_C_eff_no_coax_singlet, update_C_eff, update_Z_final, update_Z_linear
+
+# unpairable character appended to shorter sequences in a batch
+PAD_CHARACTER = '-'
+
+##################################################################################################
+def partition_batch( sequences_list, circle = False, params = '', calc_bpp = False, no_coax = False,
+                     suppress_all_output = False, deriv_params = None ):
+    '''
+    Partition function for many sequences at once, with dynamic programming matrices that carry
+     a leading batch axis (see recursions/batch_recursions.py).
+
+    sequences_list = list of sequences, each a string or array of strings (interacting strands).
+                     Sequences of different lengths are padded at their 3' end with unpaired
+                     PAD_CHARACTER, which does not change Z for linear sequences.
+
+    Returns BatchPartition object p which holds results like:
+
+      p.Z   = array of final partition functions, one per sequence
+      p.dG  = array of free energies, one per sequence
+      p.bpp = B x N x N array of base pair probabilities (if requested by user with calc_bpp = True).
+                Sequence b of length p.lengths[b] is in p.bpp[b,:L,:L].
+      p.log_derivs = B x P array of d(log Z)/d(log parameter) for deriv_params
+
+    These match what partition() gives for each sequence individually.
+    '''
+    if isinstance(params,str): params = get_params_snapshot( params, suppress_all_output )
+    params = params.get_snapshot( K_coax = 0.0 ) if no_coax else params.get_snapshot()
+
+    p = BatchPartition( sequences_list, params )
+    p.circle = circle
+    p.calc_all_elements = calc_bpp or (deriv_params != None)
+    p.suppress_all_output = suppress_all_output
+    p.deriv_params = deriv_params
+    p.run()
+    if calc_bpp: p.get_bpp_matrix()
+    if not suppress_all_output: p.show_results()
+    p.run_cross_checks()
+
+    return p
+
+##################################################################################################
+def partition_over_params( sequences, params_list = None, log_params = None, param_tags = None, params = '',
+                           circle = False, calc_bpp = False, suppress_all_output = False, deriv_params = None ):
+    '''
+    Partition function for one sequence under P parameter sets, filled in one pass with the
+     parameter sets along the batch axis -- sequence masks and loop bookkeeping are computed once.
+
+    Parameter sets are given either as
+      params_list = list of AlphaFoldParams objects or params file tags (e.g., ['v0.1','v0.17','v0.18']),
+                     which must define the same base pair types, min_loop_length, and allow_strained_3WJ; or
+      log_params  = P x M matrix of log parameter values for param_tags (default: all parameter_tags of params),
+                     applied to copies of params.
+
+    Returns BatchPartition object p with p.Z, p.dG, p.bpp, p.log_derivs for each parameter set (see partition_batch).
+    '''
+    if log_params is not None:
+        if isinstance(params,str): params = get_params( params, suppress_all_output )
+        if param_tags == None: param_tags = params.parameter_tags
+        params_list = [ get_params_for_log_values( params, param_tags, x ) for x in log_params ]
+    params_list = [ get_params( params_in, suppress_all_output ) for params_in in params_list ]
+
+    p = BatchPartition( [ sequences ], params_list )
+    p.circle = circle
+    p.calc_all_elements = calc_bpp or (deriv_params != None)
+    p.suppress_all_output = suppress_all_output
+    p.deriv_params = deriv_params
+    p.run()
+    if calc_bpp: p.get_bpp_matrix()
+    if not suppress_all_output: p.show_results()
+    p.run_cross_checks()
+
+    return p
+
+def get_params_for_log_values( params, param_tags, x ):
+    '''
+    Copy of AlphaFoldParams with parameters param_tags set to exp( x )
+    '''
+    params = params.get_mutable_copy()
+    for param_tag in param_tags: assert( param_tag in params.parameter_tags )
+    params.set_from_log_vector( x, param_tags )
+    return params
+
+##################################################################################################
+class BatchPartition:
+    '''
+    Same statistical mechanical model as Partition, filled for a batch of problems with NumPy.
+    The batch runs over sequences, or over parameter sets -- whichever list is longer;
+     the other one must have a single entry.
+    '''
+    def __init__( self, sequences_list, params ):
+        '''
+        Required user input.
+        sequences_list = list of sequences (each a string, or array of strings of interacting strands)
+        params         = AlphaFoldParams object, or list of AlphaFoldParams objects with the same base pair types
+        '''
+        self.sequences_list = sequences_list
+        self.params_list = params if isinstance( params, list ) else [ params ]
+        self.params = self.params_list[ 0 ]
+        self.circle = False
+        self.calc_all_elements = False
+        self.suppress_all_output = False
+        self.deriv_params = None
+        assert( len( self.sequences_list ) == len( self.params_list ) or \
+                len( self.sequences_list ) == 1 or len( self.params_list ) == 1 )
+        self.B = max( len( self.sequences_list ), len( self.params_list ) )
+
+        # for output:
+        self.Z   = None
+        self.dG  = None
+        self.bpp = None
+        self.log_derivs = None
+
+    ##############################################################################################
+    def run( self ):
+        '''
+        Do the dynamic programming to fill partition function matrices, one anti-diagonal at a time
+        '''
+        initialize_batch_sequence_information( self ) # N, sequences, ligated, match, allow_pair
+        initialize_batch_parameters( self ) # C_init, ..., Kd, C_eff_stack as arrays over batch
+        initialize_batch_dynamic_programming_matrices( self )
+
+        N = self.N
+        for offset in range( 1, N ): #length of subfragment
+            I = np.arange( N ) if self.calc_all_elements else np.arange( N - offset )
+            J = (I + offset) % N  # N cyclizes
+            for update_func in self.update_funcs: update_func( self, I, J, offset )
+
+        for i in ( range( N ) if self.calc_all_elements else [ 0 ] ): update_Z_final( self, i )
+
+        self.Z = self.Z_final[ :, 0 ].copy()
+        self.dG = np.array( [ -KT_IN_KCAL * np.log( Z ) if Z > 0.0 else np.nan for Z in self.Z ] )
+        self.log_derivs = self.get_log_derivs( self.deriv_params )
+
+    # boring member functions -- defined later.
+    def get_bpp_matrix( self ): _get_bpp_matrix( self ) # fill base pair probability matrix
+    def get_log_derivs( self, deriv_params ): return _get_log_derivs_batch( self, deriv_params )
+    def show_results( self ): _show_results_batch( self )
+    def run_cross_checks( self ): _run_cross_checks_batch( self )
+
+##################################################################################################
+def initialize_batch_sequence_information( self ):
+    '''
+    Sequence information for each distinct sequence in the batch, padded to common length N:
+
+    sequences  = padded, concatenated sequences (list of strings of length N)
+    lengths    = unpadded length of each sequence
+    ligated    = Bs x N array, 1.0 if not a cut ('nick','chainbreak')
+    match      = Bs x T x N x N array, 1.0 if nucleotides at i and j can form base pair type q
+    allow_pair = match, after excluding base pairs that would close too-short apical loops
+    '''
+    sequences, ligated_list = [], []
+    for sequences_in in self.sequences_list:
+        sequence, ligated, parsed_sequences = initialize_sequence_and_ligated( sequences_in, self.circle )
+        sequences.append( sequence )
+        ligated_list.append( ligated )
+    self.lengths = [ len( sequence ) for sequence in sequences ]
+    self.N = N = max( self.lengths )
+    if self.circle: assert( min( self.lengths ) == N ) # cannot pad circles without changing loops
+    for n, L in enumerate( self.lengths ):
+        if L == N: continue
+        # last strand is extended by unpaired nucleotides
+        sequences[ n ] += PAD_CHARACTER * ( N - L )
+        ligated_list[ n ] = ligated_list[ n ][ :-1 ] + [ True ] * ( N - L ) + [ False ]
+    self.sequences = sequences
+    self.ligated = np.array( ligated_list, dtype = float )
+
+    base_pair_types = self.params.base_pair_types
+    T = len( base_pair_types )
+    self.match      = np.zeros( ( len( sequences ), T, N, N ) )
+    self.allow_pair = np.zeros( ( len( sequences ), T, N, N ) )
+    min_loop_length = self.params.min_loop_length
+    offset = ( np.arange( N )[None,:] - np.arange( N )[:,None] ) % N
+    for n, sequence in enumerate( sequences ):
+        # lookup table over sequence characters, rather than calling is_match N^2 times.
+        characters = sorted( set( sequence ) )
+        s = np.array( [ characters.index( c ) for c in sequence ] )
+        for q, base_pair_type in enumerate( base_pair_types ):
+            is_match = np.array( [ [ base_pair_type.is_match( c1, c2 ) for c2 in characters ] for c1 in characters ], dtype = float )
+            self.match[ n, q ] = is_match[ s[:,None], s[None,:] ]
+        # minimum loop length -- no other way to penalize short segments.
+        all_ligated = initialize_all_ligated( ligated_list[ n ] )
+        all_ligated = np.array( [ [ all_ligated[ i ][ j ] for j in range( N ) ] for i in range( N ) ] )
+        too_short = ( all_ligated & ( (offset - 1) % N < min_loop_length ) ) | ( all_ligated.T & ( (-offset - 1) % N < min_loop_length ) )
+        too_short |= np.eye( N, dtype = bool )
+        self.allow_pair[ n ] = self.match[ n ] * ( ~too_short )
+
+##################################################################################################
+def initialize_batch_parameters( self ):
+    '''
+    Energy parameters for each parameter set in the batch:
+       C_init, l, l_BP, K_coax, l_coax, C_std = Bp x 1 arrays (to broadcast against B x n)
+       Kd          = Bp x T array
+       C_eff_stack = Bp x T x T array
+       flipped     = index of flipped base pair type, for each q
+    Base pair types are matched up by tag across parameter sets.
+    '''
+    base_pair_types = self.params.base_pair_types
+    tags = [ base_pair_type.get_tag() for base_pair_type in base_pair_types ]
+    self.flipped = np.array( [ base_pair_types.index( base_pair_type.flipped ) for base_pair_type in base_pair_types ] )
+    for tag in [ 'C_init', 'l', 'l_BP', 'K_coax', 'l_coax', 'C_std' ]:
+        setattr( self, tag, np.array( [ [ getattr( params, tag ) ] for params in self.params_list ] ) )
+    self.Kd          = np.zeros( ( len( self.params_list ), len( tags ) ) )
+    self.C_eff_stack = np.zeros( ( len( self.params_list ), len( tags ), len( tags ) ) )
+    for n, params in enumerate( self.params_list ):
+        params.check_C_eff_stack()
+        assert( params.min_loop_length    == self.params.min_loop_length )
+        assert( params.allow_strained_3WJ == self.params.allow_strained_3WJ )
+        index = [ q for tag in tags for ( q, bpt ) in enumerate( params.base_pair_types ) if bpt.get_tag() == tag ]
+        assert( len( index ) == len( tags ) and len( params.base_pair_types ) == len( tags ) )
+        self.Kd[ n ] = get_Kd_array( params )[ index ]
+        self.C_eff_stack[ n ] = get_C_eff_stack_table( params )[ np.ix_( index, index ) ]
+    self.min_loop_length    = self.params.min_loop_length
+    self.allow_strained_3WJ = self.params.allow_strained_3WJ
+    self.coax = np.any( self.K_coax > 0.0 )
+
+##################################################################################################
+def initialize_batch_dynamic_programming_matrices( self ):
+    '''
+    B x N x N zero matrices (B x T x N x N for Z_BPq), with the same diagonal initialization as in Partition:
+         C_eff(i,i)    = C_init (units of M)
+         Z_linear(i,i) = 1
+    And: the order in update_funcs determines the order of updates on each anti-diagonal.
+    '''
+    B, N, T = self.B, self.N, len( self.params.base_pair_types )
+    self.Z_cut  = np.zeros( ( B, N, N ) )
+    self.Z_BPq  = np.zeros( ( B, T, N, N ) )
+    self.Z_BP   = np.zeros( ( B, N, N ) )
+    self.Z_coax = np.zeros( ( B, N, N ) )
+
+    diagonal = np.eye( N )[ None, :, : ]
+    self.C_eff_basic           = diagonal * self.C_init[ :, :, None ] * np.ones( ( B, 1, 1 ) )
+    self.C_eff_no_BP_singlet   = self.C_eff_basic.copy()
+    self.C_eff_no_coax_singlet = self.C_eff_basic.copy()
+    self.C_eff                 = self.C_eff_basic.copy()
+
+    self.Z_linear = diagonal * np.ones( ( B, 1, 1 ) )
+    self.Z_final  = np.zeros( ( B, N ) )
+
+    self.update_funcs = [ update_Z_cut, update_Z_BPq, update_Z_BP, update_Z_coax, update_C_eff_basic,
+                          update_C_eff_no_BP_singlet, update_C_eff_no_coax_singlet, update_C_eff, update_Z_linear ]
+
+##################################################################################################
+def _get_bpp_matrix( self ):
+    '''
+    bpp(i,j) = sum over base pair types of Z_BPq(i,j) * Z_BPq_flipped(j,i) * Kd / Z, for all members of batch at once
+    '''
+    assert( self.calc_all_elements )
+    Z_BPq_flipped = np.transpose( self.Z_BPq[ :, self.flipped ], ( 0, 1, 3, 2 ) )
+    self.bpp = np.sum( self.Z_BPq * Z_BPq_flipped * self.Kd[ :, :, None, None ], axis = 1 ) / self.Z[ :, None, None ]
+
+def _get_log_derivs_batch( self, deriv_params ):
+    '''
+    d( log Z )/ d( log parameter ) for all members of batch at once, with the same
+    code as for Partition -- DerivativeArrays sums over the B x N x N batch matrices directly.
+    '''
+    if deriv_params == None: return None
+    if deriv_params == []: deriv_params += self.params.parameter_tags
+    log_derivs = get_log_derivs_from_arrays( DerivativeArrays( self ), deriv_params )
+    return np.array( [ ( np.nan if log_deriv is None else log_deriv ) * np.ones( self.B ) for log_deriv in log_derivs ] ).T
+
+##################################################################################################
+def _show_results_batch( self ):
+    for b in range( self.B ):
+        sequence = self.sequences[ b if len( self.sequences ) > 1 else 0 ]
+        params   = self.params_list[ b if len( self.params_list ) > 1 else 0 ]
+        print( '%-40s %-16s Z = %15.6g  dG = %10.4f' % ( sequence.rstrip( PAD_CHARACTER ), getattr( params, 'name', '' ) + ' ' + getattr( params, 'version', '' ), self.Z[ b ], self.dG[ b ] ) )
+    print()
+
+def _run_cross_checks_batch( self ):
+    # all the Z(i,i) agree for each member of the batch.
+    if self.calc_all_elements:
+        for b in range( self.B ):
+            for i in range( self.N ): assert_equal( self.Z_final[ b, 0 ], self.Z_final[ b, i ] )
@@ -0,0 +1,270 @@
+from __future__ import print_function
+import gc
+import inspect
+import random
+import sys
+import time
+import numpy as np
+from .partition import partition, Partition, get_max_product_partition
+from .parameters import get_params_snapshot
+from .recursions.semiring import get_semiring
+from .util.sequence_util import initialize_sequence_and_ligated
+from .util.memory_util import get_object_bytes
+
+##################################################################################################
+# Runtime and memory cost model for partition(), for scheduling folds.
+#
+# Each phase of partition() -- the dynamic programming fill, bpp, log-derivatives, the max-product
+#  fill for MFE, stochastic and enumerative backtracking -- is timed on short sequences on the current
+#  host. Time is fit to a power law in N, and memory to a quadratic in N; enumeration instead scales
+#  with the number of structures. Calibrations are cached for the life of the process.
+##################################################################################################
+calibration_lengths  = [ 16, 24, 32, 40 ]
+enumeration_lengths  = [ 6, 8, 10, 12 ]
+calibration_stochastic_samples = 20
+cost_calibrations = {}
+
+def estimate_cost( sequences, **partition_options ):
+    '''
+    Predicted wall-clock time and peak memory of
+
+        partition( sequences, **partition_options )
+
+    without running it. Options are the same as for partition(), and unknown options raise TypeError.
+
+    The first estimate for a given parameter set and combination of options runs a short
+     micro-benchmark on this host (well under a second for the default explicit recursions).
+
+    Returns CostEstimate object c with
+      c.seconds       = predicted wall-clock time
+      c.peak_bytes    = predicted peak memory allocated by the fold (not counting the Python interpreter)
+      c.phase_seconds = breakdown of c.seconds by phase ('fill','bpp','derivs','mfe','stochastic',...)
+      c.phase_bytes   = breakdown of c.peak_bytes by phase
+    '''
+    options = get_partition_options( partition_options )
+    params = options[ 'params' ]
+    if isinstance(params,str): params = get_params_snapshot( params, suppress_all_output = True )
+    params = params.get_snapshot( K_coax = 0.0 ) if options[ 'no_coax' ] else params.get_snapshot()
+    options[ 'params' ] = params
+
+    sequence, ligated, sequences = initialize_sequence_and_ligated( sequences, options[ 'circle' ] )
+    N = len( sequence )
+    calibration = get_cost_calibration( params, options, sequence, len( sequences ) )
+
+    cost = CostEstimate( N )
+    calc_all_elements = options[ 'calc_bpp' ] or ( options[ 'deriv_params' ] != None )
+    cost.add_phase( 'fill', calibration.get_phase( 'fill', calc_all_elements = calc_all_elements ), N )
+    if options[ 'calc_bpp' ]:
+        cost.add_phase( 'bpp', calibration.get_phase( 'bpp' ), N )
+    if options[ 'deriv_params' ] != None:
+        cost.add_phase( 'derivs', calibration.get_phase( 'derivs', deriv_params = tuple( options[ 'deriv_params' ] ) ), N )
+    if options[ 'mfe' ]:
+        cost.add_phase( 'mfe', calibration.get_phase( 'mfe', calc_all_elements = calc_all_elements ), N, transient = True )
+    if options[ 'n_stochastic' ] > 0:
+        cost.add_phase( 'stochastic', calibration.get_phase( 'stochastic' ), N, scale_seconds = options[ 'n_stochastic' ] )
+    if options[ 'do_enumeration' ]:
+        # enumeration is exponential in N -- its cost follows the number of states it lists, which comes from
+        #  a fill in the counting_states semiring.
+        num_structures = partition( sequences, circle = options[ 'circle' ], params = params, semiring = 'counting_states', suppress_all_output = True ).Z
+        cost.add_phase( 'enumeration', calibration.get_phase( 'enumeration' ), N, num_structures = num_structures )
+    if options[ 'deriv_check' ] and options[ 'deriv_params' ]:
+        # numerical derivatives refold once per parameter, plus once more to check Z.
+        cost.add_phase( 'deriv_check', calibration.get_phase( 'fill', calc_all_elements = False ), N, scale_seconds = len( options[ 'deriv_params' ] ) + 1, transient = True )
+
+    return cost
+
+def get_partition_options( partition_options ):
+    '''
+    Keyword arguments of partition(), with defaults filled in.
+    '''
+    argspec = inspect.getargspec( partition )
+    options = dict( zip( argspec.args[ -len( argspec.defaults ): ], argspec.defaults ) )
+    for option in partition_options:
+        if option not in options:
+            raise TypeError( "estimate_cost() got an unexpected keyword argument '%s'" % option )
+    options.update( partition_options )
+    if options[ 'deriv_params' ] == []: options[ 'deriv_params' ] = get_deriv_params_all( options[ 'params' ] )
+    return options
+
+def get_deriv_params_all( params ):
+    if isinstance(params,str): params = get_params_snapshot( params, suppress_all_output = True )
+    return list( params.parameter_tags )
+
+##################################################################################################
+class CostEstimate:
+    '''
+    Predicted seconds and peak bytes of a fold of length N, built up phase by phase.
+    '''
+    def __init__( self, N ):
+        self.N = N
+        self.seconds = 0.0
+        self.peak_bytes = 0
+        self.phase_seconds = {}
+        self.phase_bytes = {}
+        self.persistent_bytes = 0
+        self.transient_bytes = 0
+
+    def add_phase( self, name, phase, N, scale_seconds = 1.0, num_structures = None, transient = False ):
+        '''
+        transient = memory of this phase is released when it finishes (e.g., the max-product matrices for MFE).
+        '''
+        seconds = scale_seconds * phase.predict_seconds( N, num_structures )
+        num_bytes = int( phase.predict_bytes( N, num_structures ) )
+        self.phase_seconds[ name ] = seconds
+        self.phase_bytes[ name ] = num_bytes
+        self.seconds += seconds
+        if transient: self.transient_bytes = max( self.transient_bytes, num_bytes )
+        else: self.persistent_bytes += num_bytes
+        self.peak_bytes = self.persistent_bytes + self.transient_bytes
+
+    def show_results( self ):
+        print( 'Predicted cost for N = %d:' % self.N )
+        print( '%15s %15s %15s' % ( 'phase', 'seconds', 'bytes' ) )
+        for name in sorted( self.phase_seconds.keys() ):
+            print( '%15s %15.6f %15d' % ( name, self.phase_seconds[ name ], self.phase_bytes[ name ] ) )
+        print( '%15s %15.6f %15d' % ( 'total (peak)', self.seconds, self.peak_bytes ) )
+        print()
+
+##################################################################################################
+def get_cost_calibration( params, options, sequence, num_strands ):
+    '''
+    Calibrations are shared by all folds with the same parameter values, alphabet, number of strands,
+     and options that change the work done per cell of the dynamic programming matrices.
+    '''
+    alphabet = ''.join( sorted( set( sequence ) ) )
+    key = ( tuple( params.parameter_tags ), tuple( params.parameter_values ), params.K_coax > 0.0, alphabet, num_strands, options[ 'circle' ],
+            options[ 'use_simple_recursions' ], options[ 'calc_Kd_deriv_DP' ], get_semiring( options[ 'semiring' ] ).name )
+    if key not in cost_calibrations: cost_calibrations[ key ] = CostCalibration( params, options, alphabet, num_strands )
+    return cost_calibrations[ key ]
+
+class CostCalibration:
+    '''
+    Micro-benchmarks on this host for one combination of parameters and options. Phases are only
+     benchmarked when first needed.
+    '''
+    def __init__( self, params, options, alphabet, num_strands ):
+        self.params = params
+        self.options = options
+        self.alphabet = alphabet
+        self.num_strands = num_strands
+        self.phases = {}
+
+    def get_phase( self, name, **phase_options ):
+        key = ( name, tuple( sorted( phase_options.items() ) ) )
+        if key not in self.phases: self.phases[ key ] = benchmark_phase( self, name, **phase_options )
+        return self.phases[ key ]
+
+    def get_sequences( self, N ):
+        '''
+        Reproducible random sequence of length N drawn from the alphabet of the fold, split into the same number of strands
+        '''
+        rng = random.Random( N )
+        sequence = ''.join( rng.choice( self.alphabet ) for i in range( N ) )
+        num_strands = max( 1, min( self.num_strands, N // 3 ) )
+        cuts = [ ( n * N ) // num_strands for n in range( num_strands + 1 ) ]
+        return [ sequence[ cuts[n] : cuts[n+1] ] for n in range( num_strands ) ]
+
+    def get_partition( self, N, calc_all_elements ):
+        p = Partition( self.get_sequences( N ), self.params )
+        p.options.semiring = get_semiring( self.options[ 'semiring' ] )
+        p.options.calc_deriv_DP = self.options[ 'calc_Kd_deriv_DP' ]
+        p.calc_all_elements = calc_all_elements
+        p.use_simple_recursions = self.options[ 'use_simple_recursions' ]
+        p.circle = self.options[ 'circle' ]
+        p.suppress_all_output = True
+        return p
+
+class CostPhase:
+    '''
+    seconds = a * size^b, with size = N (or number of structures x N for enumeration), and
+    bytes   = non-negative linear combination of [ N^2, N, 1 ] (or [ size, 1 ]).
+    A free exponent b takes care of inner loops that are cut short by ligation or pairing
+     checks at small N, and of the extra cost of bookkeeping in the simple recursions.
+    '''
+    def __init__( self, get_size, seconds_power_law, bytes_coeffs ):
+        self.get_size = get_size
+        self.seconds_power_law = seconds_power_law
+        self.bytes_coeffs = bytes_coeffs
+
+    def predict_seconds( self, N, num_structures = None ):
+        (a, b) = self.seconds_power_law
+        return a * self.get_size( N, num_structures ) ** b
+
+    def predict_bytes( self, N, num_structures = None ):
+        return np.dot( self.bytes_coeffs, get_memory_features( self.get_size( N, num_structures ), num_structures ) )
+
+def get_size( N, num_structures = None ):
+    if num_structures != None: return float( num_structures * N )
+    return float( N )
+
+def get_memory_features( size, num_structures = None ):
+    if num_structures != None: return [ size, 1.0 ]
+    return [ size * size, size, 1.0 ]
+
+##################################################################################################
+def benchmark_phase( calibration, name, calc_all_elements = False, deriv_params = None ):
+    '''
+    Time each phase of partition() on short sequences, and measure the memory it holds onto.
+    '''
+    sizes, seconds, num_bytes = [], [], []
+    stdout = sys.stdout
+    sys.stdout = NullOutput() # backtracking prints structures.
+    try:
+        for N in ( enumeration_lengths if name == 'enumeration' else calibration_lengths ):
+            p = calibration.get_partition( N, calc_all_elements or name in ( 'bpp', 'derivs', 'stochastic', 'enumeration' ) )
+            gc.collect()
+            start_time = time.time()
+            p.run()
+            fill_seconds = time.time() - start_time
+            num_structures = None
+            start_bytes = get_object_bytes( p )
+            gc.collect()
+            start_time = time.time()
+            if   name == 'fill':   pass
+            elif name == 'bpp':    p.get_bpp_matrix()
+            elif name == 'derivs': p.get_log_derivs( list( deriv_params ) )
+            elif name == 'mfe':    p = get_max_product_partition( p )
+            elif name == 'stochastic': p.stochastic_backtrack( calibration_stochastic_samples )
+            elif name == 'enumeration':
+                num_structures = partition( p.sequences, circle = p.circle, params = p.params, semiring = 'counting_states', suppress_all_output = True ).Z
+                start_time = time.time()
+                p.enumerative_backtrack()
+            phase_seconds = time.time() - start_time
+            if name == 'fill': (phase_seconds, start_bytes) = (fill_seconds, 0)
+            if name == 'mfe': start_bytes = 0 # a whole new Partition.
+            if name == 'stochastic': phase_seconds /= calibration_stochastic_samples
+            sizes.append( get_size( N, num_structures ) )
+            seconds.append( phase_seconds )
+            num_bytes.append( max( get_object_bytes( p ) - start_bytes, 0 ) )
+    finally:
+        sys.stdout = stdout
+    memory_features = [ get_memory_features( size, num_structures ) for size in sizes ]
+    return CostPhase( get_size, fit_power_law( sizes, seconds ), fit_non_negative( memory_features, num_bytes ) )
+
+def fit_power_law( x, y ):
+    '''
+    Least squares fit of log y ~ log a + b log x. Returns (a, b).
+    '''
+    y = np.maximum( np.array( y, dtype = float ), 1.0e-6 ) # timer resolution
+    (b, log_a) = np.polyfit( np.log( x ), np.log( y ), 1 )
+    return ( np.exp( log_a ), max( b, 0.0 ) )
+
+def fit_non_negative( X, y ):
+    '''
+    Least squares fit y ~ X c with c >= 0, by dropping the most negative coefficient until none are left.
+    '''
+    X = np.array( X, dtype = float )
+    y = np.array( y, dtype = float )
+    active = list( range( X.shape[1] ) )
+    coeffs = np.zeros( X.shape[1] )
+    while len( active ) > 0:
+        c = np.linalg.lstsq( X[:, active], y, rcond = None )[0]
+        if np.all( c >= 0.0 ):
+            coeffs[ active ] = c
+            break
+        active.pop( int( np.argmin( c ) ) )
+    return coeffs
+
+class NullOutput:
+    def write( self, s ): pass
+    def flush( self ): pass
@@ -1,4 +1,6 @@
 from .base_pair_types import get_base_pair_type_for_tag, get_base_pair_types_for_tag
+from .parameters import get_C_eff_stack_table
+import numpy as np
 
 def _get_log_derivs( self, deriv_parameters = [] ):
     '''
@@ -7,181 +9,263 @@ def _get_log_derivs( self, deriv_parameters = [] ):
        d( log Z )/ d( log parameter )
 
     using simple expressions that require O( N^2 ) time or less after
-    the original O( N^3 ) dynamic programming calculations
+    the original O( N^3 ) dynamic programming calculations.
+
+    All parameters are read off the same arrays (see DerivativeArrays below) -- the filled matrices are
+     copied into NumPy once, and products shared by several parameters are computed once.
     '''
     if deriv_parameters == None: return None
     if deriv_parameters == []:
         for tag in self.params.parameter_tags: deriv_parameters.append( tag )
+    return [ None if log_derivs is None else float( log_derivs[ 0 ] ) for log_derivs in get_log_derivs_from_arrays( DerivativeArrays( self ), deriv_parameters ) ]
 
+def get_log_derivs_from_arrays( arrays, deriv_parameters ):
+    '''
+    d( log Z )/ d( log parameter ) for each of deriv_parameters, as arrays over the batch axis of DerivativeArrays arrays.
+    '''
+    params = arrays.params
     derivs = [None]*len(deriv_parameters)
-
-    # Derivatives with respect to each Kd
-    N = self.N
-    Z = self.Z_final.val( 0 )
     for n,parameter in enumerate(deriv_parameters):
         if parameter == 'l':
             # Derivatives with respect to loop closure parameters
-            num_internal_linkages = 0.0
-            for i in range( N ):
-                if not self.ligated[i]: continue
-                num_internal_linkages += self.params.l * self.C_eff_no_coax_singlet.val( i+1, i ) / self.params.C_std / Z
-            derivs[ n ] = num_internal_linkages
+            derivs[ n ] = arrays.get_num_internal_linkages()
         elif parameter == 'l_BP':
-            derivs[ n ] = get_num_base_pairs_closed_by_loops( self )
+            derivs[ n ] = arrays.get_num_base_pairs_closed_by_loops()
         elif parameter == 'C_init':
-            num_loops = 0.0
-            # first count up loops closed by base pairs (i,j), i < j
-            for i in range( N ):
-                for j in range( i+2, N ):
-                    if not self.ligated[i]: continue
-                    if not self.ligated[j-1]: continue
-                    num_loops += self.params.l**2 * self.params.l_BP * self.C_eff.val(i+1,j-1) * self.Z_BP.val(j,i) / self.Z_final.val(0)
-            # one more loop if RNA is a circle.
-            if self.ligated[ N-1 ]: num_loops += 1
-            derivs[ n ] = num_loops
+            derivs[ n ] = arrays.get_num_closed_loops()
         elif len(parameter)>=2 and  parameter[:2] == 'Kd':
             if parameter == 'Kd':
                 # currently can only handle case where Kd controls *all* of the base pair types
-                for base_pair_type in self.params.base_pair_types: assert( base_pair_type.Kd == self.params.base_pair_types[0].Kd )
-                derivs[ n ] = - get_bpp_tot( self )
+                assert( np.all( arrays.Kd == arrays.Kd[ :, :1 ] ) )
+                derivs[ n ] = - arrays.get_bpp_tot()
             else:
                 Kd_tag = parameter[3:]
-                derivs[ n ] = - get_bpp_tot_for_base_pair_type( self, get_base_pair_type_for_tag( self.params, Kd_tag ) )
+                derivs[ n ] = - arrays.get_bpp_tot_for_base_pair_type( get_base_pair_type_for_tag( params, Kd_tag ) )
         elif len(parameter)>=11 and parameter[:11] == 'C_eff_stack':
             # Derivatives with respect to motifs (stacked pairs first)
             if parameter == 'C_eff_stacked_pair':
-                bpts1 = self.params.base_pair_types
-                bpts2 = self.params.base_pair_types
+                bpts1 = params.base_pair_types
+                bpts2 = params.base_pair_types
             else:
                 assert( len(parameter) > 11 )
                 tags = parameter[12:].split('_')
                 assert( len( tags ) == 2 )
-                bpts1 = get_base_pair_types_for_tag( self.params, tags[0] )
-                bpts2 = get_base_pair_types_for_tag( self.params, tags[1] )
-            derivs[ n ] = 0.0
-            motif_types_computed = []
-            for bpt1 in bpts1:
-                for bpt2 in bpts2:
-                    if (bpt1, bpt2) in motif_types_computed: continue
-                    derivs[ n ] += get_motif_prob( self, bpt1, bpt2 )
-                    motif_types_computed.append( (bpt1, bpt2 ) )
-                    motif_types_computed.append( (bpt2.flipped, bpt1.flipped ) ) # prevents overcounting
+                bpts1 = get_base_pair_types_for_tag( params, tags[0] )
+                bpts2 = get_base_pair_types_for_tag( params, tags[1] )
+            derivs[ n ] = arrays.get_stacked_pair_prob( bpts1, bpts2 )
         elif parameter == 'K_coax':
-            coax_prob = get_coax_prob( self )
-            derivs[ n ] = coax_prob
+            derivs[ n ] = arrays.get_coax_prob()
         elif parameter == 'l_coax':
-            coax_prob = get_loop_closed_coax_prob( self )
-            coax_prob = 0.0
-            C_eff_for_coax = self.C_eff if self.params.allow_strained_3WJ else self.C_eff_no_BP_singlet
-            for i in range( N ):
-                for j in range( N ):
-                    if ( i - j ) % N < 2: continue
-                    if not self.ligated[ i-1 ]: continue
-                    if not self.ligated[ j ]: continue
-                    coax_prob += self.Z_coax.val(i,j) * self.params.l_coax * self.params.l**2 * C_eff_for_coax.val(j+1,i-1) / Z
-            derivs[ n ] = coax_prob
+            derivs[ n ] = arrays.get_loop_closed_coax_prob()
         else:
             print "Did not recognize parameter ", parameter
             pass
 
     return derivs
 
-def get_bpp_tot_for_base_pair_type( self, base_pair_type ):
-    assert( self.calc_all_elements )
-    bpp = 0.0
-    N = self.N
-    for i in range( N ):
-        for j in range( N ):
-            if self.Z_BPq[base_pair_type].val(i,j) == 0: continue
-            bpp += self.Z_BPq[base_pair_type].val(i,j) * self.Z_BPq[base_pair_type.flipped].val(j,i) * base_pair_type.Kd / self.Z_final.val(0)
-    return bpp
-
-def get_bpp_tot( self ):
-    bpp_tot = []
-    for base_pair_type in self.params.base_pair_types: bpp_tot.append( get_bpp_tot_for_base_pair_type( self, base_pair_type ) )
-    return sum( bpp_tot ) / 2.0
-
-def get_num_base_pairs_closed_by_loops( self ):
-    # base pair forms a stacked pair with previous pair
-    #
-    #     ~~~~~
-    #  i+1     j-1
-    #    |     |
-    #    i ... j
-    #      bp1
-    #
-    num_base_pairs_closed_by_loops = 0.0
-    N = self.N
-    # this is slightly different than num_closed_loops for C_init -- each base pair is counted
-    # if it closes a loop in either direction (i<j) vs. (i>j)
-    for i in range( N ):
-        for j in range( N ):
-            if ( j - i ) % N < 2: continue
-            if not self.ligated[i]: continue
-            if not self.ligated[(j-1)%N]: continue
-            num_base_pairs_closed_by_loops += self.params.l**2 * self.params.l_BP * self.C_eff.val(i+1,j-1) * self.Z_BP.val(j,i) / self.Z_final.val(0)
-    return num_base_pairs_closed_by_loops
-
-def get_motif_prob( self, base_pair_type, base_pair_type2 ):
-    # base pair forms a stacked pair with previous pair
-    #
-    #      bp2
-    #  i+1 ... j-1
-    #    |     |
-    #    i ... j
-    #      bp1
-    #
-    motif_prob = 0.0
-    Z_BPq1 = self.Z_BPq[base_pair_type.flipped]
-    Z_BPq2 = self.Z_BPq[base_pair_type2]
-    N = self.N
-    for i in range( N ):
-        for j in range( N ):
-            if ( j - i ) % N < 3: continue
-            if not self.ligated[i]: continue
-            if not self.ligated[(j-1)%N]: continue
-            if not base_pair_type.flipped.is_match( self.sequence[j],self.sequence[i] ): continue
-            if not base_pair_type2       .is_match( self.sequence[(i+1)%N],self.sequence[(j-1)%N] ): continue
-            motif_prob += self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BPq1.val(j,i) * Z_BPq2.val(i+1,j-1) / self.Z_final.val(0)
-    if base_pair_type == base_pair_type2.flipped: motif_prob /= 2.0 # symmetry correction
-    return motif_prob
-
-def get_loop_closed_coax_prob( self ):
-    # If the two coaxially stacked base pairs are connected by a loop.
-    #
-    #       ~~~~
-    #   -- j    i --
-    #  /   :    :   \
-    #  \   :    :   /
-    #   ------------
-    #
-    coax_prob = 0.0
-    C_eff_for_coax = self.C_eff if self.params.allow_strained_3WJ else self.C_eff_no_BP_singlet
-    N = self.N
-    for i in range( N ):
-        for j in range( N ):
-            if ( i - j ) % N < 2: continue
-            if not self.ligated[ i-1 ]: continue
-            if not self.ligated[ j ]: continue
-            coax_prob += self.Z_coax.val(i,j) * self.params.l_coax * self.params.l**2 * C_eff_for_coax.val(j+1,i-1) / self.Z_final.val(0)
-    return coax_prob
-
-def get_loop_open_coax_prob( self ):
-    # If the two stacked base pairs are in split segments
-    #
-    #      \    /
-    #   -- j    i --
-    #  /   :    :   \
-    #  \   :    :   /
-    #   ------------
-    #
-    coax_prob = 0.0
-    N = self.N
-    for i in range( N ):
-        for j in range( N ):
-            coax_prob += self.Z_coax.val(i,j) * self.Z_cut.val(j,i) / self.Z_final.val(0)
-    return coax_prob
-
-def get_coax_prob( self ):
-    return get_loop_closed_coax_prob( self ) + get_loop_open_coax_prob( self )
+##################################################################################################
+class DerivativeArrays:
+    '''
+    Filled matrices as B x N x N NumPy arrays, and the products that log derivatives are sums over, each
+     computed the first time a parameter needs it. Array [b,i,j] holds the term for (i,j) of member b;
+     masks zero out (i,j) that the recursions skip (too short, or across a chainbreak). Every sum is an array over b.
+    B = 1 for a Partition (either set of recursions). For a BatchPartition (batch_partition.py), the batch
+     matrices are used as they are, so the whole batch is done with the same NumPy operations as one Partition.
+    Sequence information and parameters have leading axis B or 1, as in batch_recursions.py.
+    '''
+    def __init__( self, partition ):
+        self.partition = partition
+        self.params = partition.params
+        self.base_pair_types = partition.params.base_pair_types
+        self.N = N = partition.N
+        self.calc_all_elements = partition.calc_all_elements
+        self.batch = isinstance( partition.Z_final, np.ndarray )
+        if self.batch:
+            self.Z = partition.Z_final[ :, 0 ]
+            self.ligated = ( partition.ligated > 0.0 )
+            for tag in [ 'l', 'l_BP', 'l_coax', 'C_std' ]: setattr( self, tag, getattr( partition, tag )[ :, :, None ] )
+            ( self.Kd, self.C_eff_stack ) = ( partition.Kd, partition.C_eff_stack )
+        else:
+            self.Z = np.array( [ partition.Z_final.val( 0 ) ] )
+            self.ligated = np.array( [ [ bool( partition.ligated[ i ] ) for i in range( N ) ] ], dtype = bool )
+            for tag in [ 'l', 'l_BP', 'l_coax', 'C_std' ]: setattr( self, tag, np.array( [ [ [ getattr( self.params, tag ) ] ] ] ) )
+            ( self.Kd, self.C_eff_stack ) = ( np.array( [ [ bpt.Kd for bpt in self.base_pair_types ] ] ), get_C_eff_stack_table( self.params )[ None ] )
+        self.Z_ = self.Z[ :, None, None ]
+        positions = np.arange( N )
+        self.offset = ( positions[ None, : ] - positions[ :, None ] ) % N # (j - i) % N
+        self.arrays = {}
+
+    def get_array( self, name ):
+        if name not in self.arrays:
+            DP = getattr( self.partition, name )
+            self.arrays[ name ] = DP if self.batch else get_Q_array( DP )[ None ]
+        return self.arrays[ name ]
+
+    def get_Z_BPq( self, base_pair_type ):
+        q = self.base_pair_types.index( base_pair_type )
+        if self.batch: return self.partition.Z_BPq[ :, q ]
+        return self.get_array_for( 'Z_BPq_' + base_pair_type.get_tag(), lambda: get_Q_array( self.partition.Z_BPq[ base_pair_type ] )[ None ] )
+
+    def get_array_for( self, name, compute ):
+        if name not in self.arrays: self.arrays[ name ] = compute()
+        return self.arrays[ name ]
+
+    def get_match( self, base_pair_type ):
+        '''
+        match[b,i,j] = base_pair_type.is_match( sequence[i], sequence[j] ), from a table over the letters in the sequence.
+        '''
+        if self.batch: return ( self.partition.match[ :, self.base_pair_types.index( base_pair_type ) ] > 0.0 )
+        name = 'match_' + base_pair_type.get_tag()
+        if name not in self.arrays:
+            sequence = [ self.partition.sequence[ i ] for i in range( self.N ) ]
+            letters = sorted( set( sequence ) )
+            table = np.array( [ [ base_pair_type.is_match( a, b ) for b in letters ] for a in letters ], dtype = bool ).reshape( ( len( letters ), len( letters ) ) )
+            codes = np.array( [ letters.index( a ) for a in sequence ], dtype = int )
+            self.arrays[ name ] = table[ codes[ :, None ], codes[ None, : ] ][ None ]
+        return self.arrays[ name ]
+
+    def get_closed_loops( self ):
+        '''
+        [b,i,j] = probability that base pair (j,i) closes a loop from i to j:  l^2 l_BP C_eff(i+1,j-1) Z_BP(j,i) / Z
+        '''
+        if 'closed_loops' not in self.arrays:
+            mask = ( self.offset >= 2 ) & self.ligated[ :, :, None ] & np.roll( self.ligated, 1, axis = 1 )[ :, None, : ] # ligated[ j-1 ]
+            with np.errstate( all = 'ignore' ):
+                terms = self.l**2 * self.l_BP * shift( self.get_array( 'C_eff' ), 1, -1 ) * transpose( self.get_array( 'Z_BP' ) ) / self.Z_
+            self.arrays[ 'closed_loops' ] = np.where( mask, terms, 0.0 )
+        return self.arrays[ 'closed_loops' ]
+
+    def get_num_base_pairs_closed_by_loops( self ):
+        # base pair forms a stacked pair with previous pair
+        #
+        #     ~~~~~
+        #  i+1     j-1
+        #    |     |
+        #    i ... j
+        #      bp1
+        #
+        # this is slightly different than num_closed_loops for C_init -- each base pair is counted
+        # if it closes a loop in either direction (i<j) vs. (i>j)
+        return self.get_closed_loops().sum( axis = ( 1, 2 ) )
+
+    def get_num_closed_loops( self ):
+        # first count up loops closed by base pairs (i,j), i < j
+        num_loops = np.triu( self.get_closed_loops(), 2 ).sum( axis = ( 1, 2 ) )
+        # one more loop if RNA is a circle.
+        return num_loops + self.ligated[ :, self.N-1 ]
+
+    def get_num_internal_linkages( self ):
+        positions = np.arange( self.N )
+        C_eff_no_coax_singlet = self.get_array( 'C_eff_no_coax_singlet' )
+        linkages = self.l[ :, :, 0 ] * C_eff_no_coax_singlet[ :, ( positions + 1 ) % self.N, positions ] / self.C_std[ :, :, 0 ] / self.Z[ :, None ]
+        return np.where( self.ligated, linkages, 0.0 ).sum( axis = 1 )
 
+    def get_bpp( self, base_pair_type ):
+        '''
+        [b,i,j] = probability of base pair (i,j) of base_pair_type:  Z_BPq(i,j) Z_BPq_flipped(j,i) Kd / Z
+        '''
+        name = 'bpp_' + base_pair_type.get_tag()
+        if name not in self.arrays:
+            Z_BPq = self.get_Z_BPq( base_pair_type )
+            Kd = self.Kd[ :, self.base_pair_types.index( base_pair_type ) ][ :, None, None ]
+            with np.errstate( all = 'ignore' ):
+                terms = Z_BPq * transpose( self.get_Z_BPq( base_pair_type.flipped ) ) * Kd / self.Z_
+            self.arrays[ name ] = np.where( Z_BPq != 0.0, terms, 0.0 )
+        return self.arrays[ name ]
+
+    def get_bpp_tot_for_base_pair_type( self, base_pair_type ):
+        assert( self.calc_all_elements )
+        return self.get_bpp( base_pair_type ).sum( axis = ( 1, 2 ) )
+
+    def get_bpp_tot( self ):
+        return sum( self.get_bpp_tot_for_base_pair_type( base_pair_type ) for base_pair_type in self.base_pair_types ) / 2.0
+
+    def get_stacked_pair_tensor( self ):
+        '''
+        B x T x T array over base pair types: [b,a,c] = expected number of stacked pairs with bp1 of type a and bp2 of type c,
+         C_eff_stack[a][c] Z_BPq_a_flipped(j,i) Z_BPq_c(i+1,j-1) / Z summed over (i,j), from one sweep over all types.
+        '''
+        # base pair forms a stacked pair with previous pair
+        #
+        #      bp2
+        #  i+1 ... j-1
+        #    |     |
+        #    i ... j
+        #      bp1
+        #
+        if 'stacked_pairs' not in self.arrays:
+            mask = ( self.offset >= 3 ) & self.ligated[ :, :, None ] & np.roll( self.ligated, 1, axis = 1 )[ :, None, : ]
+            shape = ( len( self.Z ), self.N, self.N )
+            bp1 = np.array( [ np.broadcast_to( np.where( mask & transpose( self.get_match( bpt.flipped ) ), transpose( self.get_Z_BPq( bpt.flipped ) ), 0.0 ), shape ) for bpt in self.base_pair_types ] )
+            bp2 = np.array( [ np.broadcast_to( np.where( shift( self.get_match( bpt ), 1, -1 ), shift( self.get_Z_BPq( bpt ), 1, -1 ), 0.0 ), shape ) for bpt in self.base_pair_types ] )
+            with np.errstate( all = 'ignore' ):
+                self.arrays[ 'stacked_pairs' ] = self.C_eff_stack * np.einsum( 'abij,cbij->bac', bp1, bp2 ) / self.Z_
+        return self.arrays[ 'stacked_pairs' ]
+
+    def get_motif_prob( self, base_pair_type, base_pair_type2 ):
+        base_pair_types = self.base_pair_types
+        motif_prob = self.get_stacked_pair_tensor()[ :, base_pair_types.index( base_pair_type ), base_pair_types.index( base_pair_type2 ) ]
+        if base_pair_type == base_pair_type2.flipped: motif_prob = motif_prob / 2.0 # symmetry correction
+        return motif_prob
+
+    def get_stacked_pair_prob( self, bpts1, bpts2 ):
+        '''
+        Log derivative for a C_eff_stack tag that covers stacks of bpts1 on bpts2 -- a sum over the stacked pair tensor.
+         ( bpt1, bpt2 ) and ( bpt2.flipped, bpt1.flipped ) are the same stack, seen from either side, and count once.
+        '''
+        base_pair_types = self.base_pair_types
+        weights = np.zeros( ( len( base_pair_types ), len( base_pair_types ) ) )
+        motif_types_computed = set()
+        for bpt1 in bpts1:
+            for bpt2 in bpts2:
+                if (bpt1, bpt2) in motif_types_computed: continue
+                weights[ base_pair_types.index( bpt1 ), base_pair_types.index( bpt2 ) ] += 0.5 if bpt1 == bpt2.flipped else 1.0 # symmetry correction
+                motif_types_computed.add( (bpt1, bpt2 ) )
+                motif_types_computed.add( (bpt2.flipped, bpt1.flipped ) ) # prevents overcounting
+        return ( weights * self.get_stacked_pair_tensor() ).sum( axis = ( 1, 2 ) )
+
+    def get_loop_closed_coax_prob( self ):
+        # If the two coaxially stacked base pairs are connected by a loop.
+        #
+        #       ~~~~
+        #   -- j    i --
+        #  /   :    :   \
+        #  \   :    :   /
+        #   ------------
+        #
+        C_eff_for_coax = self.get_array( 'C_eff' if self.params.allow_strained_3WJ else 'C_eff_no_BP_singlet' )
+        mask = ( self.offset.T >= 2 ) & np.roll( self.ligated, 1, axis = 1 )[ :, :, None ] & self.ligated[ :, None, : ] # (i - j) % N, ligated[ i-1 ], ligated[ j ]
+        with np.errstate( all = 'ignore' ):
+            terms = self.get_array( 'Z_coax' ) * self.l_coax * self.l**2 * transpose( shift( C_eff_for_coax, 1, -1 ) ) / self.Z_
+        return np.where( mask, terms, 0.0 ).sum( axis = ( 1, 2 ) )
+
+    def get_loop_open_coax_prob( self ):
+        # If the two stacked base pairs are in split segments
+        #
+        #      \    /
+        #   -- j    i --
+        #  /   :    :   \
+        #  \   :    :   /
+        #   ------------
+        #
+        with np.errstate( all = 'ignore' ):
+            return ( self.get_array( 'Z_coax' ) * transpose( self.get_array( 'Z_cut' ) ) ).sum( axis = ( 1, 2 ) ) / self.Z
+
+    def get_coax_prob( self ):
+        return self.get_loop_closed_coax_prob() + self.get_loop_open_coax_prob()
+
+def shift( A, di, dj ):
+    '''
+    B[...,i,j] = A[ ..., (i+di) % N, (j+dj) % N ]
+    '''
+    return np.roll( np.roll( A, -di, axis = -2 ), -dj, axis = -1 )
+
+def transpose( A ): return np.swapaxes( A, -1, -2 )
+
+def get_Q_array( DP ):
+    '''
+    Values of a dynamic programming matrix as an N x N array: from the lists in
+     explicit_dynamic_programming.py, or cell by cell from dynamic_programming.py.
+    '''
+    if hasattr( DP, 'Q' ): return np.asarray( DP.Q, dtype = float )
+    return np.array( [ [ DP.val( i, j ) for j in range( DP.N ) ] for i in range( DP.N ) ], dtype = float )
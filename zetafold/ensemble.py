@@ -0,0 +1,151 @@
+import numpy as np
+from .util.secstruct_util import bps_from_secstruct
+
+##################################################################################################
+# Batch operations on ensembles of structures held as pair tables (see sampling.py):
+#
+#    pair_tables[ n ][ i ] = partner of nucleotide i in structure n, or -1 if i is unpaired.
+#
+# Everything works on whole arrays -- no Python object per structure -- so that 10^5 samples or more
+#  can be deduplicated, counted, and summarized into pairing frequencies, centroid and MEA structures.
+#  Structures are deduplicated by a 64-bit hash of their pair table; rows that share a hash are
+#  compared in full, so a hash collision can cost time, but never merges two different structures.
+##################################################################################################
+block_size = 10000 # rows at a time, to bound temporary arrays
+
+class StructureEnsemble:
+    '''
+    pair_tables = int16 array of shape ( n_structures, N ), e.g. p.stochastic_pair_tables, or from sample_structures().
+    Hashes, unique structures and pairing frequencies are computed once, when first asked for.
+    '''
+    def __init__( self, pair_tables ):
+        self.pair_tables = np.asarray( pair_tables, dtype = np.int16 )
+        ( self.n_structures, self.N ) = self.pair_tables.shape
+        self.hashes = None
+        self.unique = None
+        self.bpp = None
+
+    def get_hashes( self ):
+        if self.hashes is None: self.hashes = hash_pair_tables( self.pair_tables )
+        return self.hashes
+
+    def get_unique( self ):
+        '''
+        ( unique pair tables, counts, inverse ), from most to least frequent, where
+         pair_tables[ n ] == unique pair tables[ inverse[ n ] ].
+        '''
+        if self.unique is None: self.unique = get_unique_pair_tables( self.pair_tables, self.get_hashes() )
+        return self.unique
+
+    def get_pairing_frequencies( self ):
+        '''
+        N x N array: fraction of structures in which i pairs with j.
+        '''
+        if self.bpp is None: self.bpp = get_pairing_frequencies( self.pair_tables )
+        return self.bpp
+
+    def get_paired_frequencies( self ):
+        '''
+        Array of length N: fraction of structures in which i is paired.
+        '''
+        return self.get_pairing_frequencies().sum( axis = 1 )
+
+    def get_centroid( self ):
+        '''
+        Pair table of the centroid structure: base pairs with frequency above 1/2. They cannot cross,
+         and no nucleotide gets two partners. This minimizes the mean base pair distance to the ensemble.
+        '''
+        bpp = self.get_pairing_frequencies()
+        partner = bpp.argmax( axis = 1 )
+        return np.where( bpp[ np.arange( self.N ), partner ] > 0.5, partner, -1 ).astype( np.int16 )
+
+    def get_mea( self, gamma = 1.0 ):
+        '''
+        ( pair table, expected accuracy ) of the structure in the ensemble with the maximum expected accuracy,
+         sum over its base pairs of 2 * gamma * frequency, plus sum over its unpaired nucleotides of their
+         frequency of being unpaired. Selected from the unique structures in the ensemble.
+        '''
+        ( pair_tables, counts, inverse ) = self.get_unique()
+        bpp = self.get_pairing_frequencies()
+        unpaired = 1.0 - bpp.sum( axis = 1 )
+        positions = np.arange( self.N )
+        accuracy = np.where( pair_tables >= 0, gamma * bpp[ positions, np.maximum( pair_tables, 0 ) ], unpaired[ positions ] ).sum( axis = 1 )
+        best = accuracy.argmax()
+        return ( pair_tables[ best ], accuracy[ best ] )
+
+    def get_secstructs( self, pair_tables = None ):
+        return secstructs_from_pair_tables( self.pair_tables if pair_tables is None else pair_tables )
+
+##################################################################################################
+def hash_pair_tables( pair_tables ):
+    '''
+    64-bit hash of each row: sum over positions of ( partner + 1 ) times a random odd multiplier for that
+     position, modulo 2^64, and then bits mixed as in the finalizer of MurmurHash3. Same on every platform.
+    '''
+    ( n_structures, N ) = pair_tables.shape
+    multipliers = get_hash_multipliers( N )
+    hashes = np.zeros( n_structures, dtype = np.uint64 )
+    with np.errstate( over = 'ignore' ):
+        for i in range( N ): hashes += ( pair_tables[ :, i ] + 1 ).astype( np.uint64 ) * multipliers[ i ]
+        hashes ^= hashes >> np.uint64( 33 )
+        hashes *= np.uint64( 0xff51afd7ed558ccd )
+        hashes ^= hashes >> np.uint64( 33 )
+    return hashes
+
+def get_hash_multipliers( N ):
+    random_state = np.random.RandomState( 2018 )
+    return random_state.randint( 0, 2**62, size = N, dtype = np.int64 ).astype( np.uint64 ) * np.uint64( 2 ) + np.uint64( 1 )
+
+def get_unique_pair_tables( pair_tables, hashes = None ):
+    '''
+    ( unique pair tables, counts, inverse ) -- see StructureEnsemble.get_unique().
+    '''
+    if hashes is None: hashes = hash_pair_tables( pair_tables )
+    if len( hashes ) == 0: return ( pair_tables[ :0 ], np.zeros( 0, dtype = np.int64 ), np.zeros( 0, dtype = np.int64 ) )
+    order = np.argsort( hashes, kind = 'mergesort' )
+    sorted_hashes = hashes[ order ]
+    is_first = np.concatenate( ( [ True ], sorted_hashes[ 1: ] != sorted_hashes[ :-1 ] ) )
+    group = np.cumsum( is_first ) - 1
+    firsts = order[ is_first ]
+    if ( pair_tables[ order ] != pair_tables[ firsts ][ group ] ).any():
+        # hash collision -- sort rows themselves
+        ( unique_pair_tables, inverse, counts ) = np.unique( pair_tables, axis = 0, return_inverse = True, return_counts = True )
+    else:
+        unique_pair_tables = pair_tables[ firsts ]
+        counts = np.bincount( group )
+        inverse = np.empty( len( hashes ), dtype = np.int64 )
+        inverse[ order ] = group
+    by_count = np.argsort( -counts, kind = 'mergesort' )
+    rank = np.empty( len( by_count ), dtype = np.int64 )
+    rank[ by_count ] = np.arange( len( by_count ) )
+    return ( unique_pair_tables[ by_count ], counts[ by_count ], rank[ inverse ] )
+
+def get_pairing_frequencies( pair_tables ):
+    ( n_structures, N ) = pair_tables.shape
+    counts = np.zeros( N * N, dtype = np.int64 )
+    rows = np.arange( N ) * N
+    for start in range( 0, n_structures, block_size ):
+        block = pair_tables[ start:start + block_size ]
+        paired = ( block >= 0 )
+        counts += np.bincount( ( rows + block )[ paired ], minlength = N * N )
+    return counts.reshape( ( N, N ) ) / float( max( n_structures, 1 ) )
+
+def secstructs_from_pair_tables( pair_tables ):
+    '''
+    Dot-paren strings for the rows of pair_tables, like secstruct_from_bps() in util/secstruct_util.py.
+    '''
+    ( n_structures, N ) = pair_tables.shape
+    positions = np.arange( N )
+    chars = np.full( ( n_structures, N ), b'.', dtype = 'S1' )
+    chars[ pair_tables > positions ] = b'('
+    chars[ ( pair_tables >= 0 ) & ( pair_tables < positions ) ] = b')'
+    return np.ascontiguousarray( chars ).view( 'S%d' % N ).ravel().astype( str ).tolist() if N > 0 else [ '' ] * n_structures
+
+def pair_tables_from_secstructs( secstructs ):
+    N = len( secstructs[ 0 ] ) if len( secstructs ) > 0 else 0
+    pair_tables = np.full( ( len( secstructs ), N ), -1, dtype = np.int16 )
+    for ( n, secstruct ) in enumerate( secstructs ):
+        for ( i, j ) in bps_from_secstruct( secstruct ):
+            pair_tables[ n, i ] = j
+            pair_tables[ n, j ] = i
+    return pair_tables
@@ -0,0 +1,106 @@
+from __future__ import print_function
+import numpy as np
+from .parameters import get_params, get_Kd_base_pair_types, get_C_eff_stack_motifs
+from .partition import Partition
+from .util.secstruct_util import get_structure_string
+from .recursions.tangent import CrossTangent, get_seed, get_cross_seed, get_log_derivs_from_tangent, get_log_hessian_from_tangent
+
+##################################################################################################
+def forward_log_derivs( sequences, deriv_params = None, circle = False, params = '',
+                        structure = None, force_base_pairs = None, no_coax = False, use_simple_recursions = False,
+                        suppress_all_output = False ):
+    '''
+    d( log Z )/d( log parameter ) for each of deriv_params (default: all parameter tags), in forward mode:
+     every selected parameter is replaced by a Tangent (see recursions/tangent.py) and the matrices are filled
+     once, so derivatives go through every recursion, including update_Z_final.
+
+    No closed-form expressions are needed, as in derivatives.py -- so this is exact for any parameter the
+     recursions use, and is an independent check on those expressions, at the cost of one fill with P-vectors
+     in place of floats, instead of the 2P refolds of a numerical derivative.
+
+    Returns ( log_derivs, Z ).
+    '''
+    ( Z, deriv_params ) = fill_with_tangents( sequences, deriv_params, circle, params, structure, force_base_pairs, no_coax, use_simple_recursions, suppress_all_output )
+    log_derivs = get_log_derivs_from_tangent( Z, len( deriv_params ) )
+    if not suppress_all_output:
+        print( '%20s %25s' % ('parameter','d(logZ)/d(log parameter)' ) )
+        for ( param, log_deriv ) in zip( deriv_params, log_derivs ): print( '%20s %25.12f' % ( param, log_deriv ) )
+    return ( log_derivs, float( Z ) )
+
+def forward_log_hessian( sequences, deriv_params = None, circle = False, params = '',
+                         structure = None, force_base_pairs = None, no_coax = False, use_simple_recursions = False,
+                         suppress_all_output = False ):
+    '''
+    Hessian d2( log Z )/d( log parameter )^2 for deriv_params, from one fill with Tangent2 (P x P matrices in place of floats).
+
+    Every Boltzmann weight is a product of powers of parameters, so this is also the covariance of the
+     feature counts controlled by the parameters (negative counts for Kd), i.e. the Fisher information.
+
+    Returns ( hessian, log_derivs, Z ).
+    '''
+    ( Z, deriv_params ) = fill_with_tangents( sequences, deriv_params, circle, params, structure, force_base_pairs, no_coax, use_simple_recursions, suppress_all_output, second_order = True )
+    return ( get_log_hessian_from_tangent( Z, len( deriv_params ) ), get_log_derivs_from_tangent( Z, len( deriv_params ) ), float( Z ) )
+
+def forward_log_hessian_vector_product( sequences, deriv_params, v, circle = False, params = '',
+                                        structure = None, force_base_pairs = None, no_coax = False, use_simple_recursions = False,
+                                        suppress_all_output = False ):
+    '''
+    Hessian of log Z (as in forward_log_hessian()) times the vector v over deriv_params, without the Hessian:
+     one fill with CrossTangent, with a single other direction e that moves every log parameter along v. Then
+
+        d2( log Z )/d e d( log parameter n ) = sum_m H[n,m] v[m]
+
+     so each operation is O( P ) rather than the O( P^2 ) of Tangent2.
+
+    Returns ( hessian_vector_product, log_derivs, Z ).
+    '''
+    ( Z, deriv_params ) = fill_with_tangents( sequences, deriv_params, circle, params, structure, force_base_pairs, no_coax, use_simple_recursions, suppress_all_output, direction = v )
+    if not isinstance( Z, CrossTangent ) or Z.Q == 0.0: return ( np.zeros( len( deriv_params ) ), [ 0.0 ] * len( deriv_params ), float( Z ) )
+    return ( Z.derivs[ 1, 1: ], Z.derivs[ 0, 1: ].tolist(), float( Z ) )
+
+def fill_with_tangents( sequences, deriv_params, circle, params, structure, force_base_pairs, no_coax, use_simple_recursions,
+                        suppress_all_output, second_order = False, num_directions = 0, base_pair_weights = None, direction = None ):
+    '''
+    Z as a Tangent (or Tangent2, if second_order), and deriv_params (all parameter tags, if None or []).
+    num_directions > 0 makes Z a CrossTangent instead, with room for that many other directions, which
+     base_pair_weights carry (see observable_derivs.py).
+    direction = vector over deriv_params: Z is a CrossTangent with one other direction, along which the
+     log parameters move by direction (see forward_log_hessian_vector_product()).
+    '''
+    if isinstance(params,str): params = get_params( params, suppress_all_output )
+    params = params.get_mutable_copy()
+    if no_coax: params.K_coax = 0.0
+    if deriv_params == None or deriv_params == []: deriv_params = list( params.parameter_tags )
+    if direction is not None:
+        assert( len( direction ) == len( deriv_params ) )
+        num_directions = 1
+
+    for n,param in enumerate( deriv_params ):
+        direction_weights = None if direction is None else [ direction[ n ] ]
+        set_tangent_parameter( params, param, n, len( deriv_params ), second_order, num_directions, direction_weights )
+
+    p = Partition( sequences, params )
+    p.circle = circle
+    p.structure = get_structure_string( structure )
+    p.force_base_pairs = get_structure_string( force_base_pairs )
+    p.use_simple_recursions = use_simple_recursions
+    p.base_pair_weights = base_pair_weights
+    p.suppress_all_output = True
+    p.run()
+    return ( p.Z_final.val( 0 ), deriv_params )
+
+def set_tangent_parameter( params, param, n, num_params, second_order = False, num_directions = 0, direction_weights = None ):
+    '''
+    Add unit tangent n (with respect to log of param) to every value in AlphaFoldParams that param sets --
+     same tags as _set_parameter() in parameters.py, plus 'Kd' for all base pair types.
+    A value set by several of the selected params gets the tangents of all of them.
+    '''
+    seed = lambda val: get_seed( val, n, num_params, second_order )
+    if num_directions > 0: seed = lambda val: get_cross_seed( val, n, num_params, num_directions, direction_weights )
+    if param[:2] == 'Kd':
+        for base_pair_type in get_Kd_base_pair_types( params, param ): base_pair_type.Kd = seed( base_pair_type.Kd )
+    elif param[:11] == 'C_eff_stack':
+        for ( bpt1, bpt2 ) in get_C_eff_stack_motifs( params, param ): params.C_eff_stack[ bpt1 ][ bpt2 ] = seed( params.C_eff_stack[ bpt1 ][ bpt2 ] )
+    else:
+        assert( param in [ 'C_init', 'l', 'l_BP', 'K_coax', 'l_coax' ] )
+        setattr( params, param, seed( getattr( params, param ) ) )
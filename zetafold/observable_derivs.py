@@ -0,0 +1,128 @@
+from __future__ import print_function
+import numpy as np
+from .parameters import get_params
+from .partition import partition
+from .forward_derivs import fill_with_tangents
+from .reverse_derivs import Adjoints
+from .recursions.tangent import CrossTangent, get_cross_derivs_from_tangent
+from .util.sequence_util import initialize_sequence_and_ligated
+
+##################################################################################################
+# Derivatives of ensemble observables -- base pair probabilities bpp(i,j), and unpaired probabilities
+#  1 - sum_j bpp(i,j) -- with respect to log parameters, e.g., for training on chemical mapping data.
+#
+# Give each base pair (i,j) an extra factor exp( e_k c_k(i,j) ). Then at e = 0,
+#
+#     F_k = sum_{i<j} c_k(i,j) bpp(i,j) = d( log Z )/d e_k
+#
+#  and dF_k/d( log parameter n ) = d2( log Z )/d e_k d( log parameter n ): the derivative in e_k of the gradient of
+#  log Z. The outside sweep of reverse_derivs.py gives that gradient from a plain fill, and carries the e_k along
+#  as forward derivatives through the same contribution records -- O( K ) per record, whatever the number of
+#  parameters P. For a loss L over N reactivities, the weights c(i,j) = -dL/du_i - dL/du_j make a single
+#  observable whose derivatives are dL/d( log parameter ) (unpaired_log_derivs() with weights): one fill and
+#  one sweep, not N constrained refolds. That is the entry point for training.
+#
+# The simple recursions (use_simple_recursions) do not give contribution records. There, the fill is redone with
+#  CrossTangent over the P parameters and the K directions (see recursions/tangent.py), at O( K P ) per operation.
+##################################################################################################
+def observable_log_derivs( sequences, pair_weights, deriv_params = None, circle = False, params = '',
+                           structure = None, force_base_pairs = None, no_coax = False, use_simple_recursions = False,
+                           suppress_all_output = False ):
+    '''
+    pair_weights = list of K dicts { (i,j): c(i,j) }, one for each observable F = sum over base pairs of c(i,j) bpp(i,j)
+      (each pair appears once, as (i,j) or (j,i)).
+
+    Returns ( values, jacobian ), with values[k] = F_k, jacobian[k][n] = dF_k/d( log deriv_params[n] ) (K x P array).
+    '''
+    if isinstance(params,str): params = get_params( params, suppress_all_output )
+    if deriv_params == None or deriv_params == []: deriv_params = list( params.parameter_tags )
+    if use_simple_recursions: return forward_observable_log_derivs( sequences, pair_weights, deriv_params, circle, params, structure, force_base_pairs, no_coax, use_simple_recursions )
+    p = partition( sequences, circle = circle, params = params, structure = structure, force_base_pairs = force_base_pairs, no_coax = no_coax, suppress_all_output = True )
+    return get_observable_log_derivs( p, pair_weights, deriv_params )
+
+def get_observable_log_derivs( p, pair_weights, deriv_params = None ):
+    '''
+    Same, for the fold of filled Partition p -- from an outside sweep over p, or a forward refill for the simple recursions.
+    '''
+    if deriv_params == None or deriv_params == []: deriv_params = list( p.params.parameter_tags )
+    if not hasattr( p.Z_final, 'get_contribs_records' ):
+        return forward_observable_log_derivs( p.sequences, pair_weights, deriv_params, p.circle, p.params, p.structure, p.force_base_pairs, False, p.use_simple_recursions )
+    adjoints = Adjoints( p, deriv_params, pair_weights )
+    return ( adjoints.observables, adjoints.observable_log_derivs )
+
+def forward_observable_log_derivs( sequences, pair_weights, deriv_params, circle, params, structure, force_base_pairs, no_coax, use_simple_recursions ):
+    '''
+    Same, from one fill with CrossTangent.
+    '''
+    ( P, K ) = ( len( deriv_params ), len( pair_weights ) )
+    base_pair_weights = get_base_pair_weights( pair_weights, P )
+    ( Z, deriv_params ) = fill_with_tangents( sequences, deriv_params, circle, params, structure, force_base_pairs, no_coax, use_simple_recursions,
+                                              True, num_directions = K, base_pair_weights = base_pair_weights )
+    return get_cross_derivs_from_tangent( Z, P, K )
+
+def bpp_log_derivs( sequences, bps, deriv_params = None, circle = False, params = '',
+                    structure = None, force_base_pairs = None, no_coax = False, use_simple_recursions = False,
+                    suppress_all_output = False ):
+    '''
+    Base pair probabilities of the pairs bps = [ (i,j), ... ] and their log derivatives (K x P array).
+    '''
+    return observable_log_derivs( sequences, get_bpp_pair_weights( bps ), deriv_params, circle, params, structure, force_base_pairs, no_coax, use_simple_recursions, suppress_all_output )
+
+def unpaired_log_derivs( sequences, deriv_params = None, weights = None, circle = False, params = '',
+                         structure = None, force_base_pairs = None, no_coax = False, use_simple_recursions = False,
+                         suppress_all_output = False ):
+    '''
+    Unpaired probability of each nucleotide, u_i = 1 - sum_j bpp(i,j), and its log derivatives: ( N values, N x P array ).
+
+    With weights (length N, e.g., dL/du_i for a loss L over reactivities), instead the single observable
+     sum_i weights[i] u_i and its log derivatives: ( value, P array ) -- with one extra direction, not N.
+     Use this for a loss; without weights, the cost grows with N.
+    '''
+    N = len( initialize_sequence_and_ligated( sequences, circle )[0] )
+    derivs = observable_log_derivs( sequences, get_unpaired_pair_weights( N, weights ), deriv_params, circle, params, structure, force_base_pairs, no_coax, use_simple_recursions, suppress_all_output )
+    return get_unpaired_from_observables( derivs, weights )
+
+##################################################################################################
+def get_bpp_pair_weights( bps ): return [ { ( i, j ): 1.0 } for ( i, j ) in bps ]
+
+def get_unpaired_pair_weights( N, weights = None ):
+    '''
+    pair_weights for the unpaired probability of each nucleotide (minus 1), or for sum_i weights[i] u_i (minus sum of weights).
+    '''
+    pairs = [ ( i, j ) for i in range( N ) for j in range( i+1, N ) ]
+    if weights is None: return [ dict( ( ( i, j ), -1.0 ) for ( i, j ) in pairs if n in ( i, j ) ) for n in range( N ) ]
+    assert( len( weights ) == N )
+    return [ dict( ( ( i, j ), -weights[ i ] - weights[ j ] ) for ( i, j ) in pairs ) ]
+
+def get_unpaired_from_observables( derivs, weights = None ):
+    ( values, jacobian ) = derivs
+    if weights is None: return ( [ 1.0 + value for value in values ], jacobian )
+    return ( sum( weights ) + values[ 0 ], jacobian[ 0 ] )
+
+def get_base_pair_weights( pair_weights, P ):
+    '''
+    Factor exp( sum_k e_k c_k(i,j) ) for each base pair, as a CrossTangent in the K directions e_k, keyed by (i,j) and (j,i).
+    '''
+    K = len( pair_weights )
+    base_pair_weights = {}
+    for ( k, weights ) in enumerate( pair_weights ):
+        for ( ( i, j ), c ) in weights.items():
+            if c == 0.0: continue
+            if ( i, j ) not in base_pair_weights:
+                base_pair_weights[ ( i, j ) ] = base_pair_weights[ ( j, i ) ] = CrossTangent( 1.0, np.zeros( ( K + 1, P + 1 ) ) )
+            base_pair_weights[ ( i, j ) ].derivs[ k+1, 0 ] += c
+    return base_pair_weights
+
+def install_base_pair_weights( self ):
+    '''
+    Multiply each cell (i,j) of Z_BPq of Partition self by base_pair_weights[ (i,j) ] as it is filled, so each
+     structure picks up the factors of its base pairs. Values only -- contributions and backtracking do not see them.
+    '''
+    for DP in self.Z_BPq.values(): DP.update = get_weighted_update( DP, self.base_pair_weights )
+
+def get_weighted_update( DP, base_pair_weights ):
+    update = DP.update
+    def weighted_update( partition, i, j ):
+        update( partition, i, j )
+        if ( i, j ) in base_pair_weights and DP.val( i, j ) != 0.0: DP.set_val( i, j, DP.val( i, j ) * base_pair_weights[ ( i, j ) ] )
+    return weighted_update
@@ -1,18 +1,27 @@
 from __future__ import print_function
+import copy
 import math
+import numpy as np
 from .base_pair_types import BasePairType, setup_base_pair_type, get_base_pair_types_for_tag, get_base_pair_type_for_tag
 from .util.constants import KT_IN_KCAL
 import glob
+import hashlib
+import json
+import os
 import os.path
 
 class AlphaFoldParams:
     '''
     Parameters that define the statistical mechanical model for RNA folding
     '''
+    frozen = False # see get_snapshot()
+
     def __init__( self ):
         self.C_std  = 1.0      # 1 M. drops out in end (up to overall scale factor).
         self.parameter_tags   = [] # K_CG, etc.
-        self.parameter_values = [] # floats
+        self.parameter_values = np.zeros( 0 ) # floats
+        self.parameter_index  = {} # tag --> index in parameter_tags, parameter_values
+        self.tying = None # ParameterTying, compiled at first set_from_log_vector()
         self.string_tags   = [] # name, version, etc.
         self.string_values = [] # strings
 
@@ -24,8 +33,29 @@ class AlphaFoldParams:
         val = _set_parameter( self, tag, val )
 
     def get_parameter_value( self, param_tag ):
-        if self.parameter_tags.count( param_tag ) == 0: return None
-        return self.parameter_values[ self.parameter_tags.index( param_tag ) ]
+        if param_tag not in self.parameter_index: return None
+        return float( self.parameter_values[ self.parameter_index[ param_tag ] ] )
+
+    def set_from_log_vector( self, x, param_tags = None ): _set_from_log_vector( self, x, param_tags )
+
+    def get_snapshot( self, **scalars ): return get_snapshot( self, **scalars ) # read-only, hashable copy
+    def get_mutable_copy( self ): return get_mutable_copy( self )
+
+    def __setattr__( self, name, val ):
+        if self.__dict__.get( 'frozen' ): raise AttributeError( 'parameters snapshot is read-only (see get_mutable_copy): %s' % name )
+        self.__dict__[ name ] = val
+
+    # snapshots compare and hash by value; otherwise, by identity
+    def __eq__( self, other ):
+        if self.frozen and isinstance( other, AlphaFoldParams ) and other.frozen: return self.snapshot_key == other.snapshot_key
+        return self is other
+    def __ne__( self, other ): return not self.__eq__( other )
+    def __hash__( self ): return hash( self.snapshot_key ) if self.frozen else id( self )
+
+    def __setstate__( self, state ):
+        self.__dict__.update( state ) # e.g., snapshot pickled to a worker -- arrays stay read-only
+        if self.frozen:
+            for array in [ self.parameter_values, self.Kd_array, self.C_eff_stack_table ]: array.flags.writeable = False
 
     def check_C_eff_stack( self ): _check_C_eff_stack( self )
 
@@ -37,16 +67,131 @@ class AlphaFoldParams:
 
 def get_params( params = None, suppress_all_output = False ):
     '''
-    master function to get parameters
+    master function to get parameters -- a copy that the caller can change (see get_params_snapshot)
     '''
-    params_object = None
     if isinstance(params,AlphaFoldParams): return params
-    elif params == None or params =='':    params_object = get_latest_params()
-    else:
-        assert( isinstance( params, str ) )
-        params_object = get_params_from_file( params )
-    if not suppress_all_output: print('Parameters: ', params_object.name, ' version', params_object.version)
-    return params_object
+    snapshot = get_params_snapshot( params, suppress_all_output )
+    if snapshot == None: return None
+    return snapshot.get_mutable_copy()
+
+def get_params_snapshot( params = None, suppress_all_output = False ):
+    '''
+    Read-only parameters (see get_snapshot()) shared by everyone in this process who asks for the same file
+     (tag, path, or None or '' for latest). Each file is loaded once per process, so later calls only find
+     the file and look it up.
+    '''
+    if isinstance(params,AlphaFoldParams): return params.get_snapshot()
+    if params == None: params = ''
+    assert( isinstance( params, str ) )
+    params_file = get_latest_params_file() if params == '' else find_params_file( params )
+    if params_file == None:
+        print()
+        print( 'Could not find requested parameters:', params )
+        print( 'Options are: ' )
+        for params_file in get_all_params_files(): print('  ',params_file)
+        print()
+        return None
+    params_file = os.path.abspath( params_file )
+    if params_file not in params_registry: params_registry[ params_file ] = load_params_file( params_file )
+    snapshot = params_registry[ params_file ]
+    if not suppress_all_output: print('Parameters: ', snapshot.name, ' version', snapshot.version)
+    return snapshot
+
+params_registry = {} # absolute path of params file --> snapshot
+latest_params_file = None
+
+def clear_params_registry():
+    '''
+    Forget loaded parameters, e.g., after editing or adding a params file in a running session.
+    '''
+    global latest_params_file
+    params_registry.clear()
+    latest_params_file = None
+
+#############################################################################################################
+#  Read-only snapshots, for folds that run concurrently (threads, forked or pickled to workers)
+#############################################################################################################
+def get_snapshot( params, **scalars ):
+    '''
+    Read-only copy of params that folds can share, with scalars replaced (e.g., K_coax = 0.0 for no_coax) --
+     the caller's params are never changed. Base pair types, C_eff_stack and parameter_values cannot be
+     changed in place, and the derived tables
+
+        Kd_array          = Kd of each of base_pair_types
+        C_eff_stack_table = T x T array of C_eff_stack
+
+     are computed once (see get_Kd_array() and get_C_eff_stack_table()). Snapshots hash and compare by value.
+     A snapshot of a snapshot is itself -- so callers that fold many times with the same parameters (e.g.,
+     in a loop) should take one snapshot first and pass that, rather than copying params at every call.
+    '''
+    if params.frozen and not scalars: return params
+    params = get_mutable_copy( params )
+    for ( tag, val ) in scalars.items():
+        setattr( params, tag, val )
+        if tag in params.parameter_index: params.parameter_values[ params.parameter_index[ tag ] ] = val
+    bpts = params.base_pair_types
+    params.C_eff_stack = FrozenDict( ( bpt1, FrozenDict( C_eff_stack ) ) for ( bpt1, C_eff_stack ) in params.C_eff_stack.items() )
+    params.Kd_array = get_read_only_array( get_Kd_array( params ) )
+    params.C_eff_stack_table = get_read_only_array( get_C_eff_stack_table( params ) )
+    params.parameter_values.flags.writeable = False
+    params.snapshot_key = ( tuple( params.parameter_tags ), tuple( params.parameter_values.tolist() ), tuple( params.string_tags ), tuple( params.string_values ),
+                            tuple( getattr( params, tag, None ) for tag in [ 'C_init', 'l', 'l_BP', 'K_coax', 'l_coax', 'C_std', 'min_loop_length', 'allow_strained_3WJ' ] ),
+                            tuple( ( bpt.get_tag(), bpt.Kd ) for bpt in bpts ), tuple( params.C_eff_stack_table.flatten().tolist() ) )
+    for bpt in bpts: bpt.__dict__[ 'frozen' ] = True
+    params.__dict__[ 'frozen' ] = True
+    return params
+
+def get_mutable_copy( params, deep = True ):
+    '''
+    Copy of params (snapshot or not) that can be changed. Shallow copies share base pair types, which stay as they were.
+    Deep copies get their own base pair types, C_eff_stack, lists and arrays; values (floats, or Tangents, which
+     are never changed in place) and the ParameterTying are shared.
+    '''
+    params = copy.copy( params )
+    params.__dict__[ 'frozen' ] = False
+    for tag in [ 'Kd_array', 'C_eff_stack_table', 'snapshot_key' ]: params.__dict__.pop( tag, None )
+    if deep:
+        bpt_copies = {}
+        for bpt in getattr( params, 'base_pair_types', [] ):
+            bpt_copies[ bpt ] = copy.copy( bpt )
+            bpt_copies[ bpt ].__dict__[ 'frozen' ] = False
+        for bpt in bpt_copies.values(): bpt.__dict__[ 'flipped' ] = bpt_copies[ bpt.flipped ]
+        if hasattr( params, 'base_pair_types' ): params.base_pair_types = [ bpt_copies[ bpt ] for bpt in params.base_pair_types ]
+        if hasattr( params, 'C_eff_stack' ):
+            params.C_eff_stack = dict( ( bpt_copies[ bpt1 ], dict( ( bpt_copies[ bpt2 ], val ) for ( bpt2, val ) in C_eff_stack.items() ) ) for ( bpt1, C_eff_stack ) in params.C_eff_stack.items() )
+        for tag in [ 'parameter_tags', 'string_tags', 'string_values' ]: setattr( params, tag, list( getattr( params, tag ) ) )
+        params.parameter_index = dict( params.parameter_index )
+        params.parameter_values = np.array( params.parameter_values )
+    return params
+
+class FrozenDict( dict ):
+    '''
+    dict that cannot be changed in place. Copies (copy.deepcopy) are plain dicts.
+    '''
+    def read_only( self, *args, **kwargs ): raise TypeError( 'C_eff_stack in parameters snapshot is read-only' )
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = read_only
+    def __reduce__( self ): return ( FrozenDict, ( dict( self ), ) )
+    def __deepcopy__( self, memo ): return dict( ( copy.deepcopy( key, memo ), copy.deepcopy( val, memo ) ) for ( key, val ) in self.items() )
+
+def get_Kd_array( params ):
+    '''
+    Kd of each of params.base_pair_types -- computed once, for a snapshot.
+    '''
+    if params.frozen: return params.Kd_array
+    return np.array( [ bpt.Kd for bpt in params.base_pair_types ] )
+
+def get_C_eff_stack_table( params ):
+    '''
+    T x T array of C_eff_stack over params.base_pair_types -- computed once, for a snapshot.
+    '''
+    if params.frozen: return params.C_eff_stack_table
+    bpts = params.base_pair_types
+    return np.array( [ [ params.C_eff_stack[ bpt1 ][ bpt2 ] for bpt2 in bpts ] for bpt1 in bpts ] )
+
+def get_read_only_array( vals ):
+    array = np.array( vals )
+    array.flags.writeable = False
+    return array
 
 def read_params_fields( params_file ):
     '''
@@ -72,32 +217,112 @@ def get_params_from_file( params_file_tag ):
     '''
     find the file (if it exists) and then load up into params variables.
     '''
-    params = AlphaFoldParams()
+    return get_params( params_file_tag, suppress_all_output = True )
+
+def find_params_file( params_file_tag ):
     params_file = params_file_tag
     if not os.path.exists( params_file ): params_file = params_file_tag +'.params'
     if not os.path.exists( params_file ): params_file = os.path.dirname( os.path.abspath(__file__) ) + '/parameters/'+params_file_tag +'.params'
     if not os.path.exists( params_file ): params_file = os.path.dirname( os.path.abspath(__file__) ) + '/parameters/zetafold_'+params_file_tag +'.params'
-    if not os.path.exists( params_file ):
-        print()
-        print( 'Could not find requested parameters:', params_file_tag )
-        print( 'Options are: ' )
-        for params_file in get_all_params_files(): print('  ',params_file)
-        print()
-        return None
-    params_fields = read_params_fields( params_file );
-    for param_tag,param_val in params_fields:
-        val = _set_parameter( params, param_tag, param_val )
+    if not os.path.exists( params_file ): return None
+    return params_file
+
+def get_latest_params():
+    return get_params_from_file( get_latest_params_file() )
+
+def get_latest_params_file():
+    '''
+    look for parameters/zetafold_v*.*.params and choose latest (looked up once per process)
+    '''
+    global latest_params_file
+    if latest_params_file == None:
+        params_dir =  os.path.dirname( os.path.abspath(__file__) ) + '/parameters/'
+        params_files = glob.glob( params_dir+'zetafold*.params' )
+        params_files.sort()
+        latest_params_file = params_files[-1]
+    return latest_params_file
+
+#############################################################################################################
+#  Compiled params files: next to each params file, its parsed values as JSON -- base pair types, the
+#   C_eff_stack table, scalars and tags -- under a key with the SHA-1 of the file's contents (and
+#   params_cache_version -- bump that when the format changes). Only data is read back, never code, and a
+#   stale or unreadable cache is just parsed again; a read-only install just doesn't get a cache.
+#############################################################################################################
+params_cache_version = 2
 
+def load_params_file( params_file ):
+    '''
+    Snapshot of params_file, from its compiled cache if the contents have not changed.
+    '''
+    contents = open( params_file, 'rb' ).read()
+    key = [ params_cache_version, hashlib.sha1( contents ).hexdigest() ]
+    cache_file = get_params_cache_file( params_file )
+    try:
+        with open( cache_file, 'r' ) as f:
+            compiled = json.load( f )
+        if compiled[ 'key' ] == key: return get_params_from_compiled( compiled ).get_snapshot()
+    except Exception:
+        pass # no cache yet, or from another version
+    params = parse_params_file( params_file )
+    compiled = get_compiled_params( params )
+    compiled[ 'key' ] = key
+    tmp_file = '%s.%d' % ( cache_file, os.getpid() ) # rename is atomic, for processes loading at the same time
+    try:
+        with open( tmp_file, 'w' ) as f:
+            json.dump( compiled, f )
+        os.rename( tmp_file, cache_file )
+    except ( IOError, OSError, TypeError, ValueError ):
+        pass
+    finally:
+        if os.path.exists( tmp_file ): os.remove( tmp_file )
+    return params.get_snapshot()
+
+def get_params_cache_file( params_file ):
+    ( params_dir, params_file_name ) = os.path.split( os.path.abspath( params_file ) )
+    return os.path.join( params_dir, '.' + params_file_name + '.cache' )
+
+def get_compiled_params( params ):
+    '''
+    Everything in params, as lists, dicts, strings and numbers. Base pair types are listed without their flips.
+    '''
+    bpts = params.base_pair_types
+    return { 'string_tags': params.string_tags, 'string_values': params.string_values,
+             'parameter_tags': params.parameter_tags, 'parameter_values': params.parameter_values.tolist(),
+             'scalars': dict( ( tag, getattr( params, tag ) ) for tag in [ 'C_init', 'l', 'l_BP', 'K_coax', 'l_coax', 'C_std' ] ),
+             'base_pair_types': [ [ bpt.nt1, bpt.nt2, bpt.Kd, bpt.match_lowercase ] for ( a, bpt ) in enumerate( bpts ) if bpt.flipped not in bpts[ :a ] ],
+             'C_eff_stack': [ [ params.C_eff_stack[ bpt1 ][ bpt2 ] for bpt2 in bpts ] for bpt1 in bpts ] }
+
+def get_params_from_compiled( compiled ):
+    '''
+    AlphaFoldParams from get_compiled_params().
+    '''
+    params = AlphaFoldParams()
+    for ( tag, val ) in zip( compiled[ 'string_tags' ], compiled[ 'string_values' ] ):
+        assert( tag in [ 'name', 'version', 'min_loop_length', 'allow_strained_3WJ' ] )
+        _set_parameter( params, str( tag ), str( val ) )
+    for ( tag, val ) in compiled[ 'scalars' ].items(): setattr( params, str( tag ), val )
+    for ( nt1, nt2, Kd, match_lowercase ) in compiled[ 'base_pair_types' ]: setup_base_pair_type( params, str( nt1 ), str( nt2 ), Kd, match_lowercase )
+    bpts = params.base_pair_types
+    params.C_eff_stack = dict( ( bpt1, dict( zip( bpts, row ) ) ) for ( bpt1, row ) in zip( bpts, compiled[ 'C_eff_stack' ] ) )
+    params.parameter_tags = [ str( tag ) for tag in compiled[ 'parameter_tags' ] ]
+    params.parameter_values = np.array( compiled[ 'parameter_values' ], dtype = float )
+    params.parameter_index = dict( ( tag, n ) for ( n, tag ) in enumerate( params.parameter_tags ) )
+    _check_C_eff_stack( params )
     return params
 
-def get_latest_params():
+def parse_params_file( params_file ):
     '''
-    look for parameters/zetafold_v*.*.params and choose latest
+    AlphaFoldParams from params file, checked for what every fold needs.
     '''
-    params_dir =  os.path.dirname( os.path.abspath(__file__) ) + '/parameters/'
-    params_files = glob.glob( params_dir+'zetafold*.params' )
-    params_files.sort()
-    return get_params_from_file( params_files[-1] )
+    params = AlphaFoldParams()
+    params_fields = read_params_fields( params_file );
+    for param_tag,param_val in params_fields:
+        val = _set_parameter( params, param_tag, param_val )
+    for tag in [ 'name', 'version', 'C_init', 'l', 'l_BP', 'K_coax', 'l_coax', 'min_loop_length', 'allow_strained_3WJ', 'base_pair_types', 'C_eff_stack' ]:
+        if not hasattr( params, tag ): print( 'Parameter missing from', params_file, ':', tag )
+        assert( hasattr( params, tag ) )
+    _check_C_eff_stack( params )
+    return params
 
 def get_all_params_files():
     '''
@@ -130,8 +355,9 @@ def _set_parameter( self, tag, val ):
     elif tag == 'min_loop_length':    self.min_loop_length = int( val )
     elif tag == 'allow_strained_3WJ': self.allow_strained_3WJ = (val == 'True')
     elif len( tag )>=2 and tag[:2] == 'Kd':
-        setup_base_pair_type_by_tag( self, tag, float(val) )
-        update_C_eff_stack( self )
+        if setup_base_pair_type_by_tag( self, tag, float(val) ):
+            update_C_eff_stack( self )
+            self.tying = None
         float_parameter = True
     elif len( tag )>=11 and tag[:11] == 'C_eff_stack':
         if tag == 'C_eff_stacked_pair':
@@ -140,14 +366,7 @@ def _set_parameter( self, tag, val ):
                     self.C_eff_stack[bpt1][bpt2] = float(val)
         else:
             assert( len(tag) > 11 )
-            tags = tag[12:].split('_')
-            assert( len( tags ) == 2 )
-            bpts1 = get_base_pair_types_for_tag( self, tags[0] )
-            bpts2 = get_base_pair_types_for_tag( self, tags[1] )
-            for bpt1 in bpts1:
-                for bpt2 in bpts2:
-                    self.C_eff_stack[ bpt1 ][ bpt2 ] = float(val)
-                    self.C_eff_stack[ bpt2.flipped ][ bpt1.flipped ] = float(val)
+            for ( bpt1, bpt2 ) in get_C_eff_stack_motifs( self, tag ): self.C_eff_stack[ bpt1 ][ bpt2 ] = float(val)
         float_parameter = True
     else:
         if not tag in ('name','version','C_init','l','l_BP','l_coax','K_coax'):
@@ -156,10 +375,12 @@ def _set_parameter( self, tag, val ):
         setattr( self, tag, float( val ) )
         float_parameter = True
     if float_parameter:
-        if self.parameter_tags.count( tag ) == 0:
+        if tag not in self.parameter_index:
+            self.parameter_index[ tag ] = len( self.parameter_tags )
             self.parameter_tags.append( tag )
-            self.parameter_values.append( None )
-        self.parameter_values[ self.parameter_tags.index( tag ) ] = float(val)
+            self.parameter_values = np.append( self.parameter_values, 0.0 )
+            self.tying = None
+        self.parameter_values[ self.parameter_index[ tag ] ] = float(val)
     else:
         if self.string_tags.count( tag ) == 0:
             self.string_tags.append( tag )
@@ -184,15 +405,102 @@ def _check_C_eff_stack( params ):
             assert( params.C_eff_stack[ bpt1 ][ bpt2 ] == params.C_eff_stack[ bpt2.flipped ][ bpt1.flipped ] )
 
 def setup_base_pair_type_by_tag( params, Kd_tag, val ):
+    '''
+    Set Kd of base pair type (and its flip); returns True if the base pair type is new.
+    '''
     tag = Kd_tag[3:]
     base_pair_type = get_base_pair_type_for_tag( params, tag )
     if base_pair_type != None:
         base_pair_type.Kd = val
         base_pair_type.flipped.Kd = val
-        return
+        return False
     if tag == 'matchlowercase':
         setup_base_pair_type( params, '*', '*', val, match_lowercase = True )
     else:
         setup_base_pair_type( params, tag[0], tag[1], val, match_lowercase = False )
     assert( get_base_pair_type_for_tag( params, tag ) )
+    return True
+
+def get_Kd_base_pair_types( params, tag ):
+    '''
+    Base pair types whose Kd is set by tag ('Kd' = all of them).
+    '''
+    if tag == 'Kd': return params.base_pair_types
+    base_pair_type = get_base_pair_type_for_tag( params, tag[3:] )
+    assert( base_pair_type != None )
+    if base_pair_type.flipped == base_pair_type: return [ base_pair_type ]
+    return [ base_pair_type, base_pair_type.flipped ]
+
+def get_C_eff_stack_motifs( params, tag ):
+    '''
+    ( bpt1, bpt2 ) entries of C_eff_stack set by tag -- C_eff_stacked_pair, or C_eff_stack_X_Y and its mirror.
+    '''
+    if tag == 'C_eff_stacked_pair':
+        return [ ( bpt1, bpt2 ) for bpt1 in params.base_pair_types for bpt2 in params.base_pair_types ]
+    tags = tag[12:].split('_')
+    assert( len( tags ) == 2 )
+    motifs = []
+    for bpt1 in get_base_pair_types_for_tag( params, tags[0] ):
+        for bpt2 in get_base_pair_types_for_tag( params, tags[1] ):
+            for motif in [ ( bpt1, bpt2 ), ( bpt2.flipped, bpt1.flipped ) ]:
+                if motif not in motifs: motifs.append( motif )
+    return motifs
+
+#############################################################################################################
+#  Vector of parameter values, and the derived values each one sets
+#############################################################################################################
+class ParameterTying:
+    '''
+    Which derived values each parameter (index in parameter_tags) sets: Kd of base pair types, entries of the
+     T x T table C_eff_stack, or one of C_init, l, etc. -- by index into base_pair_types, so copies of params can share it.
+    Where selected tags overlap (e.g., C_eff_stacked_pair and C_eff_stack_WC_GU), the later one in the selection
+     wins, as if set_parameter() were called for each tag in turn.
+    '''
+    def __init__( self, params ):
+        bpts = params.base_pair_types
+        bpt_index = dict( ( id( bpt ), a ) for ( a, bpt ) in enumerate( bpts ) )
+        self.Kd_entries = []          # per parameter, base pair type indices
+        self.C_eff_stack_entries = [] # per parameter, ( a, b ) in C_eff_stack table
+        self.scalar_entries = []      # per parameter, attribute names
+        for tag in params.parameter_tags:
+            ( Kd_entries, C_eff_stack_entries, scalar_entries ) = ( [], [], [] )
+            if tag[:2] == 'Kd':
+                Kd_entries = [ bpt_index[ id( bpt ) ] for bpt in get_Kd_base_pair_types( params, tag ) ]
+            elif tag[:11] == 'C_eff_stack':
+                C_eff_stack_entries = [ ( bpt_index[ id( bpt1 ) ], bpt_index[ id( bpt2 ) ] ) for ( bpt1, bpt2 ) in get_C_eff_stack_motifs( params, tag ) ]
+            else:
+                scalar_entries = [ tag ]
+            self.Kd_entries.append( Kd_entries )
+            self.C_eff_stack_entries.append( C_eff_stack_entries )
+            self.scalar_entries.append( scalar_entries )
+        self.targets = {} # tuple of indices --> ( Kd, C_eff_stack entries, scalars ) they set, with owner of each
+
+    def get_targets( self, indices ):
+        key = tuple( indices )
+        if key not in self.targets:
+            ( Kd_owner, C_eff_stack_owner, scalar_owner ) = ( {}, {}, {} )
+            for n in indices:
+                for a in self.Kd_entries[ n ]: Kd_owner[ a ] = n
+                for ( a, b ) in self.C_eff_stack_entries[ n ]: C_eff_stack_owner[ ( a, b ) ] = n
+                for tag in self.scalar_entries[ n ]: scalar_owner[ tag ] = n
+            Kd_targets = sorted( Kd_owner.items() )
+            C_eff_stack_targets = [ ( a, b, n ) for ( ( a, b ), n ) in sorted( C_eff_stack_owner.items() ) ]
+            scalar_targets = sorted( scalar_owner.items() )
+            self.targets[ key ] = ( Kd_targets, C_eff_stack_targets, scalar_targets )
+        return self.targets[ key ]
+
+def _set_from_log_vector( self, x, param_tags = None ):
+    '''
+    Set param_tags (default: all parameter_tags) to exp( x ), and in one pass, every Kd, C_eff_stack entry and
+     scalar that they set, following the tying compiled in ParameterTying -- same as set_parameter() for each tag in order.
+    '''
+    if param_tags == None: param_tags = self.parameter_tags
+    if self.tying == None: self.tying = ParameterTying( self )
+    indices = [ self.parameter_index[ tag ] for tag in param_tags ]
+    self.parameter_values[ indices ] = np.exp( x )
+    ( Kd_targets, C_eff_stack_targets, scalar_targets ) = self.tying.get_targets( indices )
+    ( bpts, vals ) = ( self.base_pair_types, self.parameter_values.tolist() )
+    for ( a, n ) in Kd_targets: bpts[ a ].Kd = vals[ n ]
+    for ( a, b, n ) in C_eff_stack_targets: self.C_eff_stack[ bpts[ a ] ][ bpts[ b ] ] = vals[ n ]
+    for ( tag, n ) in scalar_targets: setattr( self, tag, vals[ n ] )
 
@@ -1,22 +1,34 @@
 from __future__ import print_function
-from .backtrack  import mfe, boltzmann_sample, enumerative_backtrack
-from .parameters import get_params
+from .backtrack  import mfe, enumerative_backtrack, suboptimal_structures
+from .parameters import get_params_snapshot
 from .util.wrapped_array  import WrappedArray, initialize_matrix
 from .util.secstruct_util import *
 from .util.output_util    import _show_results, _show_matrices
 from .util.sequence_util  import initialize_sequence_and_ligated, initialize_all_ligated, get_num_strand_connections
 from .util.constants import KT_IN_KCAL
 from .util.assert_equal import assert_equal
+from .util.deriv_check import check_log_derivs
 from .derivatives import _get_log_derivs
+from .recursions.semiring import SUM_PRODUCT, MAX_PRODUCT, get_semiring
+from .util.run_monitor import RunMonitor, check_interrupt, get_deadline
+from .util.profiling import install_profiling, run_profiled
+from .util.memory_util import MemoryReport, get_peak_rss
+from .sampling import get_sampler, sample_blocks
+from .ensemble import StructureEnsemble, secstructs_from_pair_tables
 
-from math import log, exp
+from math import log
+import random
+import time
 
 ##################################################################################################
 def partition( sequences, circle = False, params = '', mfe = False, calc_bpp = False,
                n_stochastic = 0, do_enumeration = False, structure = None, force_base_pairs = None, no_coax = False,
                verbose = False,  suppress_all_output = False,
-               deriv_params = None,
-               calc_Kd_deriv_DP = False, use_simple_recursions = False, deriv_check = False  ):
+               deriv_params = None, deriv_method = 'analytic',
+               calc_Kd_deriv_DP = False, use_simple_recursions = False, deriv_check = False,
+               semiring = 'sum_product',
+               progress_callback = None, progress_step = 0.0, cancel_token = None, timeout = None,
+               profile = False, n_workers = 1, seed = None, energy_band = None, max_structures = None ):
     '''
     Wrapper function into Partition() class
     Returns Partition object p which holds results like:
@@ -25,14 +37,42 @@ def partition( sequences, circle = False, params = '', mfe = False, calc_bpp = F
       p.bpp = matrix of base pair probabilities (if requested by user with calc_bpp = True)
       p.struct_MFE = minimum free energy secondary structure in dot-parens notation
       p.bps_MFE  = minimum free energy secondary structure as sorted list of base pairs
+      p.dG_MFE   = free energy of minimum free energy structure
       p.dZ_dKd_DP = derivative of Z w.r.t. Kd computed in-line with dynamic programming (if requested by user with calc_Kd_deriv_DP = True)
 
+    deriv_method = how p.log_derivs, d(log Z)/d(log parameter) for deriv_params, are computed:
+                    'analytic' (default, closed-form expressions in derivatives.py),
+                    'adjoint'  (outside sweep back through the recursions, see reverse_derivs.py), or
+                    'forward'  (refill with tangents, see forward_derivs.py).
+
+    semiring = 'sum_product' (default, Z is partition function),
+               'max_product' (Z is Boltzmann weight of MFE structure),
+               'counting'    (Z is number of secondary structures), or
+               'counting_states' (Z is number of states, e.g., with and without each coaxial stack).
+
+    progress_callback = function called with a PartitionProgress (elapsed time, eta, ...) after each
+                         anti-diagonal of the dynamic programming, or every progress_step of the work (e.g. 0.01).
+    cancel_token      = CancellationToken; calling its cancel() stops the calculation with PartitionCancelled
+    timeout           = wall-clock seconds, after which the calculation stops with PartitionTimeout
+
+    profile = record time, calls, inner-loop iterations and zero-skips of each recursion, and time of
+               post-processing, in p.stats (a PartitionStats; see util/profiling.py). p.stats.to_json() dumps it.
+
+    n_workers = processes for stochastic sampling (n_stochastic), forked to share the filled matrices.
+    seed      = seed for stochastic sampling; with a seed, samples are the same for any n_workers.
+
+    energy_band    = list structures within energy_band (kcal/mol) of the MFE, in order of free energy, and/or
+    max_structures = list the max_structures most probable structures, in p.struct_suboptimal and p.dG_suboptimal.
+                      p.suboptimal_structures() is the generator behind these, for streaming.
     '''
-    if isinstance(params,str): params = get_params( params, suppress_all_output )
-    if no_coax:                params.K_coax = 0.0
+    if isinstance(params,str): params = get_params_snapshot( params, suppress_all_output )
+    params = params.get_snapshot( K_coax = 0.0 ) if no_coax else params.get_snapshot()
 
     p = Partition( sequences, params )
-    p.calc_all_elements = calc_bpp or (deriv_params != None)
+    p.options.semiring = get_semiring( semiring )
+    do_suboptimal = ( energy_band != None or max_structures != None )
+    assert( p.options.semiring == SUM_PRODUCT or not ( calc_bpp or deriv_params != None or n_stochastic > 0 or do_enumeration or do_suboptimal ) )
+    p.calc_all_elements = calc_bpp or (deriv_params != None and deriv_method == 'analytic')
     p.use_simple_recursions = use_simple_recursions
     p.circle    = circle
     p.options.calc_deriv_DP = calc_Kd_deriv_DP
@@ -40,12 +80,19 @@ def partition( sequences, circle = False, params = '', mfe = False, calc_bpp = F
     p.force_base_pairs = get_structure_string( force_base_pairs )
     p.suppress_all_output = suppress_all_output
     p.deriv_params = deriv_params
+    p.deriv_method = deriv_method
     p.deriv_check  = deriv_check
+    p.progress_callback = progress_callback
+    p.progress_step = progress_step
+    p.cancel_token = cancel_token
+    p.deadline = get_deadline( timeout )
+    p.profile = profile
     p.run()
     if calc_bpp:         p.get_bpp_matrix()
-    if mfe:              p.calc_mfe()
-    if n_stochastic > 0: p.stochastic_backtrack( n_stochastic )
-    if do_enumeration:   p.enumerative_backtrack()
+    if mfe:              p.check_interrupt(); p.calc_mfe()
+    if n_stochastic > 0: p.check_interrupt(); p.stochastic_backtrack( n_stochastic, n_workers, seed )
+    if do_enumeration:   p.check_interrupt(); p.enumerative_backtrack()
+    if do_suboptimal:    p.check_interrupt(); p.calc_suboptimal( energy_band, max_structures )
     if verbose:          p.show_matrices()
     if not suppress_all_output: p.show_results()
     p.run_cross_checks()
@@ -75,7 +122,17 @@ class Partition:
         self.structure = None
         self.force_base_pairs = None
         self.deriv_params = None
+        self.deriv_method = 'analytic' # or 'adjoint' (reverse_derivs.py), 'forward' (forward_derivs.py)
+        self.deriv_check = False
         self.options = PartitionOptions()
+        self.progress_callback = None # see util/run_monitor.py
+        self.progress_step = 0.0
+        self.cancel_token = None
+        self.deadline = None
+        self.profile = False
+        self.stats   = None # PartitionStats, if profile
+        self.base_pair_weights = None # { (i,j): extra factor } on base pairs, keyed by both (i,j) and (j,i), e.g. tangents in observable_derivs.py
+        self.peak_rss = []  # ( phase, peak RSS before, peak RSS after )
 
         # for output:
         self.Z       = 0
@@ -83,8 +140,14 @@ class Partition:
         self.bpp     = []
         self.bps_MFE = []
         self.struct_MFE = ''
+        self.dG_MFE  = None
         self.struct_stochastic = []
+        self.stochastic_pair_tables = None # int16 array, one row per sample; see sampling.py and ensemble.py
+        self.sampler = None
         self.struct_enumerate  = []
+        self.struct_suboptimal = []
+        self.dG_suboptimal     = []
+        self.max_product_partition = None # cached by get_max_product_partition()
         self.log_derivs = []
         self.derivs     = []
         return
@@ -94,32 +157,63 @@ class Partition:
         '''
         Do the dynamic programming to fill partition function matrices
         '''
+        if self.options.semiring.weight:
+            # e.g., counting semiring -- all Boltzmann weights become unity.
+            self.params = self.options.semiring.weighted_params( self.params )
+            self.base_pair_types = self.params.base_pair_types
+        peak_rss_before = get_peak_rss()
         initialize_sequence_information( self ) # N, sequence, ligated, all_ligated
         initialize_dynamic_programming_matrices( self ) # ( Z_BP, C_eff, Z_linear, Z_cut, Z_coax, etc. )
         initialize_force_base_pair( self )
+        self.peak_rss.append( ( 'initialize', peak_rss_before, get_peak_rss() ) )
 
         # do the dynamic programming
+        peak_rss_before = get_peak_rss()
+        start_time = time.time()
+        monitor = get_run_monitor( self ) # None, unless progress reports, cancellation or timeout are requested
         for offset in range( 1, self.N ): #length of subfragment
             for i in range( self.N ):     #index of subfragment
                 if (not self.calc_all_elements) and ( i + offset ) >= self.N: continue
+                if monitor != None: monitor.check()
                 j = (i + offset) % self.N;  # N cyclizes
                 for Z in self.Z_all: Z.update( self, i, j )
+            if monitor != None: monitor.finished_diagonal( offset )
 
+        if monitor != None: monitor.check()
         for i in range( self.N): self.Z_final.update( self, i )
+        if self.stats != None: self.stats.add( 'fill', time.time() - start_time )
+        self.peak_rss.append( ( 'fill', peak_rss_before, get_peak_rss() ) )
 
         self.log_derivs = self.get_log_derivs( self.deriv_params )
         fill_in_outputs( self )
 
     # boring member functions -- defined later.
-    def get_bpp_matrix( self ): _get_bpp_matrix( self ) # fill base pair probability matrix
-    def calc_mfe( self ): _calc_mfe( self )
-    def stochastic_backtrack( self, N ): _stochastic_backtrack( self, N )
-    def enumerative_backtrack( self ): _enumerative_backtrack( self )
+    def get_bpp_matrix( self ): run_profiled( self, 'get_bpp_matrix', _get_bpp_matrix ) # fill base pair probability matrix
+    def calc_mfe( self ): run_profiled( self, 'calc_mfe', _calc_mfe )
+    def stochastic_backtrack( self, N, n_workers = 1, seed = None ): run_profiled( self, 'stochastic_backtrack', _stochastic_backtrack, N, n_workers, seed )
+    def sample_structures( self, N, seed = None, n_workers = 1 ): return run_profiled( self, 'sample_structures', _sample_structures, N, seed, n_workers )
+    def enumerative_backtrack( self ): run_profiled( self, 'enumerative_backtrack', _enumerative_backtrack )
+    def suboptimal_structures( self, energy_band = None, max_structures = None ): return suboptimal_structures( self, energy_band, max_structures ) # generator of ( bps, p )
+    def calc_suboptimal( self, energy_band = None, max_structures = None ): run_profiled( self, 'calc_suboptimal', _calc_suboptimal, energy_band, max_structures )
+    def get_max_product_partition( self ): return _get_max_product_partition( self )
+    def get_structure_ensemble( self ): return StructureEnsemble( self.stochastic_pair_tables ) # unique structures, pairing frequencies, centroid, MEA
     def show_results( self ): _show_results( self )
     def show_matrices( self ): _show_matrices( self )
-    def get_log_derivs( self, deriv_params ): return _get_log_derivs( self, deriv_params )
+    def get_log_derivs( self, deriv_params ): return run_profiled( self, 'get_log_derivs', _get_log_derivs_by_method, deriv_params ) # see deriv_method
+    def get_forward_log_derivs( self, deriv_params = None ): return run_profiled( self, 'get_forward_log_derivs', _get_forward_log_derivs, deriv_params ) # refill with tangents
+    def get_log_hessian( self, deriv_params = None ): return run_profiled( self, 'get_log_hessian', _get_log_hessian, deriv_params ) # P x P, refill with Tangent2
+    def get_log_hessian_vector_product( self, deriv_params, v ): return run_profiled( self, 'get_log_hessian_vector_product', _get_log_hessian_vector_product, deriv_params, v ) # P, refill with CrossTangent
+    def get_fisher_matrix( self, deriv_params = None ): return self.get_log_hessian( deriv_params ) # covariance of feature counts
+    def get_bpp_log_derivs( self, bps, deriv_params = None ): return run_profiled( self, 'get_bpp_log_derivs', _get_bpp_log_derivs, bps, deriv_params ) # K x P, outside sweep
+    def get_unpaired_log_derivs( self, deriv_params = None, weights = None ): return run_profiled( self, 'get_unpaired_log_derivs', _get_unpaired_log_derivs, deriv_params, weights ) # N x P, or P for weights
     def run_cross_checks( self ): _run_cross_checks( self )
     def num_strand_connections( self ):  return get_num_strand_connections( self.sequences, self.circle)
+    def check_interrupt( self ): check_interrupt( self.cancel_token, self.deadline )
+    def get_memory_report( self, target_N = None ): return MemoryReport( self, target_N ) # bytes held, peak RSS, projection to target_N
+
+def get_run_monitor( self ):
+    if self.progress_callback == None and self.cancel_token == None and self.deadline == None: return None
+    return RunMonitor( self.N, self.calc_all_elements, self.progress_callback, self.progress_step, self.cancel_token, self.deadline )
 
 ##################################################################################################
 def fill_in_outputs( self ):
@@ -157,6 +251,8 @@ class PartitionOptions:
     def __init__( self ):
         self.calc_deriv_DP = False
         self.calc_contrib  = False
+        self.calc_loop_counts = False # see util/profiling.py
+        self.semiring      = SUM_PRODUCT
 
 ##################################################################################################
 def initialize_dynamic_programming_matrices( self ):
@@ -209,6 +305,11 @@ def initialize_dynamic_programming_matrices( self ):
 
     self.params.check_C_eff_stack()
 
+    if self.base_pair_weights != None:
+        from .observable_derivs import install_base_pair_weights
+        install_base_pair_weights( self )
+    if self.profile: install_profiling( self )
+
 ##################################################################################################
 def initialize_force_base_pair( self ):
     self.allow_base_pair     = None
@@ -281,59 +382,100 @@ def _get_bpp_matrix( self ):
 def _calc_mfe( self ):
     '''
      Wrapper into mfe(), written out in backtrack.py
-     Note that this is not *quite* MFE -- would have to rerun dynamic programming with max() instead of sum over Z
-     And that means that backtracking from different points can lead to different apparent MFE's -- for example
-      a fully unfolded structure can be accumulated with a bunch of dinky hairpins to win over the actual MFE.
-    Example case:
-         CAAUGCUCAUUGGG G --circle
-    vs.
-         GCAAUGCUCAUUGGG
+     Dynamic programming is rerun with max() instead of sum over Z (see recursions/semiring.py), which
+      stores a backpointer to the best contribution at each (i,j). The MFE structure then comes out of an
+      O(N) traceback, and is exact -- no need to backtrack from different points as in the partition function.
+     If there are ties for the MFE structure, the first contribution encountered wins.
     '''
     N = self.N
-    p_MFE   = [0.0]*N
-    bps_MFE = [[]]*N
+    (bps_MFE, Q_MFE) = mfe( self.get_max_product_partition() )
+
+    self.bps_MFE = bps_MFE
+    self.struct_MFE = secstruct_from_bps( bps_MFE, N )
+    self.dG_MFE = -KT_IN_KCAL * log( Q_MFE ) if Q_MFE > 0.0 else None
 
-    # there are actually numerous ways to calculate MFE if we did all N^2 elements -- let's check.
-    n_test = N if self.calc_all_elements else 1
     if not self.suppress_all_output:
         print()
         print('Doing backtrack to get minimum free energy structure:')
         print(self.sequence)
+        if self.options.semiring.max_product: print( self.struct_MFE, "   ", self.dG_MFE, "[MFE]")
+        else: print( self.struct_MFE, "   ", Q_MFE/self.Z_final.val(0), "[MFE]")
+        print()
+
+def get_max_product_partition( self ):
+    '''
+    Same calculation as Partition self, but with dynamic programming in the max-product semiring.
+    '''
+    p = Partition( self.sequences, self.params )
+    p.options.semiring = MAX_PRODUCT
+    p.circle = self.circle
+    p.use_simple_recursions = self.use_simple_recursions
+    p.calc_all_elements = self.calc_all_elements
+    p.structure = self.structure
+    p.force_base_pairs = self.force_base_pairs
+    p.suppress_all_output = True
+    p.cancel_token = self.cancel_token
+    p.deadline = self.deadline
+    p.run()
+    p.run_cross_checks()
+    return p
 
-    all_bps_MFE = set()
-    for i in range( n_test ):
-        (bps_MFE[i], p_MFE[i] ) = mfe( self, self.Z_final.get_contribs(self,i) )
-        if len(all_bps_MFE) > 0 and not ( tuple(bps_MFE[i]) in all_bps_MFE ):
-            if not self.suppress_all_output:
-                print( 'Warning, MFE structure computed only approximately from partition, and another structure had been found backtracking from position %d:' % i )
-                print( secstruct_from_bps(bps_MFE[i],N), "   ", p_MFE[i], "[MFE?]")
-        all_bps_MFE.add( tuple(bps_MFE[i]) )
-        #assert_equal( p_MFE[i], p_MFE[0] )
-        # actually this doesn't always hold -- in some parameter sets and sequences there are literally ties.
-        # assert( bps_MFE[i] == bps_MFE[0] )
+def _get_max_product_partition( self ):
+    if self.options.semiring.max_product: return self
+    if self.max_product_partition == None: self.max_product_partition = get_max_product_partition( self )
+    return self.max_product_partition
 
-    if not self.suppress_all_output:
-        print( secstruct_from_bps(bps_MFE[0],N), "   ", p_MFE[0], "[MFE]")
-        print()
-    self.bps_MFE = bps_MFE[0]
-    self.struct_MFE = secstruct_from_bps( bps_MFE[0], N)
+##################################################################################################
+def _calc_suboptimal( self, energy_band = None, max_structures = None ):
+    '''
+    Structures in order of free energy, within energy_band of the MFE and/or the top max_structures,
+     from the generator suboptimal_structures() in backtrack.py.
+    '''
+    self.struct_suboptimal = []
+    self.dG_suboptimal = []
+    for ( bps, p ) in self.suboptimal_structures( energy_band, max_structures ):
+        self.check_interrupt()
+        self.struct_suboptimal.append( secstruct_from_bps( bps, self.N ) )
+        self.dG_suboptimal.append( self.dG - KT_IN_KCAL * log( p ) )
+    if self.suppress_all_output: return
+
+    print()
+    print('Doing best-first backtrack to get structures in order of free energy')
+    print(self.sequence)
+    for ( struct, dG ) in zip( self.struct_suboptimal, self.dG_suboptimal ):
+        print(struct, "   ", dG, "[suboptimal]")
+    print()
 
 ##################################################################################################
-def _stochastic_backtrack( self, N_backtrack ):
+def _stochastic_backtrack( self, N_backtrack, n_workers = 1, seed = None ):
     #
     # Get stochastic, Boltzmann-weighted structural samples from partition function
     #
+    ( pair_tables, probabilities ) = self.sample_structures( N_backtrack, seed, n_workers )
+    self.stochastic_pair_tables = pair_tables
+    self.struct_stochastic = secstructs_from_pair_tables( pair_tables )
+    if self.suppress_all_output: return
+
     print()
     print('Doing',N_backtrack,'stochastic backtracks to get Boltzmann-weighted ensemble')
     print(self.sequence)
-    for i in range( N_backtrack ):
-        bps, p = boltzmann_sample( self, self.Z_final.get_contribs(self,0) )
-        print(secstruct_from_bps(bps,self.N), "   ", p, "[stochastic]")
-        self.struct_stochastic.append( secstruct_from_bps(bps,self.N) )
+    for ( struct, p ) in zip( self.struct_stochastic, probabilities ):
+        print(struct, "   ", p, "[stochastic]")
     print()
 
     return
 
+def _sample_structures( self, N_samples, seed = None, n_workers = 1 ):
+    '''
+    Draw N_samples Boltzmann-weighted structures, as ( pair_tables, probabilities ) -- see BoltzmannSampler
+     in sampling.py. Sampling tables built for each cell are kept in self.sampler and reused by later calls.
+     A seed gives the same samples every time, for any n_workers (worker processes); without one,
+     several workers still get independent streams, from a seed drawn here.
+    '''
+    if seed == None and n_workers > 1: seed = random.getrandbits( 64 )
+    if seed != None: return sample_blocks( self, N_samples, seed, n_workers )
+    return get_sampler( self ).sample( N_samples )
+
 ##################################################################################################
 def _enumerative_backtrack( self ):
     #
@@ -351,6 +493,67 @@ def _enumerative_backtrack( self ):
     assert( abs(p_tot - 1.0) < 1.0e-5 )
     return
 
+##################################################################################################
+def _get_log_derivs_by_method( self, deriv_params ):
+    if self.deriv_method == 'adjoint':
+        from .reverse_derivs import get_adjoint_log_derivs
+        return get_adjoint_log_derivs( self, deriv_params )
+    if self.deriv_method == 'forward':
+        if deriv_params == None: return None
+        if deriv_params == []: deriv_params.extend( self.params.parameter_tags )
+        return _get_forward_log_derivs( self, deriv_params )
+    return _get_log_derivs( self, deriv_params )
+
+def _get_forward_log_derivs( self, deriv_params = None ):
+    '''
+    d( log Z )/d( log parameter ) in forward mode (see forward_derivs.py), for the same fold as self.
+    '''
+    from .forward_derivs import forward_log_derivs
+    ( log_derivs, Z ) = forward_log_derivs( self.sequences, deriv_params, circle = self.circle, params = self.params,
+                                            structure = self.structure, force_base_pairs = self.force_base_pairs,
+                                            use_simple_recursions = self.use_simple_recursions, suppress_all_output = True )
+    return log_derivs
+
+def _get_log_hessian( self, deriv_params = None ):
+    '''
+    d2( log Z )/d( log parameter )^2 (see forward_log_hessian() in forward_derivs.py), for the same fold as self.
+    Also the covariance of the feature counts that the parameters control (Fisher information).
+    '''
+    from .forward_derivs import forward_log_hessian
+    ( hessian, log_derivs, Z ) = forward_log_hessian( self.sequences, deriv_params, circle = self.circle, params = self.params,
+                                                      structure = self.structure, force_base_pairs = self.force_base_pairs,
+                                                      use_simple_recursions = self.use_simple_recursions, suppress_all_output = True )
+    return hessian
+
+def _get_log_hessian_vector_product( self, deriv_params, v ):
+    '''
+    d2( log Z )/d( log parameter )^2 times v (see forward_log_hessian_vector_product() in forward_derivs.py), for the
+     same fold as self -- O( P ) per operation, without forming the Hessian.
+    '''
+    from .forward_derivs import forward_log_hessian_vector_product
+    ( hessian_vector_product, log_derivs, Z ) = forward_log_hessian_vector_product( self.sequences, deriv_params, v, circle = self.circle, params = self.params,
+                                                                                    structure = self.structure, force_base_pairs = self.force_base_pairs,
+                                                                                    use_simple_recursions = self.use_simple_recursions, suppress_all_output = True )
+    return hessian_vector_product
+
+def _get_bpp_log_derivs( self, bps, deriv_params = None ):
+    '''
+    d( bpp(i,j) )/d( log parameter ) for base pairs bps = [ (i,j), ... ] (see observable_derivs.py), from an outside sweep over self.
+    '''
+    from .observable_derivs import get_observable_log_derivs, get_bpp_pair_weights
+    ( bpp, jacobian ) = get_observable_log_derivs( self, get_bpp_pair_weights( bps ), deriv_params )
+    return jacobian
+
+def _get_unpaired_log_derivs( self, deriv_params = None, weights = None ):
+    '''
+    d( unpaired probability )/d( log parameter ) of each nucleotide -- or, with weights, of sum_i weights[i] x unpaired
+     probability of i, which needs a single extra direction in the sweep (e.g., weights = d(loss)/d(unpaired probability)).
+    '''
+    from .observable_derivs import get_observable_log_derivs, get_unpaired_pair_weights, get_unpaired_from_observables
+    derivs = get_observable_log_derivs( self, get_unpaired_pair_weights( self.N, weights ), deriv_params )
+    ( unpaired, jacobian ) = get_unpaired_from_observables( derivs, weights )
+    return jacobian
+
 ##################################################################################################
 def _run_cross_checks( self ):
     # stringent test that partition function is correct -- all the Z(i,i) agree.
@@ -381,26 +584,6 @@ def _run_cross_checks( self ):
         p_shift = partition( self.sequences, circle = self.circle, params = self.params, mfe = False, suppress_all_output = True, structure = self.structure, force_base_pairs = self.force_base_pairs )
         print( 'Check logZ value upon recomputation: ',logZ_val, 'vs', log(p_shift.Z) )
         assert_equal( logZ_val, log(p_shift.Z) )
-        analytic_grad_val = self.log_derivs
-        epsilon = 1.0e-8
-        numerical_grad_val = []
-        for n,param in enumerate( self.deriv_params ):
-            save_val = self.params.get_parameter_value( param )
-            if save_val == 0.0:
-                numerical_grad_val.append( 0.0 )
-                continue
-            self.params.set_parameter( param,  exp( log(save_val) + epsilon ) )
-            p_shift = partition( self.sequences, circle = self.circle, params = self.params, mfe = False, suppress_all_output = True, structure = self.structure, force_base_pairs = self.force_base_pairs )
-            numerical_grad_val.append( ( log( p_shift.Z ) - logZ_val ) / epsilon )
-            self.params.set_parameter( param, save_val )
-
-        print()
-        print( '%20s %25s %25s' % ('','','d(logZ)/d(log parameter)' ) )
-        print( '%20s %25s %25s %25s' % ('parameter','analytic','numerical', 'diff' ) )
-        for i,parameter in enumerate(self.deriv_params):
-               print( '%20s %25.12f %25.12f %25.12f' % (parameter, analytic_grad_val[i], numerical_grad_val[i], analytic_grad_val[i] - numerical_grad_val[i] ) )
-        print()
-        for val1,val2 in zip(analytic_grad_val,numerical_grad_val):
-            if abs( val1 ) > 0.001:
-                if abs( val1 - val2 )/val2 > 1.0e-3: print( 'ISSUE!!', val1, val2 )
-                assert_equal( val1, val2, 1.0e-3 ) # seeing numerical issues for very small vals
+        log_Z = lambda params: log( partition( self.sequences, circle = self.circle, params = params, mfe = False, suppress_all_output = True, structure = self.structure, force_base_pairs = self.force_base_pairs ).Z )
+        forward_grad_val = self.get_forward_log_derivs( self.deriv_params )
+        check_log_derivs( log_Z, self.params, self.deriv_params, self.log_derivs, other_derivs = { 'forward': forward_grad_val } )
@@ -0,0 +1,128 @@
+from __future__ import print_function
+import numpy as np
+from .parameters import get_params
+from .partition import Partition
+from .base_pair_types import get_base_pair_type_for_tag
+from .util.secstruct_util import get_structure_string
+from .util.sequence_util import initialize_sequence_and_ligated
+from .recursions.polynomial import Polynomial, Reciprocal
+
+# parameters that show up as plain factors in the recursions, and the feature they count
+polynomial_parameters = { 'C_init': 'loops', 'l': 'linkages in loops', 'l_BP': 'base pairs in loops',
+                          'K_coax': 'coaxial stacks', 'l_coax': 'coaxial stacks in loops',
+                          'C_eff_stacked_pair': 'stacked pairs' }
+
+##################################################################################################
+def partition_polynomial( sequences, param = 'Kd', circle = False, params = '', max_count = None,
+                          structure = None, force_base_pairs = None, no_coax = False, suppress_all_output = False ):
+    '''
+    Partition function as an explicit polynomial in one parameter, obtained in a single fill of the
+     dynamic programming matrices in which each cell holds a truncated polynomial (see recursions/polynomial.py):
+
+        Z( val ) = sum_k  coeffs[k] * x^k,      x = val  (or x = 1/val for Kd parameters)
+
+     where k counts the features controlled by param:
+
+        Kd, Kd_CG, ...      base pairs (of that type; 'Kd' requires all Kd to be the same)
+        C_init              loops
+        l                   linkages in loops
+        l_BP                base pairs in loops
+        K_coax              coaxial stacks
+        l_coax              coaxial stacks in loops
+        C_eff_stacked_pair  stacked pairs (all C_eff_stack values are set to this parameter)
+
+    max_count = truncate polynomials at this many features (default: N, which is exact)
+
+    Returns PartitionPolynomial object p, from which Z and the distribution of feature counts
+     at any new value of param come from a dot product, with no refolding:
+
+      p.coeffs = polynomial coefficients
+      p.Z      = partition function at current value of param
+      p.get_Z( val ), p.get_feature_distribution( val ), p.get_mean_count( val )
+    '''
+    if isinstance(params,str): params = get_params( params, suppress_all_output )
+    params = params.get_mutable_copy()
+    if no_coax: params.K_coax = 0.0
+
+    if max_count == None: max_count = len( initialize_sequence_and_ligated( sequences, circle )[0] )
+    val = set_polynomial_parameter( params, param, max_count )
+
+    p = Partition( sequences, params )
+    p.circle = circle
+    p.structure = get_structure_string( structure )
+    p.force_base_pairs = get_structure_string( force_base_pairs )
+    p.suppress_all_output = True
+    p.run()
+
+    Z = p.Z_final.val( 0 )
+    if not isinstance( Z, Polynomial ): Z = Polynomial( [ Z ], max_count ) # no way to form feature
+    p_poly = PartitionPolynomial( param, val, Z.coeffs )
+    if not suppress_all_output: p_poly.show_results()
+    return p_poly
+
+def set_polynomial_parameter( params, param, max_count ):
+    '''
+    Replace param in AlphaFoldParams by polynomial variable x, and return current value of param.
+    '''
+    if param[:2] == 'Kd':
+        if param == 'Kd':
+            base_pair_types = params.base_pair_types
+            for base_pair_type in base_pair_types: assert( base_pair_type.Kd == base_pair_types[0].Kd )
+        else:
+            base_pair_type = get_base_pair_type_for_tag( params, param[3:] )
+            assert( base_pair_type != None )
+            base_pair_types = [ base_pair_type, base_pair_type.flipped ]
+        val = base_pair_types[ 0 ].Kd
+        x = Reciprocal( Polynomial( [ 0.0, 1.0 ], max_count, 1.0/val ) )
+        for base_pair_type in base_pair_types: base_pair_type.Kd = x
+    elif param == 'C_eff_stacked_pair':
+        val = params.get_parameter_value( param )
+        if val == None:
+            untied_tags = [ tag for tag in params.parameter_tags if tag[:11] == 'C_eff_stack' ]
+            raise ValueError( 'C_eff_stacked_pair requires all C_eff_stack values tied to one parameter, but these parameters set them separately: %s' % ', '.join( untied_tags ) )
+        x = Polynomial( [ 0.0, 1.0 ], max_count, val )
+        for bpt1 in params.base_pair_types:
+            for bpt2 in params.base_pair_types: params.C_eff_stack[ bpt1 ][ bpt2 ] = x
+    else:
+        assert( param in polynomial_parameters )
+        val = getattr( params, param )
+        setattr( params, param, Polynomial( [ 0.0, 1.0 ], max_count, val ) )
+    return val
+
+##################################################################################################
+class PartitionPolynomial:
+    '''
+    Z( val ) = sum_k coeffs[k] x^k, where x = val, or 1/val for Kd parameters.
+    '''
+    def __init__( self, param, val, coeffs ):
+        self.param  = param
+        self.val    = val
+        self.coeffs = np.array( coeffs )
+        self.Z      = self.get_Z( val )
+
+    def get_x( self, val ): return 1.0/val if self.param[:2] == 'Kd' else val
+
+    def get_Z( self, val ):
+        return np.dot( self.coeffs, self.get_x( val ) ** np.arange( len( self.coeffs ) ) )
+
+    def get_feature_distribution( self, val ):
+        '''
+        probability of k features, at parameter value val
+        '''
+        weights = self.coeffs * self.get_x( val ) ** np.arange( len( self.coeffs ) )
+        return weights / np.sum( weights )
+
+    def get_mean_count( self, val ):
+        '''
+        same as d( log Z )/d( log val ) -- or minus that, for Kd parameters.
+        '''
+        return np.dot( np.arange( len( self.coeffs ) ), self.get_feature_distribution( val ) )
+
+    def show_results( self ):
+        feature = 'base pairs' if self.param[:2] == 'Kd' else polynomial_parameters[ self.param ]
+        print( 'Z as polynomial in %s ( currently %s ), by number of %s:' % ( 'x = 1/'+self.param if self.param[:2] == 'Kd' else self.param, self.val, feature ) )
+        distribution = self.get_feature_distribution( self.val )
+        for k, coeff in enumerate( self.coeffs ):
+            if coeff > 0.0: print( '%5d %25.12g %12.6f' % ( k, coeff, distribution[ k ] ) )
+        print( 'Z =', self.Z )
+        print()
@@ -0,0 +1,227 @@
+##################################################################################################
+# batch_recursions.py = same recursions as recursions.py, but written with NumPy so that each
+#                        update fills a whole anti-diagonal (all i with j = i + offset) of the
+#                        dynamic programming matrices at once, for a whole batch of problems.
+#
+# Every matrix carries a leading batch axis, e.g. Z_BP[ b, i, j ], and Z_BPq[ b, q, i, j ] for base pair type q.
+# Sequence information ( ligated, base pair matches ) has leading axis of size B or 1, and so do the
+#  energy parameters -- so the batch can be over sequences, or over parameter sets for one sequence.
+# Cells on the same anti-diagonal never depend on each other, only on shorter fragments and
+#  on matrices earlier in the update order for the same cell.
+#
+# Keep in sync with recursions.py! Tested against explicit recursions in tests_zetafold.py.
+##################################################################################################
+import numpy as np
+
+def diagonal_k( I, start, stop ):
+    '''
+    For each i in I, the values k = i+start ... i+stop-1, as an array of shape ( len(I), stop-start ).
+    Indices are not wrapped -- apply %N before using them to look up matrices.
+    '''
+    return I[:,None] + np.arange( start, stop )[None,:]
+
+##################################################################################################
+def update_Z_cut( self, I, J, offset ):
+    '''
+    Z_cut is the partition function for independently combining one contiguous/bonded segment emerging out of i to a cutpoint c, and another segment that goes from c+1 to j.
+    '''
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+
+    # strand 1  (i --> c), strand 2  (c+1 -- > j); no Z_linear factor if strand is just one nucleotide.
+    C = diagonal_k( I, 0, offset )
+    r = np.arange( offset )
+    Z_linear_1 = np.where( r == 0,        1.0, Z_linear[ :, (I[:,None]+1)%N, C%N ] )
+    Z_linear_2 = np.where( r == offset-1, 1.0, Z_linear[ :, (C+1)%N, (J[:,None]-1)%N ] )
+    Z_cut[ :, I, J ] = np.sum( ( 1.0 - ligated[ :, C%N ] ) * Z_linear_1 * Z_linear_2, axis = 2 )
+
+##################################################################################################
+def update_Z_BPq( self, I, J, offset ):
+    '''
+    Z_BPq is the partition function for all structures that base pair i and j with base_pair_type q.
+    All base pair types are filled at once -- only 1/Kd and stacking depend on q.
+    '''
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    ( C_eff_for_coax, C_eff_for_BP ) = (C_eff, C_eff ) if allow_strained_3WJ else (C_eff_no_BP_singlet, C_eff_no_coax_singlet )
+
+    Ip1 = (I+1) % N
+    Jm1 = (J-1) % N
+    closes_loop = ligated[ :, I ] * ligated[ :, Jm1 ]
+
+    # base pair closes a loop
+    Z = closes_loop * C_eff_for_BP[ :, Ip1, Jm1 ] * l * l * l_BP
+
+    # base pair brings together two strands that were previously disconnected
+    Z = Z + C_std * Z_cut[ :, I, J ]
+
+    if self.coax:
+        # coaxial stack of bp (i,j) and (i+1,k), and closes loop on right; or stack of bp (i,j) and (k,j-1), and closes loop on left.
+        K = diagonal_k( I, 2, offset-1 )
+        Z_coax_loop = np.sum( ligated[ :, K%N ] * Z_BP[ :, Ip1[:,None], K%N ] * C_eff_for_coax[ :, (K+1)%N, Jm1[:,None] ], axis = 2 ) + \
+                      np.sum( ligated[ :, (K-1)%N ] * C_eff_for_coax[ :, Ip1[:,None], (K-1)%N ] * Z_BP[ :, K%N, Jm1[:,None] ], axis = 2 )
+        Z = Z + closes_loop * Z_coax_loop * l**2 * l_coax * K_coax
+
+        # "left stack" but no loop closed on right (free strands hanging off j end)
+        K = diagonal_k( I, 2, offset )
+        Z = Z + ligated[ :, I ] * np.sum( Z_BP[ :, Ip1[:,None], K%N ] * Z_cut[ :, K%N, J[:,None] ], axis = 2 ) * C_std * K_coax
+
+        # "right stack" but no loop closed on left (free strands hanging off i end)
+        K = diagonal_k( I, 0, offset-1 )
+        Z = Z + ligated[ :, Jm1 ] * np.sum( Z_cut[ :, I[:,None], K%N ] * Z_BP[ :, K%N, Jm1[:,None] ], axis = 2 ) * C_std * K_coax
+
+    # base pair forms a stacked pair with previous pair -- weight summed over all types q2 matching sequence at (i+1,j-1).
+    stack = np.sum( self.C_eff_stack[ :, :, :, None ] * self.match[ :, :, Ip1, Jm1 ][ :, None ], axis = 2 )
+    Z_stack = ( closes_loop * Z_BP[ :, Ip1, Jm1 ] )[ :, None ] * stack
+
+    Z_BPq = self.Z_BPq
+    Z_BPq[ :, :, I, J ] = self.allow_pair[ :, :, I, J ] * ( Z[ :, None ] + Z_stack ) / self.Kd[ :, :, None ]
+
+##################################################################################################
+def update_Z_BP( self, I, J, offset ):
+    '''
+    Z_BP is the partition function for all structures that base pair i and j.
+    '''
+    self.Z_BP[ :, I, J ] = np.sum( self.Z_BPq[ :, :, I, J ], axis = 1 )
+
+##################################################################################################
+def update_Z_coax( self, I, J, offset ):
+    '''
+    Z_coax(i,j) is the partition function for all structures that form coaxial stacks between (i,k) and (k+1,j) for some k
+    '''
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    if not self.coax: return
+
+    K = diagonal_k( I, 1, offset-1 )
+    Z = np.sum( ligated[ :, K%N ] * Z_BP[ :, I[:,None], K%N ] * Z_BP[ :, (K+1)%N, J[:,None] ], axis = 2 ) * K_coax
+    if offset == N-1: Z = Z * ( 1.0 - ligated[ :, J ] )
+    Z_coax[ :, I, J ] = Z
+
+##################################################################################################
+def update_C_eff_basic( self, I, J, offset ):
+    '''
+    C_eff tracks the effective molarity of a loop starting at i and ending at j
+    '''
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    Jm1 = (J-1) % N
+
+    # j is not base paired or coaxially stacked: Extension by one residue from j-1 to j.
+    Z = ligated[ :, Jm1 ] * C_eff[ :, I, Jm1 ] * l
+
+    # j is base paired (or coax-stacked), and its partner is k > i.
+    K = diagonal_k( I, 1, offset )
+    C_eff_for_BP = C_eff[ :, I[:,None], (K-1)%N ]
+    if self.coax: C_eff_for_coax = C_eff_for_BP
+    if (not allow_strained_3WJ) and (offset == N-1):
+        exclude_strained_3WJ = ( ligated[ :, J ] > 0.0 )[ :, :, None ]
+        C_eff_for_BP = np.where( exclude_strained_3WJ, C_eff_no_coax_singlet[ :, I[:,None], (K-1)%N ], C_eff_for_BP )
+        if self.coax: C_eff_for_coax = np.where( exclude_strained_3WJ, C_eff_no_BP_singlet[ :, I[:,None], (K-1)%N ], C_eff_for_coax )
+    Z = Z + np.sum( ligated[ :, (K-1)%N ] * C_eff_for_BP * Z_BP[ :, K%N, J[:,None] ], axis = 2 ) * l * l_BP
+    if self.coax:
+        Z = Z + np.sum( ligated[ :, (K-1)%N ] * C_eff_for_coax * Z_coax[ :, K%N, J[:,None] ], axis = 2 ) * l * l_coax
+
+    C_eff_basic[ :, I, J ] = Z
+
+##################################################################################################
+def update_C_eff_no_coax_singlet( self, I, J, offset ):
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    C_eff_no_coax_singlet[ :, I, J ] = C_eff_basic[ :, I, J ] + C_init * Z_BP[ :, I, J ] * l_BP
+
+##################################################################################################
+def update_C_eff_no_BP_singlet( self, I, J, offset ):
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    if not self.coax: return
+    C_eff_no_BP_singlet[ :, I, J ] = C_eff_basic[ :, I, J ] + C_init * Z_coax[ :, I, J ] * l_coax
+
+##################################################################################################
+def update_C_eff( self, I, J, offset ):
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    Z = C_eff_basic[ :, I, J ] + C_init * Z_BP[ :, I, J ] * l_BP
+    if self.coax: Z = Z + C_init * Z_coax[ :, I, J ] * l_coax
+    C_eff[ :, I, J ] = Z
+
+##################################################################################################
+def update_Z_linear( self, I, J, offset ):
+    '''
+    Z_linear tracks the total partition function from i to j, assuming all intervening residues are covalently connected (or base-paired).
+    '''
+    (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    Jm1 = (J-1) % N
+
+    # j is not base paired (extension from j-1), or base paired to i
+    Z = ligated[ :, Jm1 ] * Z_linear[ :, I, Jm1 ] + Z_BP[ :, I, J ]
+
+    # j is base paired, and its partner is k > i
+    K = diagonal_k( I, 1, offset )
+    Z_linear_ik = ligated[ :, (K-1)%N ] * Z_linear[ :, I[:,None], (K-1)%N ]
+    Z = Z + np.sum( Z_linear_ik * Z_BP[ :, K%N, J[:,None] ], axis = 2 )
+
+    if self.coax:
+        # j is coax-stacked, and its partner is i or k > i.
+        Z = Z + Z_coax[ :, I, J ] + np.sum( Z_linear_ik * Z_coax[ :, K%N, J[:,None] ], axis = 2 )
+
+    Z_linear[ :, I, J ] = Z
+
+##################################################################################################
+def update_Z_final( self, i ):
+    '''
+    Z_final is total partition function, computed at end of filling dynamic programming arrays.
+    Filled for all members of the batch at one i.
+    '''
+    (C_init, l, l_BP, K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+     ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+    I   = np.array( [ i ] )
+    Im1 = (I-1) % N
+
+    # i-1 and i not ligated
+    Z_open = Z_linear[ :, I, Im1 ]
+
+    # Need to 'ligate' across i-1 to i, with Z_coax contribution removed from C_eff
+    Z = C_eff_no_coax_singlet[ :, I, Im1 ] * l / C_std
+
+    # any split segments, combined independently
+    C = diagonal_k( I, 0, N-1 )
+    Z = Z + np.sum( ( 1.0 - ligated[ :, C%N ] ) * Z_linear[ :, I[:,None], C%N ] * Z_linear[ :, (C+1)%N, Im1[:,None] ], axis = 2 )
+
+    # base pair forms a stacked pair with previous pair, across i-1 to i
+    Jx = diagonal_k( I, 1, N-1 )
+    Z_stack = np.einsum( '...pq,...pnj,...qnj->...nj', self.C_eff_stack[ :, self.flipped, : ],
+                         self.Z_BPq[ :, :, (Jx+1)%N, Im1[:,None] ], self.Z_BPq[ :, :, I[:,None], Jx%N ] )
+    Z = Z + np.sum( ligated[ :, Jx%N ] * Z_stack, axis = 2 )
+
+    if self.coax:
+        C_eff_for_coax = C_eff if allow_strained_3WJ else C_eff_no_BP_singlet
+
+        # New co-axial stack might form across ligation junction, between (i,j) and (k,i-1)
+        Jx = diagonal_k( I, 1, N-2 )[ :, :, None ]
+        Kx = diagonal_k( I, 2, N-1 )[ :, None, : ]
+        Z_BP_ij = Z_BP[ :, I[:,None,None], Jx%N ]
+        Z_BP_ki = Z_BP[ :, Kx%N, Im1[:,None,None] ]
+
+        # If the two coaxially stacked base pairs are connected by a loop.
+        loop  = ( Kx >= Jx+2 ) * ligated[ :, Jx%N ] * ligated[ :, (Kx-1)%N ] * C_eff_for_coax[ :, (Jx+1)%N, (Kx-1)%N ]
+        Z = Z + np.sum( Z_BP_ij * loop * Z_BP_ki, axis = (2,3) ) * l * l * l_coax * K_coax
+
+        # If the two stacked base pairs are in split segments
+        split = ( Kx >= Jx+1 ) * ( 1.0 - ( Kx == Jx+1 ) * ligated[ :, Jx%N ] ) * Z_cut[ :, Jx%N, Kx%N ]
+        Z = Z + np.sum( Z_BP_ij * split * Z_BP_ki, axis = (2,3) ) * K_coax
+
+    ligated_im1 = ligated[ :, Im1 ]
+    self.Z_final[ :, I ] = ( 1.0 - ligated_im1 ) * Z_open + ligated_im1 * Z
+
+##################################################################################################
+def unpack_variables( self ):
+    '''
+    Same as unpack_variables() in recursions.py, but energy parameters are
+    arrays of shape (B,1) or (1,1), and matrices are arrays with a leading batch axis.
+    '''
+    return ( self.C_init, self.l, self.l_BP, self.K_coax, self.l_coax, self.C_std, self.min_loop_length, self.allow_strained_3WJ ) + \
+           ( self.N, self.ligated, \
+             self.Z_BP,self.C_eff_basic,self.C_eff_no_BP_singlet,self.C_eff_no_coax_singlet,self.C_eff,\
+             self.Z_linear,self.Z_cut,self.Z_coax )
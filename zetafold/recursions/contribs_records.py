@@ -0,0 +1,131 @@
+import numpy as np
+from .contribs_view import get_all_matrices
+
+##################################################################################################
+# Contributions as typed records, instead of Python lists.
+#
+# The recursions give the contributions of a cell as ( weight, [ ( DP, i, j ), ... ] ). Cached in
+#  that form, each one is a tuple, a list and a tuple per branch, all holding references to matrix
+#  objects. Here they are packed into a NumPy structured array, one record per contribution:
+#
+#    weight   = Boltzmann weight of the contribution
+#    matrix   = index of the matrix of each branch in get_all_matrices( partition ), or -1 if unused
+#    i, j     = cell of each branch
+#    factor   = exponents of factor_params in the weight
+#    stack    = indices in params.base_pair_types of the C_eff_stack entry in the weight, or -1 if none
+#
+# The weight is the product of the branches' Q and of its parameter factor, i.e. factor_params to the
+#  powers in factor, times the C_eff_stack entry (times 1/Kd of the cell, for Z_BPq, and constants like
+#  C_std). explicit_recursions.py gives the factor of each contribution, worked out by
+#  create_explicit_recursions.py; contributions from dynamic_programming.py do not carry it, and get zeros.
+#
+# explicit_dynamic_programming.py caches contributions this way, sampling.py builds its tables for
+#  tracebacks directly from the records, and reverse_derivs.py sweeps adjoints through them. A Partition's traced cells can also
+#  be dumped to one flat record array (TracedContribs) that pickles cheaply, and loaded into another
+#  Partition of the same fold, which then traces back without recomputing contributions.
+##################################################################################################
+max_branches = 3 # Z_final, with a coaxial stack across the strand ends
+factor_params = [ 'C_init', 'l', 'l_BP', 'K_coax', 'l_coax' ] # same order in create_explicit_recursions.py
+
+contrib_dtype = np.dtype( [ ( 'weight', np.float64 ),
+                            ( 'matrix', np.int16, ( max_branches, ) ),
+                            ( 'i', np.int32, ( max_branches, ) ),
+                            ( 'j', np.int32, ( max_branches, ) ),
+                            ( 'factor', np.int8, ( len( factor_params ), ) ),
+                            ( 'stack', np.int8, ( 2, ) ) ] )
+
+def get_matrix_index( partition ):
+    return dict( ( id( DP ), n ) for ( n, DP ) in enumerate( get_all_matrices( partition ) ) )
+
+def get_base_pair_type_index( params ):
+    return dict( ( bpt, n ) for ( n, bpt ) in enumerate( params.base_pair_types ) )
+
+def encode_contribs( contribs, matrix_index, base_pair_type_index = None ):
+    '''
+    Records for contribs, a list of ( weight, [ ( DP, i, j ), ... ] ), or of ( weight, [ ( DP, i, j ), ... ], factor )
+     as in explicit_recursions.py, with factor = ( exponents of factor_params, ( bpt1, bpt2 ) of the C_eff_stack entry or None ).
+    matrix_index = dict from id( DP ) to matrix id; base_pair_type_index = get_base_pair_type_index( params ), needed for factors.
+    '''
+    records = np.zeros( len( contribs ), dtype = contrib_dtype )
+    if len( contribs ) == 0: return records
+    records[ 'weight' ] = [ contrib[0] for contrib in contribs ]
+    ( matrix, i, j ) = ( [], [], [] )
+    for contrib in contribs:
+        branches = contrib[1]
+        assert( len( branches ) <= max_branches )
+        padding = max_branches - len( branches )
+        matrix.append( [ matrix_index[ id( branch[0] ) ] for branch in branches ] + [ -1 ] * padding )
+        i.append( [ branch[1] for branch in branches ] + [ 0 ] * padding )
+        j.append( [ branch[2] for branch in branches ] + [ 0 ] * padding )
+    ( records[ 'matrix' ], records[ 'i' ], records[ 'j' ] ) = ( matrix, i, j )
+    records[ 'stack' ] = -1
+    if len( contribs[0] ) > 2:
+        records[ 'factor' ] = [ contrib[2][0] for contrib in contribs ]
+        records[ 'stack' ] = [ ( -1, -1 ) if contrib[2][1] == None else [ base_pair_type_index[ bpt ] for bpt in contrib[2][1] ] for contrib in contribs ]
+    return records
+
+def decode_contribs( records, matrices ):
+    '''
+    List of ( weight, [ ( DP, i, j ), ... ] ) from records. matrices = get_all_matrices( partition ).
+    '''
+    weights = records[ 'weight' ].tolist()
+    ( matrix, i, j ) = ( records[ 'matrix' ].tolist(), records[ 'i' ].tolist(), records[ 'j' ].tolist() )
+    return [ ( weights[ n ], [ ( matrices[ m ], i[ n ][ b ], j[ n ][ b ] ) for ( b, m ) in enumerate( matrix[ n ] ) if m >= 0 ] ) for n in range( len( weights ) ) ]
+
+##################################################################################################
+class TracedContribs:
+    '''
+    Contributions of every cell computed so far in a Partition, in one record array. Picklable.
+    matrix_names = names of the matrices, in get_all_matrices() order, that matrix ids refer to
+    records      = contrib_dtype records, plus the cell they belong to: cell_matrix, cell_i, cell_j (-1 for Z_final)
+    '''
+    def __init__( self, matrix_names, records ):
+        self.matrix_names = matrix_names
+        self.records = records
+
+cell_dtype = np.dtype( [ ( 'cell_matrix', np.int16 ), ( 'cell_i', np.int32 ), ( 'cell_j', np.int32 ) ] + [ ( name, contrib_dtype.fields[ name ][0] ) for name in contrib_dtype.names ] )
+
+def get_traced_contribs( partition ):
+    '''
+    TracedContribs for all cells of partition whose contributions have been computed, e.g., by tracebacks.
+    '''
+    matrices = get_all_matrices( partition )
+    matrix_index = get_matrix_index( partition )
+    blocks = []
+    for ( n, DP ) in enumerate( matrices ):
+        for ( cell, contribs ) in get_computed_contribs( DP ):
+            records = contribs if isinstance( contribs, np.ndarray ) else encode_contribs( contribs, matrix_index )
+            block = np.zeros( len( records ), dtype = cell_dtype )
+            ( block[ 'cell_matrix' ], block[ 'cell_i' ], block[ 'cell_j' ] ) = ( n, cell[0], cell[1] )
+            for name in contrib_dtype.names: block[ name ] = records[ name ]
+            blocks.append( block )
+    records = np.concatenate( blocks ) if len( blocks ) > 0 else np.zeros( 0, dtype = cell_dtype )
+    return TracedContribs( [ DP.name for DP in matrices ], records )
+
+def get_computed_contribs( DP ):
+    '''
+    ( ( i, j ), contributions ) of each cell of DP whose contributions are cached, with j = -1 for Z_final.
+    '''
+    if hasattr( DP, 'data' ): get_contribs = lambda i, j: ( DP.data[i] if j < 0 else DP.data[i][j] ).contribs # dynamic_programming.py
+    else:                     get_contribs = lambda i, j: DP.contribs[i] if j < 0 else DP.contribs[i][j]
+    if isinstance( DP.contribs_updated[0], list ):
+        return [ ( ( i, j ), get_contribs( i, j ) ) for i in range( DP.N ) for j in range( DP.N ) if DP.contribs_updated[i][j] ]
+    return [ ( ( i, -1 ), get_contribs( i, -1 ) ) for i in range( DP.N ) if DP.contribs_updated[i] ]
+
+def set_traced_contribs( partition, traced_contribs ):
+    '''
+    Load TracedContribs (e.g., from get_traced_contribs() on another Partition of the same sequence and
+     parameters) into partition, which must use explicit_dynamic_programming.py.
+    '''
+    matrices = get_all_matrices( partition )
+    assert( [ DP.name for DP in matrices ] == traced_contribs.matrix_names )
+    records = traced_contribs.records
+    if len( records ) == 0: return
+    cells = np.stack( ( records[ 'cell_matrix' ], records[ 'cell_i' ], records[ 'cell_j' ] ), axis = 1 )
+    starts = np.flatnonzero( np.concatenate( ( [ True ], ( cells[ 1: ] != cells[ :-1 ] ).any( axis = 1 ) ) ) )
+    ends = np.concatenate( ( starts[ 1: ], [ len( records ) ] ) )
+    for ( start, end ) in zip( starts, ends ):
+        ( n, i, j ) = cells[ start ].tolist()
+        block = np.zeros( end - start, dtype = contrib_dtype )
+        for name in contrib_dtype.names: block[ name ] = records[ name ][ start:end ]
+        matrices[ n ].set_contribs_records( block, i, j if j >= 0 else None )
@@ -0,0 +1,38 @@
+import copy
+
+##################################################################################################
+# Contributions of one cell, computed without touching the filled Partition.
+#
+# get_contribs() in dynamic_programming.py and explicit_dynamic_programming.py re-runs the update
+#  function of cell (i,j) with contributions turned on. Instead of switching on the shared
+#  partition.options.calc_contrib and overwriting the cell in place, the update function runs on a
+#  ContribsView -- it looks like the Partition, but has its own options (calc_contrib on), and its
+#  dynamic programming matrices are stand-ins whose cell (i,j) is scratch space. So other threads can
+#  read the filled matrices, or compute contributions of other cells, at the same time.
+##################################################################################################
+class ContribsView:
+    '''
+    partition       = filled Partition
+    view_matrices   = dict from id( DP ) to the stand-in for DP (matrices not in it are used as is)
+    options         = options for the update, by default a copy of partition.options with calc_contrib on
+    '''
+    def __init__( self, partition, view_matrices, options = None ):
+        self.__dict__.update( partition.__dict__ ) # plain attribute lookups in the update functions, not __getattr__
+        self.partition = partition
+        self.options = options if options != None else get_contribs_options( partition.options )
+        for ( name, value ) in partition.__dict__.items():
+            if id( value ) in view_matrices:
+                self.__dict__[ name ] = view_matrices[ id( value ) ]
+            elif isinstance( value, dict ) and any( id( DP ) in view_matrices for DP in value.values() ):
+                self.__dict__[ name ] = dict( ( key, view_matrices.get( id( DP ), DP ) ) for ( key, DP ) in value.items() ) # e.g., Z_BPq
+
+    def __getattr__( self, name ): return getattr( self.partition, name )
+
+def get_contribs_options( options ):
+    contribs_options = copy.copy( options )
+    contribs_options.calc_contrib  = True
+    contribs_options.calc_deriv_DP = False
+    return contribs_options
+
+def get_all_matrices( partition ):
+    return partition.Z_all + [ partition.Z_final ]
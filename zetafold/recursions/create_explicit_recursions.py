@@ -1,4 +1,5 @@
 #!/usr/bin/python
+import re
 with open('recursions.py') as f:
     lines = f.readlines()
 
@@ -7,6 +8,8 @@ not_data_objects = ['self.Z_BPq','sequence','self.params.C_eff_stack']
 not_2D_dynamic_programming_objects = ['all_ligated','ligated','self.Z_BPq','sequence','self.allow_base_pair','self.in_forced_base_pair','self.params.C_eff_stack']
 dynamic_programming_lists = ['Z_final']
 dynamic_programming_data = ['Z_seg1','Z_seg2']
+factor_params = ['C_init','l','l_BP','K_coax','l_coax'] # same order as factor_params in contribs_records.py
+factor_constants = ['C_std','Kdq'] # not in factors: C_std is fixed, and reverse_derivs.py puts in 1/Kd for all of Z_BPq
 
 def find_substring(substring, string):
     """
@@ -26,9 +29,46 @@ def find_substring(substring, string):
         indices.append(index)
     return indices
 
+def get_factor_string( weight ):
+    '''
+    Parameter factor of a contribution with this weight, i.e. the weight without its .Q's, as
+      ( exponents of factor_params, ( bpt1, bpt2 ) of its C_eff_stack entry, or None )
+    '''
+    C_eff_stack_pattern = r'self\.params\.C_eff_stack\[([^\]]*)\]\[([^\]]*)\]'
+    C_eff_stacks = re.findall( C_eff_stack_pattern, weight )
+    assert( len( C_eff_stacks ) <= 1 )
+    factor = re.sub( r'\w+\.Q\[[^\]]*\]\[[^\]]*\]', '1', re.sub( C_eff_stack_pattern, '1', weight ) )
+    assert( not re.search( r'/\s*\(', factor ) )
+    exponents = [0]*len( factor_params )
+    for ( divide, name, power ) in re.findall( r'(/?)\s*\(*\s*([A-Za-z_]\w*)(?:\*\*(\d+))?', factor ):
+        # a new parameter in recursions.py needs to be added to factor_params here and in contribs_records.py
+        assert( name in factor_params or name in factor_constants )
+        if name in factor_params: exponents[ factor_params.index( name ) ] += ( -1 if divide else 1 ) * int( power or 1 )
+    C_eff_stack_string = '(%s,%s)' % C_eff_stacks[0] if len( C_eff_stacks ) > 0 else 'None'
+    return '(%s), %s' % ( ','.join( [ str( n ) for n in exponents ] ), C_eff_stack_string )
+
+def get_loop_count_line( line_new, Q_pos, assign_pos, in_loop ):
+    '''
+    Line for the loop counts block from assignment line_new: same condition, but the term goes to
+     self.loop_counts -- or nothing happens, for terms outside loops over positions.
+    '''
+    before_target = line_new[:Q_pos]
+    target = before_target.split()[-1]
+    if not in_loop: return before_target[:len(before_target)-len(target)] + 'pass\n'
+    return before_target[:len(before_target)-len(target)] + 'self.loop_counts.add( ' + line_new[assign_pos+3:-1].strip() + ' )\n'
+
 lines_new = []
 lines_deriv = []
 lines_contrib = []
+lines_max = []
+lines_count = []
+loop_indents = [] # indentation of the loops over positions ( for ... in range ) that enclose the current line
+function_name = None
+recursions_with_loop_counts = []
+max_assignment = False
+max_insert_pos = None
+looking_for_body = False
+in_header_comment_block = False
 in_comment_block = False
 
 for line in lines:
@@ -46,13 +86,43 @@ for line in lines:
             lines_new += lines_contrib
             lines_contrib = []
             lines_new += '\n'
+        # loop counts block, for util/profiling.py -- only for recursions with loops over positions.
+        if function_name in recursions_with_loop_counts:
+            lines_new.append('    if self.options.calc_loop_counts: # AUTOGENERATED LOOP COUNTS BLOCK\n')
+            lines_new.append('        self.loop_counts.cells_counted += 1\n')
+            lines_new += lines_count
+            lines_new += '\n'
+        lines_count = []
+        loop_indents = []
+        function_name = line[4:line.index('(')].strip() if line[:4] == 'def ' else None
+        # max-product block replaces the sum-product recursion, so it goes at the top of the function and returns.
+        if max_assignment:
+            lines_new[ max_insert_pos:max_insert_pos ] = \
+                ['    if self.options.semiring.max_product: # AUTOGENERATED MAX-PRODUCT BLOCK\n'] + lines_max + \
+                ['        return\n', '\n']
+        lines_max = []
+        max_assignment = False
+        looking_for_body = ( line[:4] == 'def ' )
+    elif looking_for_body:
+        # skip docstring and comments at top of function to find where the body starts
+        if in_header_comment_block or line.strip() == '' or line.strip()[0] == '#' or line.count( "'''" ):
+            if line.count( "'''" ) == 1: in_header_comment_block = not in_header_comment_block
+        else:
+            max_insert_pos = len( lines_new )
+            looking_for_body = False
 
+    # leaving loops?
+    if line[0] == ' ' and line.strip() != '' and line.strip()[0] != '#':
+        while len( loop_indents ) > 0 and len( line ) - len( line.lstrip() ) <= loop_indents[-1]: loop_indents.pop()
 
     if line.count( '.dQ' ) or line.count( '.Q') :
         # if explicitly defining Q, dQ already, special case!!!
         line_new = line.replace( '[i][j].Q', '.Q[i][j]' )
         line_new = line_new.replace( '[i][j].dQ', '.dQ[i][j]' )
         lines_new.append( line_new )
+        if not line.count( '.dQ' ): lines_max.append( ' '*4 + line_new )
+        if not line.count( '.dQ' ):
+            lines_count.append( ' '*4 + get_loop_count_line( line_new, line_new.find( '.Q' ), line_new.find( '+= ' ), len( loop_indents ) > 0 ) )
         continue
 
     if line.count( "'''" ): in_comment_block = not in_comment_block
@@ -134,6 +204,13 @@ for line in lines:
        not in_comment_block and not line.count( "'''" ) and first_char != '' and num_indent >= 4:
         lines_deriv.append( ' '*4 + line_new )
         lines_contrib.append( ' '*4 + line_new )
+        lines_max.append( ' '*4 + line_new )
+        lines_count.append( ' '*4 + line_new )
+        if line_new.strip()[:4] == 'for ' and line_new.count( ' in range(' ):
+            # each iteration counts, and is a zero-skip unless a term added in it is nonzero.
+            lines_count.append( ' '*( num_indent + 8 ) + 'self.loop_counts.start( %d )\n' % len( loop_indents ) )
+            loop_indents.append( num_indent )
+            if function_name not in recursions_with_loop_counts: recursions_with_loop_counts.append( function_name )
 
     if line == line_new: continue
     print line,
@@ -159,6 +236,19 @@ for line in lines:
                 print line_deriv,
                 lines_deriv.append(line_deriv)
 
+            # backtracking info: matrices and (i,j) that are multiplied together in this contribution
+            info_string = ''
+            for (n,info) in enumerate(all_args):
+                if info[ 0 ] <= assign_pos: continue
+                info_string += '(%s,' % info[1]
+                if len(info[2])> 1:  info_string += '(%s)%%N' % info[2]
+                else: info_string += '%s%%N' % info[2]
+                info_string+=','
+                if len(info[3])>1:   info_string += '(%s)%%N' % info[3]
+                else: info_string += '%s%%N' % info[3]
+                info_string+=')'
+                if n < len( all_args )-1: info_string += ', '
+
             # contrib line
             print lines_new[-1],
             line_contrib = ' '*num_indent
@@ -169,22 +259,33 @@ for line in lines:
             line_contrib += line_new[Qpos[0]+2 : assign_pos+3]
             line_contrib +=' [ ('
             line_contrib += line_new[assign_pos+3:-1] + ', ['
-            for (n,info) in enumerate(all_args):
-                if info[ 0 ] <= assign_pos: continue
-                line_contrib += '(%s,' % info[1]
-                if len(info[2])> 1:  line_contrib += '(%s)%%N' % info[2]
-                else: line_contrib += '%s%%N' % info[2]
-                line_contrib+=','
-                if len(info[3])>1:   line_contrib += '(%s)%%N' % info[3]
-                else: line_contrib += '%s%%N' % info[3]
-                line_contrib+=')'
-                if n < len( all_args )-1: line_contrib += ', '
-            line_contrib += '] ) ]\n'
+            line_contrib += info_string
+            line_contrib += '], ( ' + get_factor_string( line_new[assign_pos+3:-1] ) + ' ) ) ]\n'
             print line_contrib,
             lines_contrib.append( line_contrib)
+
+            # loop counts line
+            lines_count.append( ' '*4 + get_loop_count_line( line_new, Qpos[0], assign_pos, len( loop_indents ) > 0 ) )
+
+            # max-product line -- keep the best contribution, and remember where it came from.
+            assert( line_new[assign_pos:assign_pos+2] == '+=' )
+            target = line_new[:Qpos[0]].split()[-1]
+            target_idx = line_new[Qpos[0]+2 : assign_pos].rstrip()
+            line_max = ' '*num_indent
+            line_max += ' '*4
+            line_max += 'if %s > %s.Q%s:\n' % ( line_new[assign_pos+3:-1], target, target_idx )
+            line_max += ' '*8
+            line_max += line_new[:Qpos[0]] + '.Q' + target_idx + ', ' + target + '.backpointer' + target_idx
+            line_max += ' = ' + line_new[assign_pos+3:-1] + ', [' + info_string + ']\n'
+            print line_max,
+            lines_max.append( line_max )
+            max_assignment = True
     print
 
 
+lines_new += [ '\n', '# recursions with an AUTOGENERATED LOOP COUNTS BLOCK, see util/profiling.py\n',
+               'recursions_with_loop_counts = %s\n' % recursions_with_loop_counts ]
+
 with open('explicit_recursions.py','w') as f:
     f.writelines( lines_new )
 
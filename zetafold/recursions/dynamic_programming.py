@@ -1,4 +1,6 @@
 from zetafold.util.wrapped_array import WrappedArray
+from .contribs_view import ContribsView, get_contribs_options, get_all_matrices
+import threading
 
 class DynamicProgrammingMatrix:
     '''
@@ -23,6 +25,7 @@ class DynamicProgrammingMatrix:
         self.contribs_updated = [None]*N
         for i in range( N ): self.contribs_updated[i] = [False]*N
         self.name = name
+        self.contribs_lock = threading.Lock()
 
     def __getitem__( self, idx ):
         return self.data[ idx ]
@@ -32,19 +35,27 @@ class DynamicProgrammingMatrix:
     def val( self, i, j ): return self.data[i][j].Q
     def set_val( self, i, j, val ): self.data[i][j].Q = val
     def deriv( self, i, j ): return self.data[i][j].dQ
+    def get_backpointer( self, i, j ): return self.data[i][j].backpointer
 
     def update( self, partition, i, j ):
         self.data[ i ][ j ].zero()
         self.update_func( partition, i, j )
 
     def get_contribs( self, partition, i, j ):
+        '''
+        Contributions to cell (i,j), computed the first time they are asked for (see contribs_view.py)
+         and cached. Safe to call from several threads on one filled Partition.
+        '''
         if not self.contribs_updated[i][j]:
-            partition.options.calc_contrib = True
-            self.update( partition, i, j )
-            partition.options.calc_contrib = False
-            self.contribs_updated[i][j] = True
+            contribs = self.compute_contribs( partition, i, j )
+            with self.contribs_lock:
+                if not self.contribs_updated[i][j]:
+                    self.data[i][j].contribs = contribs
+                    self.contribs_updated[i][j] = True
         return self.data[i][j].contribs
 
+    def compute_contribs( self, partition, i, j ): return compute_contribs( partition, self, i, j ) # not cached
+
 class DynamicProgrammingList:
     '''
     Dynamic Programming 1-D list that automatically:
@@ -61,6 +72,7 @@ class DynamicProgrammingList:
         self.update_func = update_func
         self.contribs_updated = [False]*N
         self.name = name
+        self.contribs_lock = threading.Lock()
 
     def __getitem__( self, idx ):
         return self.data[ idx ]
@@ -72,30 +84,88 @@ class DynamicProgrammingList:
 
     def val( self, i ): return self.data[i].Q
     def deriv( self, i ): return self.data[i].dQ
+    def get_backpointer( self, i ): return self.data[i].backpointer
 
     def get_contribs( self, partition, i ):
         if not self.contribs_updated[i]:
-            partition.options.calc_contrib = True
-            self.update( partition, i )
-            partition.options.calc_contrib = False
-            self.contribs_updated[i] = True
+            contribs = self.compute_contribs( partition, i )
+            with self.contribs_lock:
+                if not self.contribs_updated[i]:
+                    self.data[i].contribs = contribs
+                    self.contribs_updated[i] = True
         return self.data[i].contribs
 
+    def compute_contribs( self, partition, i ): return compute_contribs( partition, self, i )
+
     def update( self, partition, i ):
         self.data[ i ].zero()
         self.update_func( partition, i )
 
+def compute_contribs( partition, DP, i, j = None ):
+    '''
+    Contributions to cell (i,j) of DP (or i of a DynamicProgrammingList), without touching partition.
+    Cells carry their options, so all matrices are replaced by ContribsMatrix stand-ins that hand out
+     copies of cells with contributions turned on; the cell being updated is a fresh scratch cell.
+    '''
+    options = get_contribs_options( partition.options )
+    scratch = DynamicProgrammingData( 0.0, options = options )
+    scratch.info = ( DP.data[i] if j == None else DP.data[i][j] ).info
+    view_matrices = dict( ( id( Z ), ContribsMatrix( Z, options, scratch if Z is DP else None, i, j ) ) for Z in get_all_matrices( partition ) )
+    view = ContribsView( partition, view_matrices, options )
+    if j == None: DP.update_func( view, i )
+    else:         DP.update_func( view, i, j )
+    return view_matrices[ id( DP ) ].scratch.contribs
+
+class ContribsMatrix:
+    '''
+    Stand-in for a DynamicProgrammingMatrix or DynamicProgrammingList Z in compute_contribs(). Reading a
+     cell gives a copy with options of the contributions calculation; cell (i,j) is the scratch cell.
+    '''
+    def __init__( self, Z, options, scratch, i, j ):
+        ( self.Z, self.options, self.scratch, self.i, self.j ) = ( Z, options, scratch, i, j )
+        ( self.N, self.name ) = ( Z.N, Z.name )
+
+    def __getitem__( self, idx ):
+        if isinstance( self.Z, DynamicProgrammingList ): return self.get_cell( idx, None )
+        return ContribsRow( self, idx )
+
+    def __setitem__( self, idx, val ): self.set_cell( idx, None, val )
+
+    def __len__( self ): return self.N
+
+    def get_cell( self, i, j ):
+        if self.scratch != None and i % self.N == self.i and ( j == None or j % self.N == self.j ): return self.scratch
+        cell = self.Z.data[ i ] if j == None else self.Z.data[ i ][ j ]
+        cell_copy = DynamicProgrammingData( cell.Q, options = self.options )
+        cell_copy.dQ = cell.dQ
+        cell_copy.info = cell.info
+        return cell_copy
+
+    def set_cell( self, i, j, val ):
+        assert( self.scratch != None and i % self.N == self.i and ( j == None or j % self.N == self.j ) )
+        self.scratch = val
+
+    def val( self, i, j = None ): return self.get_cell( i, j ).Q
+    def deriv( self, i, j = None ): return self.get_cell( i, j ).dQ
+
+class ContribsRow:
+    def __init__( self, matrix, i ): ( self.matrix, self.i ) = ( matrix, i )
+    def __getitem__( self, j ): return self.matrix.get_cell( self.i, j )
+    def __setitem__( self, j, val ): self.matrix.set_cell( self.i, j, val )
+
 class DynamicProgrammingData:
     '''
     Dynamic programming object, with derivs and contribution accumulation.
      Q   = value
      dQ  = derivative (later will generalize to gradient w.r.t. all parameters)
      contrib = contributions
+     backpointer = info of the winning contribution, if options.semiring is max_product
     '''
     def __init__( self, val = 0.0, options = None ):
         self.Q = val
         self.dQ = 0.0
         self.contribs = []
+        self.backpointer = []
         self.info = []
         self.options = options
 
@@ -103,9 +173,15 @@ class DynamicProgrammingData:
         self.Q = 0.0
         self.dQ = 0.0
         self.contribs = []
+        self.backpointer = []
 
     def __iadd__(self, other):
         if other.Q == 0.0: return self
+        if self.options and self.options.semiring.max_product:
+            if other.Q > self.Q:
+                self.Q = other.Q
+                self.backpointer = other.info
+            return self
         self.Q  += other.Q
         if self.options and self.options.calc_deriv_DP:
             self.dQ += other.dQ
@@ -121,7 +197,7 @@ class DynamicProgrammingData:
             prod.Q  = self.Q * other.Q
             if self.options and self.options.calc_deriv_DP:
                 prod.dQ = self.Q * other.dQ + self.dQ * other.Q
-            if self.options and self.options.calc_contrib:
+            if self.options and ( self.options.calc_contrib or self.options.semiring.max_product ):
                 info = self.info + other.info
                 if len( info ) > 0:
                     prod.contribs = [ [ prod.Q, info ] ]
@@ -130,7 +206,7 @@ class DynamicProgrammingData:
             prod.Q  = self.Q * other
             if self.options and self.options.calc_deriv_DP:
                 prod.dQ = self.dQ * other
-            if self.options and self.options.calc_contrib:
+            if self.options and ( self.options.calc_contrib or self.options.semiring.max_product ):
                 for contrib in self.contribs:
                     prod.contribs.append( [contrib[0]*other, contrib[1] ] )
                 prod.info = self.info
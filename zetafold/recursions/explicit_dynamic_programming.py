@@ -2,6 +2,9 @@
 # Much simpler (less intelligent) object for dynamic programming than in dynamic_programming.py --
 #  forces code to explicitly figure out updates to values, derivatives, and contributions
 #
+import threading
+from .contribs_view import ContribsView, get_all_matrices
+from .contribs_records import get_matrix_index, get_base_pair_type_index, encode_contribs, decode_contribs
 class DynamicProgrammingMatrix:
     '''
     Dynamic Programming 2-D Matrix that automatically:
@@ -25,29 +28,58 @@ class DynamicProgrammingMatrix:
         self.contribs_updated = [None]*N
         for i in range( N ): self.contribs_updated[i] = [False]*N
 
+        self.backpointer = [None]*N
+        for i in range( N ): self.backpointer[i] = [ [] for j in range( N ) ]
+
         if DPlist != None: DPlist.append( self )
         self.update_func = update_func
 
         self.name = name
+        self.contribs_lock = threading.Lock()
 
     def val( self, i, j ): return self.Q[i%self.N][j%self.N]
     def set_val( self, i, j, val ): self.Q[i%self.N][j%self.N] = val
     def deriv( self, i, j ): return self.dQ[i%self.N][j%self.N]
+    def get_backpointer( self, i, j ): return self.backpointer[i%self.N][j%self.N]
 
     def update( self, partition, i, j ):
         self.Q[ i ][ j ] = 0
         self.dQ[ i ][ j ] = 0
         self.contribs[ i ][ j ] = []
+        self.backpointer[ i ][ j ] = []
         self.update_func( partition, i, j )
 
     def get_contribs( self, partition, i, j ):
+        '''
+        Contributions to cell (i,j) as a list of ( weight, [ ( DP, i, j ), ... ] ), decoded from the cached records --
+         for callers that want lists; tracebacks (sampling.py) read the records.
+        '''
+        return decode_contribs( self.get_contribs_records( partition, i, j ), get_all_matrices( partition ) )
+
+    def get_contribs_records( self, partition, i, j ):
+        '''
+        Contributions to cell (i,j) as records (see contribs_records.py), computed the first time they are
+         asked for (see contribs_view.py) and cached. Safe to call from several threads on one filled Partition.
+        '''
         if not self.contribs_updated[i][j]:
-            partition.options.calc_contrib = True
-            self.update( partition, i, j )
-            partition.options.calc_contrib = False
-            self.contribs_updated[i][j] = True
+            self.set_contribs_records( encode_contribs( self.compute_contribs( partition, i, j ), get_matrix_index( partition ), get_base_pair_type_index( partition.params ) ), i, j )
         return self.contribs[i][j]
 
+    def compute_contribs( self, partition, i, j ):
+        '''
+        Contributions to cell (i,j) as a list of ( weight, [ ( DP, i, j ), ... ], factor ), recomputed and not cached.
+         factor is the parameter factor of the weight, see encode_contribs() in contribs_records.py.
+        '''
+        shadow = ShadowMatrix( self, i )
+        shadow.update( ContribsView( partition, { id( self ): shadow } ), i, j )
+        return get_shadow_contribs( shadow.contribs[i][j], shadow, self )
+
+    def set_contribs_records( self, records, i, j ):
+        with self.contribs_lock:
+            if not self.contribs_updated[i][j]: # first one in wins
+                self.contribs[i][j] = records
+                self.contribs_updated[i][j] = True
+
     def __len__( self ):
         return len( self.Q )
 
@@ -65,24 +97,67 @@ class DynamicProgrammingList:
         self.contribs = [None] * N
         for i in range( N ): self.contribs[i] = []
         self.contribs_updated = [False]*N
+        self.backpointer = [ [] for i in range( N ) ]
         self.update_func = update_func
         self.name = name
+        self.contribs_lock = threading.Lock()
 
     def __len__( self ): return self.N
 
     def val( self, i ): return self.Q[i]
     def deriv( self, i ): return self.dQ[i]
+    def get_backpointer( self, i ): return self.backpointer[i]
 
     def update( self, partition, i ):
         self.Q[ i ] = 0.0
         self.dQ[ i ] = 0.0
         self.contribs[ i ] = []
+        self.backpointer[ i ] = []
         self.update_func( partition, i )
 
     def get_contribs( self, partition, i ):
+        return decode_contribs( self.get_contribs_records( partition, i ), get_all_matrices( partition ) )
+
+    def get_contribs_records( self, partition, i ):
         if not self.contribs_updated[i]:
-            partition.options.calc_contrib = True
-            self.update( partition, i )
-            partition.options.calc_contrib = False
-            self.contribs_updated[i] = True
+            self.set_contribs_records( encode_contribs( self.compute_contribs( partition, i ), get_matrix_index( partition ), get_base_pair_type_index( partition.params ) ), i )
         return self.contribs[i]
+
+    def compute_contribs( self, partition, i ):
+        shadow = ShadowList( self )
+        shadow.update( ContribsView( partition, { id( self ): shadow } ), i )
+        return get_shadow_contribs( shadow.contribs[i], shadow, self )
+
+    def set_contribs_records( self, records, i, j = None ):
+        with self.contribs_lock:
+            if not self.contribs_updated[i]:
+                self.contribs[i] = records
+                self.contribs_updated[i] = True
+
+class ShadowMatrix( DynamicProgrammingMatrix ):
+    '''
+    Stands in for DynamicProgrammingMatrix DP while contributions to a cell in row i are computed. Rows
+     are shared with DP, except row i of Q, dQ, contribs and backpointer, which are copies -- so the update
+     of (i,j) is written here, and DP is not touched.
+    '''
+    def __init__( self, DP, i ):
+        ( self.N, self.name, self.update_func ) = ( DP.N, DP.name, DP.update_func )
+        for field in ( 'Q', 'dQ', 'contribs', 'backpointer' ):
+            rows = list( getattr( DP, field ) )
+            rows[ i ] = list( rows[ i ] )
+            setattr( self, field, rows )
+
+class ShadowList( DynamicProgrammingList ):
+    '''
+    Stands in for DynamicProgrammingList DP (Z_final) while contributions are computed.
+    '''
+    def __init__( self, DP ):
+        ( self.N, self.name, self.update_func ) = ( DP.N, DP.name, DP.update_func )
+        for field in ( 'Q', 'dQ', 'contribs', 'backpointer' ): setattr( self, field, list( getattr( DP, field ) ) )
+
+def get_shadow_contribs( contribs, shadow, DP ):
+    '''
+    contribs computed with shadow standing in for DP. Contributions that refer to other cells of
+     the matrix being updated (e.g., C_eff_basic) should point to DP, not shadow.
+    '''
+    return [ ( weight, [ ( DP if Z is shadow else Z, i, j ) for ( Z, i, j ) in branches ], factor ) for ( weight, branches, factor ) in contribs ]
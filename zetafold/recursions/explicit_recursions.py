@@ -11,6 +11,21 @@ def update_Z_cut( self, i, j ):
     Useful for Z_BP and Z_final calcs below.
     Analogous to 'exterior' Z in Mathews calc & Dirks multistrand calc.
     '''
+    if self.options.semiring.max_product: # AUTOGENERATED MAX-PRODUCT BLOCK
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        offset = ( j - i ) % N
+        for c in range( i, i+offset ):
+            if not ligated[c%N]:
+                if c == i and (c+1)%N == j: Z_cut.Q[i][j] += 1.0
+                if Z_linear.Q[(c+1)%N][(j-1)%N] > Z_cut.Q[i%N][j%N]:
+                    if c == i and (c+1)%N != j: Z_cut.Q[i%N][j%N], Z_cut.backpointer[i%N][j%N] = Z_linear.Q[(c+1)%N][(j-1)%N], [(Z_linear,(c+1)%N,(j-1)%N)]
+                if Z_linear.Q[(i+1)%N][c%N] > Z_cut.Q[i%N][j%N]:
+                    if c != i and (c+1)%N == j: Z_cut.Q[i%N][j%N], Z_cut.backpointer[i%N][j%N] = Z_linear.Q[(i+1)%N][c%N], [(Z_linear,(i+1)%N,c%N)]
+                if Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N] > Z_cut.Q[i%N][j%N]:
+                    if c != i and (c+1)%N != j: Z_cut.Q[i%N][j%N], Z_cut.backpointer[i%N][j%N] = Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N], [(Z_linear,(i+1)%N,c%N), (Z_linear,(c+1)%N,(j-1)%N)]
+        return
+
     (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
     offset = ( j - i ) % N
@@ -40,11 +55,24 @@ def update_Z_cut( self, i, j ):
         for c in range( i, i+offset ):
             if not ligated[c%N]:
                 if Z_linear.Q[(c+1)%N][(j-1)%N] > 0:
-                    if c == i and (c+1)%N != j: Z_cut.contribs[i%N][j%N] +=  [ (Z_linear.Q[(c+1)%N][(j-1)%N], [(Z_linear,(c+1)%N,(j-1)%N)] ) ]
+                    if c == i and (c+1)%N != j: Z_cut.contribs[i%N][j%N] +=  [ (Z_linear.Q[(c+1)%N][(j-1)%N], [(Z_linear,(c+1)%N,(j-1)%N)], ( (0,0,0,0,0), None ) ) ]
                 if Z_linear.Q[(i+1)%N][c%N] > 0:
-                    if c != i and (c+1)%N == j: Z_cut.contribs[i%N][j%N] +=  [ (Z_linear.Q[(i+1)%N][c%N], [(Z_linear,(i+1)%N,c%N)] ) ]
+                    if c != i and (c+1)%N == j: Z_cut.contribs[i%N][j%N] +=  [ (Z_linear.Q[(i+1)%N][c%N], [(Z_linear,(i+1)%N,c%N)], ( (0,0,0,0,0), None ) ) ]
                 if Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N] > 0:
-                    if c != i and (c+1)%N != j: Z_cut.contribs[i%N][j%N] +=  [ (Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N], [(Z_linear,(i+1)%N,c%N), (Z_linear,(c+1)%N,(j-1)%N)] ) ]
+                    if c != i and (c+1)%N != j: Z_cut.contribs[i%N][j%N] +=  [ (Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N], [(Z_linear,(i+1)%N,c%N), (Z_linear,(c+1)%N,(j-1)%N)], ( (0,0,0,0,0), None ) ) ]
+
+    if self.options.calc_loop_counts: # AUTOGENERATED LOOP COUNTS BLOCK
+        self.loop_counts.cells_counted += 1
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        offset = ( j - i ) % N
+        for c in range( i, i+offset ):
+            self.loop_counts.start( 0 )
+            if not ligated[c%N]:
+                if c == i and (c+1)%N == j: self.loop_counts.add( 1.0 )
+                if c == i and (c+1)%N != j: self.loop_counts.add( Z_linear.Q[(c+1)%N][(j-1)%N] )
+                if c != i and (c+1)%N == j: self.loop_counts.add( Z_linear.Q[(i+1)%N][c%N] )
+                if c != i and (c+1)%N != j: self.loop_counts.add( Z_linear.Q[(i+1)%N][c%N] * Z_linear.Q[(c+1)%N][(j-1)%N] )
 
 ##################################################################################################
 def update_Z_BPq( self, i, j, base_pair_type ):
@@ -53,6 +81,43 @@ def update_Z_BPq( self, i, j, base_pair_type ):
     Relies on previous Z contributions available for subfragments, and Z_cut for this fragment i,j
     '''
 
+    if self.options.semiring.max_product: # AUTOGENERATED MAX-PRODUCT BLOCK
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        offset = ( j - i ) % N
+        ( C_eff_for_coax, C_eff_for_BP ) = (C_eff, C_eff ) if allow_strained_3WJ else (C_eff_no_BP_singlet, C_eff_no_coax_singlet )
+        if self.allow_base_pair and not self.allow_base_pair[i%N][j%N]: return
+        if ( all_ligated[i%N][j%N] and ( ((j-i-1) % N)) < min_loop_length ): return
+        if ( all_ligated[j%N][i%N] and ( ((i-j-1) % N)) < min_loop_length ): return
+        if not base_pair_type.is_match( sequence[i], sequence[j] ): return
+        (Z_BPq, Kdq)  = ( self.Z_BPq[ base_pair_type ], base_pair_type.Kd )
+        if ligated[i%N] and ligated[(j-1)%N]:
+            if (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP) > Z_BPq.Q[i%N][j%N]:
+                Z_BPq.Q[i%N][j%N], Z_BPq.backpointer[i%N][j%N] = (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP), [(C_eff_for_BP,(i+1)%N,(j-1)%N)]
+            for base_pair_type2 in self.params.base_pair_types:
+                if base_pair_type2.is_match( sequence[(i+1)%N], sequence[(j-1)%N] ):
+                    if (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BP.Q[(i+1)%N][(j-1)%N] > Z_BPq.Q[i%N][j%N]:
+                        Z_BPq.Q[i%N][j%N], Z_BPq.backpointer[i%N][j%N] = (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BP.Q[(i+1)%N][(j-1)%N], [(Z_BP,(i+1)%N,(j-1)%N)]
+        if (C_std/Kdq) * Z_cut.Q[i%N][j%N] > Z_BPq.Q[i%N][j%N]:
+            Z_BPq.Q[i%N][j%N], Z_BPq.backpointer[i%N][j%N] = (C_std/Kdq) * Z_cut.Q[i%N][j%N], [(Z_cut,i%N,j%N)]
+        if K_coax > 0.0:
+            if ligated[i%N] and ligated[(j-1)%N]:
+                for k in range( i+2, i+offset-1 ):
+                    if Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq > Z_BPq.Q[i%N][j%N]:
+                        if ligated[k%N]: Z_BPq.Q[i%N][j%N], Z_BPq.backpointer[i%N][j%N] = Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq, [(Z_BP,(i+1)%N,k%N), (C_eff_for_coax,(k+1)%N,(j-1)%N)]
+                for k in range( i+2, i+offset-1 ):
+                    if C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq > Z_BPq.Q[i%N][j%N]:
+                        if ligated[(k-1)%N]: Z_BPq.Q[i%N][j%N], Z_BPq.backpointer[i%N][j%N] = C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq, [(C_eff_for_coax,(i+1)%N,(k-1)%N), (Z_BP,k%N,(j-1)%N)]
+            if ligated[i%N]:
+                for k in range( i+2, i+offset ):
+                    if Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j%N] * C_std * K_coax / Kdq > Z_BPq.Q[i%N][j%N]:
+                        Z_BPq.Q[i%N][j%N], Z_BPq.backpointer[i%N][j%N] = Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j%N] * C_std * K_coax / Kdq, [(Z_BP,(i+1)%N,k%N), (Z_cut,k%N,j%N)]
+            if ligated[(j-1)%N]:
+                for k in range( i, i+offset-1 ):
+                    if Z_cut.Q[i%N][k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq > Z_BPq.Q[i%N][j%N]:
+                        Z_BPq.Q[i%N][j%N], Z_BPq.backpointer[i%N][j%N] = Z_cut.Q[i%N][k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq, [(Z_cut,i%N,k%N), (Z_BP,k%N,(j-1)%N)]
+        return
+
     (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
     offset = ( j - i ) % N
@@ -191,29 +256,63 @@ def update_Z_BPq( self, i, j, base_pair_type ):
         (Z_BPq, Kdq)  = ( self.Z_BPq[ base_pair_type ], base_pair_type.Kd )
         if ligated[i%N] and ligated[(j-1)%N]:
             if (1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP) > 0:
-                Z_BPq.contribs[i%N][j%N]  +=  [ ((1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP), [(C_eff_for_BP,(i+1)%N,(j-1)%N)] ) ]
+                Z_BPq.contribs[i%N][j%N]  +=  [ ((1.0/Kdq ) * ( C_eff_for_BP.Q[(i+1)%N][(j-1)%N] * l * l * l_BP), [(C_eff_for_BP,(i+1)%N,(j-1)%N)], ( (0,2,1,0,0), None ) ) ]
             for base_pair_type2 in self.params.base_pair_types:
                 if base_pair_type2.is_match( sequence[(i+1)%N], sequence[(j-1)%N] ):
                     if (1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BP.Q[(i+1)%N][(j-1)%N] > 0:
-                        Z_BPq.contribs[i%N][j%N]  +=  [ ((1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BP.Q[(i+1)%N][(j-1)%N], [(Z_BP,(i+1)%N,(j-1)%N)] ) ]
+                        Z_BPq.contribs[i%N][j%N]  +=  [ ((1.0/Kdq ) * self.params.C_eff_stack[base_pair_type][base_pair_type2] * Z_BP.Q[(i+1)%N][(j-1)%N], [(Z_BP,(i+1)%N,(j-1)%N)], ( (0,0,0,0,0), (base_pair_type,base_pair_type2) ) ) ]
         if (C_std/Kdq) * Z_cut.Q[i%N][j%N] > 0:
-            Z_BPq.contribs[i%N][j%N] +=  [ ((C_std/Kdq) * Z_cut.Q[i%N][j%N], [(Z_cut,i%N,j%N)] ) ]
+            Z_BPq.contribs[i%N][j%N] +=  [ ((C_std/Kdq) * Z_cut.Q[i%N][j%N], [(Z_cut,i%N,j%N)], ( (0,0,0,0,0), None ) ) ]
         if K_coax > 0.0:
             if ligated[i%N] and ligated[(j-1)%N]:
                 for k in range( i+2, i+offset-1 ):
                     if Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq > 0:
-                        if ligated[k%N]: Z_BPq.contribs[i%N][j%N] +=  [ (Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq, [(Z_BP,(i+1)%N,k%N), (C_eff_for_coax,(k+1)%N,(j-1)%N)] ) ]
+                        if ligated[k%N]: Z_BPq.contribs[i%N][j%N] +=  [ (Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq, [(Z_BP,(i+1)%N,k%N), (C_eff_for_coax,(k+1)%N,(j-1)%N)], ( (0,2,0,1,1), None ) ) ]
                 for k in range( i+2, i+offset-1 ):
                     if C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq > 0:
-                        if ligated[(k-1)%N]: Z_BPq.contribs[i%N][j%N] +=  [ (C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq, [(C_eff_for_coax,(i+1)%N,(k-1)%N), (Z_BP,k%N,(j-1)%N)] ) ]
+                        if ligated[(k-1)%N]: Z_BPq.contribs[i%N][j%N] +=  [ (C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq, [(C_eff_for_coax,(i+1)%N,(k-1)%N), (Z_BP,k%N,(j-1)%N)], ( (0,2,0,1,1), None ) ) ]
             if ligated[i%N]:
                 for k in range( i+2, i+offset ):
                     if Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j%N] * C_std * K_coax / Kdq > 0:
-                        Z_BPq.contribs[i%N][j%N] +=  [ (Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j%N] * C_std * K_coax / Kdq, [(Z_BP,(i+1)%N,k%N), (Z_cut,k%N,j%N)] ) ]
+                        Z_BPq.contribs[i%N][j%N] +=  [ (Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j%N] * C_std * K_coax / Kdq, [(Z_BP,(i+1)%N,k%N), (Z_cut,k%N,j%N)], ( (0,0,0,1,0), None ) ) ]
             if ligated[(j-1)%N]:
                 for k in range( i, i+offset-1 ):
                     if Z_cut.Q[i%N][k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq > 0:
-                        Z_BPq.contribs[i%N][j%N] +=  [ (Z_cut.Q[i%N][k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq, [(Z_cut,i%N,k%N), (Z_BP,k%N,(j-1)%N)] ) ]
+                        Z_BPq.contribs[i%N][j%N] +=  [ (Z_cut.Q[i%N][k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq, [(Z_cut,i%N,k%N), (Z_BP,k%N,(j-1)%N)], ( (0,0,0,1,0), None ) ) ]
+
+    if self.options.calc_loop_counts: # AUTOGENERATED LOOP COUNTS BLOCK
+        self.loop_counts.cells_counted += 1
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        offset = ( j - i ) % N
+        ( C_eff_for_coax, C_eff_for_BP ) = (C_eff, C_eff ) if allow_strained_3WJ else (C_eff_no_BP_singlet, C_eff_no_coax_singlet )
+        if self.allow_base_pair and not self.allow_base_pair[i%N][j%N]: return
+        if ( all_ligated[i%N][j%N] and ( ((j-i-1) % N)) < min_loop_length ): return
+        if ( all_ligated[j%N][i%N] and ( ((i-j-1) % N)) < min_loop_length ): return
+        if not base_pair_type.is_match( sequence[i], sequence[j] ): return
+        (Z_BPq, Kdq)  = ( self.Z_BPq[ base_pair_type ], base_pair_type.Kd )
+        if ligated[i%N] and ligated[(j-1)%N]:
+            pass
+            for base_pair_type2 in self.params.base_pair_types:
+                if base_pair_type2.is_match( sequence[(i+1)%N], sequence[(j-1)%N] ):
+                    pass
+        pass
+        if K_coax > 0.0:
+            if ligated[i%N] and ligated[(j-1)%N]:
+                for k in range( i+2, i+offset-1 ):
+                    self.loop_counts.start( 0 )
+                    if ligated[k%N]: self.loop_counts.add( Z_BP.Q[(i+1)%N][k%N] * C_eff_for_coax.Q[(k+1)%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq )
+                for k in range( i+2, i+offset-1 ):
+                    self.loop_counts.start( 0 )
+                    if ligated[(k-1)%N]: self.loop_counts.add( C_eff_for_coax.Q[(i+1)%N][(k-1)%N] * Z_BP.Q[k%N][(j-1)%N] * l**2 * l_coax * K_coax / Kdq )
+            if ligated[i%N]:
+                for k in range( i+2, i+offset ):
+                    self.loop_counts.start( 0 )
+                    self.loop_counts.add( Z_BP.Q[(i+1)%N][k%N] * Z_cut.Q[k%N][j%N] * C_std * K_coax / Kdq )
+            if ligated[(j-1)%N]:
+                for k in range( i, i+offset-1 ):
+                    self.loop_counts.start( 0 )
+                    self.loop_counts.add( Z_cut.Q[i%N][k%N] * Z_BP.Q[k%N][(j-1)%N] * C_std * K_coax / Kdq )
 
 ##################################################################################################
 def update_Z_BP( self, i, j ):
@@ -222,6 +321,15 @@ def update_Z_BP( self, i, j ):
     All the Z_BPq (partition functions for each base pair type) must have been
     filled in already for i,j.
     '''
+    if self.options.semiring.max_product: # AUTOGENERATED MAX-PRODUCT BLOCK
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        for base_pair_type in self.base_pair_types:
+            Z_BPq = self.Z_BPq[base_pair_type]
+            if Z_BPq.Q[i%N][j%N] > Z_BP.Q[i%N][j%N]:
+                Z_BP.Q[i%N][j%N], Z_BP.backpointer[i%N][j%N] = Z_BPq.Q[i%N][j%N], [(Z_BPq,i%N,j%N)]
+        return
+
     (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
 
@@ -242,13 +350,27 @@ def update_Z_BP( self, i, j ):
         for base_pair_type in self.base_pair_types:
             Z_BPq = self.Z_BPq[base_pair_type]
             if Z_BPq.Q[i%N][j%N] > 0:
-                Z_BP.contribs[i%N][j%N]  +=  [ (Z_BPq.Q[i%N][j%N], [(Z_BPq,i%N,j%N)] ) ]
+                Z_BP.contribs[i%N][j%N]  +=  [ (Z_BPq.Q[i%N][j%N], [(Z_BPq,i%N,j%N)], ( (0,0,0,0,0), None ) ) ]
 
 ##################################################################################################
 def update_Z_coax( self, i, j ):
     '''
     Z_coax(i,j) is the partition function for all structures that form coaxial stacks between (i,k) and (k+1,j) for some k
     '''
+    if self.options.semiring.max_product: # AUTOGENERATED MAX-PRODUCT BLOCK
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        offset = ( j - i ) % N
+        if (offset == N-1) and ligated[j%N]: return
+        if K_coax > 0:
+            for k in range( i+1, i+offset-1 ):
+                if ligated[k%N]:
+                    if Z_BP.val(i,k) == 0.0: continue
+                    if Z_BP.val(k+1,j) == 0.0: continue
+                    if Z_BP.Q[i%N][k%N] * Z_BP.Q[(k+1)%N][j%N] * K_coax > Z_coax.Q[i%N][j%N]:
+                        Z_coax.Q[i%N][j%N], Z_coax.backpointer[i%N][j%N] = Z_BP.Q[i%N][k%N] * Z_BP.Q[(k+1)%N][j%N] * K_coax, [(Z_BP,i%N,k%N), (Z_BP,(k+1)%N,j%N)]
+        return
+
     (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
     offset = ( j - i ) % N
@@ -293,7 +415,21 @@ def update_Z_coax( self, i, j ):
                     if Z_BP.val(i,k) == 0.0: continue
                     if Z_BP.val(k+1,j) == 0.0: continue
                     if Z_BP.Q[i%N][k%N] * Z_BP.Q[(k+1)%N][j%N] * K_coax > 0:
-                        Z_coax.contribs[i%N][j%N]  +=  [ (Z_BP.Q[i%N][k%N] * Z_BP.Q[(k+1)%N][j%N] * K_coax, [(Z_BP,i%N,k%N), (Z_BP,(k+1)%N,j%N)] ) ]
+                        Z_coax.contribs[i%N][j%N]  +=  [ (Z_BP.Q[i%N][k%N] * Z_BP.Q[(k+1)%N][j%N] * K_coax, [(Z_BP,i%N,k%N), (Z_BP,(k+1)%N,j%N)], ( (0,0,0,1,0), None ) ) ]
+
+    if self.options.calc_loop_counts: # AUTOGENERATED LOOP COUNTS BLOCK
+        self.loop_counts.cells_counted += 1
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        offset = ( j - i ) % N
+        if (offset == N-1) and ligated[j%N]: return
+        if K_coax > 0:
+            for k in range( i+1, i+offset-1 ):
+                self.loop_counts.start( 0 )
+                if ligated[k%N]:
+                    if Z_BP.val(i,k) == 0.0: continue
+                    if Z_BP.val(k+1,j) == 0.0: continue
+                    self.loop_counts.add( Z_BP.Q[i%N][k%N] * Z_BP.Q[(k+1)%N][j%N] * K_coax )
 
 ##################################################################################################
 def update_C_eff_basic( self, i, j ):
@@ -307,6 +443,25 @@ def update_C_eff_basic( self, i, j ):
       allow for free energy costs of loop closure to scale approximately log-linearly rather than
       linearly with loop size.
     '''
+    if self.options.semiring.max_product: # AUTOGENERATED MAX-PRODUCT BLOCK
+        offset = ( j - i ) % self.N
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        allow_loop_extension = not ( self.in_forced_base_pair and self.in_forced_base_pair[j%N] )
+        if C_eff.Q[i%N][(j-1)%N] * l > C_eff_basic.Q[i%N][j%N]:
+            if ligated[(j-1)%N] and allow_loop_extension: C_eff_basic.Q[i%N][j%N], C_eff_basic.backpointer[i%N][j%N] = C_eff.Q[i%N][(j-1)%N] * l, [(C_eff,i%N,(j-1)%N)]
+        exclude_strained_3WJ = (not allow_strained_3WJ) and (offset == N-1) and ligated[j%N]
+        C_eff_for_BP = C_eff_no_coax_singlet if exclude_strained_3WJ else C_eff
+        for k in range( i+1, i+offset):
+            if C_eff_for_BP.Q[i%N][(k-1)%N] * l * Z_BP.Q[k%N][j%N] * l_BP > C_eff_basic.Q[i%N][j%N]:
+                if ligated[(k-1)%N]: C_eff_basic.Q[i%N][j%N], C_eff_basic.backpointer[i%N][j%N] = C_eff_for_BP.Q[i%N][(k-1)%N] * l * Z_BP.Q[k%N][j%N] * l_BP, [(C_eff_for_BP,i%N,(k-1)%N), (Z_BP,k%N,j%N)]
+        if K_coax > 0:
+            C_eff_for_coax = C_eff_no_BP_singlet if exclude_strained_3WJ else C_eff
+            for k in range( i+1, i+offset):
+                if C_eff_for_coax.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] * l * l_coax > C_eff_basic.Q[i%N][j%N]:
+                    if ligated[(k-1)%N]: C_eff_basic.Q[i%N][j%N], C_eff_basic.backpointer[i%N][j%N] = C_eff_for_coax.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] * l * l_coax, [(C_eff_for_coax,i%N,(k-1)%N), (Z_coax,k%N,j%N)]
+        return
+
     offset = ( j - i ) % self.N
 
     (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
@@ -366,20 +521,47 @@ def update_C_eff_basic( self, i, j ):
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         allow_loop_extension = not ( self.in_forced_base_pair and self.in_forced_base_pair[j%N] )
         if C_eff.Q[i%N][(j-1)%N] * l > 0:
-            if ligated[(j-1)%N] and allow_loop_extension: C_eff_basic.contribs[i%N][j%N] +=  [ (C_eff.Q[i%N][(j-1)%N] * l, [(C_eff,i%N,(j-1)%N)] ) ]
+            if ligated[(j-1)%N] and allow_loop_extension: C_eff_basic.contribs[i%N][j%N] +=  [ (C_eff.Q[i%N][(j-1)%N] * l, [(C_eff,i%N,(j-1)%N)], ( (0,1,0,0,0), None ) ) ]
         exclude_strained_3WJ = (not allow_strained_3WJ) and (offset == N-1) and ligated[j%N]
         C_eff_for_BP = C_eff_no_coax_singlet if exclude_strained_3WJ else C_eff
         for k in range( i+1, i+offset):
             if C_eff_for_BP.Q[i%N][(k-1)%N] * l * Z_BP.Q[k%N][j%N] * l_BP > 0:
-                if ligated[(k-1)%N]: C_eff_basic.contribs[i%N][j%N] +=  [ (C_eff_for_BP.Q[i%N][(k-1)%N] * l * Z_BP.Q[k%N][j%N] * l_BP, [(C_eff_for_BP,i%N,(k-1)%N), (Z_BP,k%N,j%N)] ) ]
+                if ligated[(k-1)%N]: C_eff_basic.contribs[i%N][j%N] +=  [ (C_eff_for_BP.Q[i%N][(k-1)%N] * l * Z_BP.Q[k%N][j%N] * l_BP, [(C_eff_for_BP,i%N,(k-1)%N), (Z_BP,k%N,j%N)], ( (0,1,1,0,0), None ) ) ]
         if K_coax > 0:
             C_eff_for_coax = C_eff_no_BP_singlet if exclude_strained_3WJ else C_eff
             for k in range( i+1, i+offset):
                 if C_eff_for_coax.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] * l * l_coax > 0:
-                    if ligated[(k-1)%N]: C_eff_basic.contribs[i%N][j%N] +=  [ (C_eff_for_coax.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] * l * l_coax, [(C_eff_for_coax,i%N,(k-1)%N), (Z_coax,k%N,j%N)] ) ]
+                    if ligated[(k-1)%N]: C_eff_basic.contribs[i%N][j%N] +=  [ (C_eff_for_coax.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] * l * l_coax, [(C_eff_for_coax,i%N,(k-1)%N), (Z_coax,k%N,j%N)], ( (0,1,0,0,1), None ) ) ]
+
+    if self.options.calc_loop_counts: # AUTOGENERATED LOOP COUNTS BLOCK
+        self.loop_counts.cells_counted += 1
+        offset = ( j - i ) % self.N
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        allow_loop_extension = not ( self.in_forced_base_pair and self.in_forced_base_pair[j%N] )
+        if ligated[(j-1)%N] and allow_loop_extension: pass
+        exclude_strained_3WJ = (not allow_strained_3WJ) and (offset == N-1) and ligated[j%N]
+        C_eff_for_BP = C_eff_no_coax_singlet if exclude_strained_3WJ else C_eff
+        for k in range( i+1, i+offset):
+            self.loop_counts.start( 0 )
+            if ligated[(k-1)%N]: self.loop_counts.add( C_eff_for_BP.Q[i%N][(k-1)%N] * l * Z_BP.Q[k%N][j%N] * l_BP )
+        if K_coax > 0:
+            C_eff_for_coax = C_eff_no_BP_singlet if exclude_strained_3WJ else C_eff
+            for k in range( i+1, i+offset):
+                self.loop_counts.start( 0 )
+                if ligated[(k-1)%N]: self.loop_counts.add( C_eff_for_coax.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] * l * l_coax )
 
 ##################################################################################################
 def update_C_eff_no_coax_singlet( self, i, j ):
+    if self.options.semiring.max_product: # AUTOGENERATED MAX-PRODUCT BLOCK
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        if C_eff_basic.Q[i%N][j%N] > C_eff_no_coax_singlet.Q[i%N][j%N]:
+            C_eff_no_coax_singlet.Q[i%N][j%N], C_eff_no_coax_singlet.backpointer[i%N][j%N] = C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)]
+        if C_init * Z_BP.Q[i%N][j%N] * l_BP > C_eff_no_coax_singlet.Q[i%N][j%N]:
+            C_eff_no_coax_singlet.Q[i%N][j%N], C_eff_no_coax_singlet.backpointer[i%N][j%N] = C_init * Z_BP.Q[i%N][j%N] * l_BP, [(Z_BP,i%N,j%N)]
+        return
+
     (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
 
@@ -397,12 +579,22 @@ def update_C_eff_no_coax_singlet( self, i, j ):
         (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         if C_eff_basic.Q[i%N][j%N] > 0:
-            C_eff_no_coax_singlet.contribs[i%N][j%N] +=  [ (C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)] ) ]
+            C_eff_no_coax_singlet.contribs[i%N][j%N] +=  [ (C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)], ( (0,0,0,0,0), None ) ) ]
         if C_init * Z_BP.Q[i%N][j%N] * l_BP > 0:
-            C_eff_no_coax_singlet.contribs[i%N][j%N] +=  [ (C_init * Z_BP.Q[i%N][j%N] * l_BP, [(Z_BP,i%N,j%N)] ) ]
+            C_eff_no_coax_singlet.contribs[i%N][j%N] +=  [ (C_init * Z_BP.Q[i%N][j%N] * l_BP, [(Z_BP,i%N,j%N)], ( (1,0,1,0,0), None ) ) ]
 
 ##################################################################################################
 def update_C_eff_no_BP_singlet( self, i, j ):
+    if self.options.semiring.max_product: # AUTOGENERATED MAX-PRODUCT BLOCK
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        if K_coax > 0.0:
+            if C_eff_basic.Q[i%N][j%N] > C_eff_no_BP_singlet.Q[i%N][j%N]:
+                C_eff_no_BP_singlet.Q[i%N][j%N], C_eff_no_BP_singlet.backpointer[i%N][j%N] = C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)]
+            if C_init * Z_coax.Q[i%N][j%N] * l_coax > C_eff_no_BP_singlet.Q[i%N][j%N]:
+                C_eff_no_BP_singlet.Q[i%N][j%N], C_eff_no_BP_singlet.backpointer[i%N][j%N] = C_init * Z_coax.Q[i%N][j%N] * l_coax, [(Z_coax,i%N,j%N)]
+        return
+
     (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
 
@@ -422,12 +614,24 @@ def update_C_eff_no_BP_singlet( self, i, j ):
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         if K_coax > 0.0:
             if C_eff_basic.Q[i%N][j%N] > 0:
-                C_eff_no_BP_singlet.contribs[i%N][j%N] +=  [ (C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)] ) ]
+                C_eff_no_BP_singlet.contribs[i%N][j%N] +=  [ (C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)], ( (0,0,0,0,0), None ) ) ]
             if C_init * Z_coax.Q[i%N][j%N] * l_coax > 0:
-                C_eff_no_BP_singlet.contribs[i%N][j%N] +=  [ (C_init * Z_coax.Q[i%N][j%N] * l_coax, [(Z_coax,i%N,j%N)] ) ]
+                C_eff_no_BP_singlet.contribs[i%N][j%N] +=  [ (C_init * Z_coax.Q[i%N][j%N] * l_coax, [(Z_coax,i%N,j%N)], ( (1,0,0,0,1), None ) ) ]
 
 ##################################################################################################
 def update_C_eff( self, i, j ):
+    if self.options.semiring.max_product: # AUTOGENERATED MAX-PRODUCT BLOCK
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        if C_eff_basic.Q[i%N][j%N] > C_eff.Q[i%N][j%N]:
+            C_eff.Q[i%N][j%N], C_eff.backpointer[i%N][j%N] = C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)]
+        if C_init * Z_BP.Q[i%N][j%N] * l_BP > C_eff.Q[i%N][j%N]:
+            C_eff.Q[i%N][j%N], C_eff.backpointer[i%N][j%N] = C_init * Z_BP.Q[i%N][j%N] * l_BP, [(Z_BP,i%N,j%N)]
+        if K_coax > 0.0:
+            if C_init * Z_coax.Q[i%N][j%N] * l_coax > C_eff.Q[i%N][j%N]:
+                C_eff.Q[i%N][j%N], C_eff.backpointer[i%N][j%N] = C_init * Z_coax.Q[i%N][j%N] * l_coax, [(Z_coax,i%N,j%N)]
+        return
+
     (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
 
@@ -463,12 +667,12 @@ def update_C_eff( self, i, j ):
         (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         if C_eff_basic.Q[i%N][j%N] > 0:
-            C_eff.contribs[i%N][j%N] +=  [ (C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)] ) ]
+            C_eff.contribs[i%N][j%N] +=  [ (C_eff_basic.Q[i%N][j%N], [(C_eff_basic,i%N,j%N)], ( (0,0,0,0,0), None ) ) ]
         if C_init * Z_BP.Q[i%N][j%N] * l_BP > 0:
-            C_eff.contribs[i%N][j%N] +=  [ (C_init * Z_BP.Q[i%N][j%N] * l_BP, [(Z_BP,i%N,j%N)] ) ]
+            C_eff.contribs[i%N][j%N] +=  [ (C_init * Z_BP.Q[i%N][j%N] * l_BP, [(Z_BP,i%N,j%N)], ( (1,0,1,0,0), None ) ) ]
         if K_coax > 0.0:
             if C_init * Z_coax.Q[i%N][j%N] * l_coax > 0:
-                C_eff.contribs[i%N][j%N] +=  [ (C_init * Z_coax.Q[i%N][j%N] * l_coax, [(Z_coax,i%N,j%N)] ) ]
+                C_eff.contribs[i%N][j%N] +=  [ (C_init * Z_coax.Q[i%N][j%N] * l_coax, [(Z_coax,i%N,j%N)], ( (1,0,0,0,1), None ) ) ]
 
 ##################################################################################################
 def update_Z_linear( self, i, j ):
@@ -477,6 +681,26 @@ def update_Z_linear( self, i, j ):
     Relies on previous Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear available for subfragments.
     Relies on Z_BP being already filled out for i,j
     '''
+    if self.options.semiring.max_product: # AUTOGENERATED MAX-PRODUCT BLOCK
+        offset = ( j - i ) % self.N
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        allow_loop_extension = ( not self.in_forced_base_pair ) or ( not self.in_forced_base_pair[j%N] )
+        if Z_linear.Q[i%N][(j-1)%N] > Z_linear.Q[i%N][j%N]:
+            if ligated[(j-1)%N] and allow_loop_extension: Z_linear.Q[i%N][j%N], Z_linear.backpointer[i%N][j%N] = Z_linear.Q[i%N][(j-1)%N], [(Z_linear,i%N,(j-1)%N)]
+        if Z_BP.Q[i%N][j%N] > Z_linear.Q[i%N][j%N]:
+            Z_linear.Q[i%N][j%N], Z_linear.backpointer[i%N][j%N] = Z_BP.Q[i%N][j%N], [(Z_BP,i%N,j%N)]
+        for k in range( i+1, i+offset):
+            if Z_linear.Q[i%N][(k-1)%N] * Z_BP.Q[k%N][j%N] > Z_linear.Q[i%N][j%N]:
+                if ligated[(k-1)%N]: Z_linear.Q[i%N][j%N], Z_linear.backpointer[i%N][j%N] = Z_linear.Q[i%N][(k-1)%N] * Z_BP.Q[k%N][j%N], [(Z_linear,i%N,(k-1)%N), (Z_BP,k%N,j%N)]
+        if K_coax > 0.0:
+            if Z_coax.Q[i%N][j%N] > Z_linear.Q[i%N][j%N]:
+                Z_linear.Q[i%N][j%N], Z_linear.backpointer[i%N][j%N] = Z_coax.Q[i%N][j%N], [(Z_coax,i%N,j%N)]
+            for k in range( i+1, i+offset):
+                if Z_linear.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] > Z_linear.Q[i%N][j%N]:
+                    if ligated[(k-1)%N]: Z_linear.Q[i%N][j%N], Z_linear.backpointer[i%N][j%N] = Z_linear.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N], [(Z_linear,i%N,(k-1)%N), (Z_coax,k%N,j%N)]
+        return
+
     offset = ( j - i ) % self.N
 
     (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
@@ -546,24 +770,83 @@ def update_Z_linear( self, i, j ):
          sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
         allow_loop_extension = ( not self.in_forced_base_pair ) or ( not self.in_forced_base_pair[j%N] )
         if Z_linear.Q[i%N][(j-1)%N] > 0:
-            if ligated[(j-1)%N] and allow_loop_extension: Z_linear.contribs[i%N][j%N] +=  [ (Z_linear.Q[i%N][(j-1)%N], [(Z_linear,i%N,(j-1)%N)] ) ]
+            if ligated[(j-1)%N] and allow_loop_extension: Z_linear.contribs[i%N][j%N] +=  [ (Z_linear.Q[i%N][(j-1)%N], [(Z_linear,i%N,(j-1)%N)], ( (0,0,0,0,0), None ) ) ]
         if Z_BP.Q[i%N][j%N] > 0:
-            Z_linear.contribs[i%N][j%N] +=  [ (Z_BP.Q[i%N][j%N], [(Z_BP,i%N,j%N)] ) ]
+            Z_linear.contribs[i%N][j%N] +=  [ (Z_BP.Q[i%N][j%N], [(Z_BP,i%N,j%N)], ( (0,0,0,0,0), None ) ) ]
         for k in range( i+1, i+offset):
             if Z_linear.Q[i%N][(k-1)%N] * Z_BP.Q[k%N][j%N] > 0:
-                if ligated[(k-1)%N]: Z_linear.contribs[i%N][j%N] +=  [ (Z_linear.Q[i%N][(k-1)%N] * Z_BP.Q[k%N][j%N], [(Z_linear,i%N,(k-1)%N), (Z_BP,k%N,j%N)] ) ]
+                if ligated[(k-1)%N]: Z_linear.contribs[i%N][j%N] +=  [ (Z_linear.Q[i%N][(k-1)%N] * Z_BP.Q[k%N][j%N], [(Z_linear,i%N,(k-1)%N), (Z_BP,k%N,j%N)], ( (0,0,0,0,0), None ) ) ]
         if K_coax > 0.0:
             if Z_coax.Q[i%N][j%N] > 0:
-                Z_linear.contribs[i%N][j%N] +=  [ (Z_coax.Q[i%N][j%N], [(Z_coax,i%N,j%N)] ) ]
+                Z_linear.contribs[i%N][j%N] +=  [ (Z_coax.Q[i%N][j%N], [(Z_coax,i%N,j%N)], ( (0,0,0,0,0), None ) ) ]
             for k in range( i+1, i+offset):
                 if Z_linear.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] > 0:
-                    if ligated[(k-1)%N]: Z_linear.contribs[i%N][j%N] +=  [ (Z_linear.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N], [(Z_linear,i%N,(k-1)%N), (Z_coax,k%N,j%N)] ) ]
+                    if ligated[(k-1)%N]: Z_linear.contribs[i%N][j%N] +=  [ (Z_linear.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N], [(Z_linear,i%N,(k-1)%N), (Z_coax,k%N,j%N)], ( (0,0,0,0,0), None ) ) ]
+
+    if self.options.calc_loop_counts: # AUTOGENERATED LOOP COUNTS BLOCK
+        self.loop_counts.cells_counted += 1
+        offset = ( j - i ) % self.N
+        (C_init, l, l_BP,  K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        allow_loop_extension = ( not self.in_forced_base_pair ) or ( not self.in_forced_base_pair[j%N] )
+        if ligated[(j-1)%N] and allow_loop_extension: pass
+        pass
+        for k in range( i+1, i+offset):
+            self.loop_counts.start( 0 )
+            if ligated[(k-1)%N]: self.loop_counts.add( Z_linear.Q[i%N][(k-1)%N] * Z_BP.Q[k%N][j%N] )
+        if K_coax > 0.0:
+            pass
+            for k in range( i+1, i+offset):
+                self.loop_counts.start( 0 )
+                if ligated[(k-1)%N]: self.loop_counts.add( Z_linear.Q[i%N][(k-1)%N] * Z_coax.Q[k%N][j%N] )
 
 ##################################################################################################
 def update_Z_final( self, i ):
     # Z_final is total partition function, and is computed at end of filling dynamic programming arrays
     # Get the answer (in N ways!) --> so final output is actually Z_final(i), an array.
     # Equality of the array is tested in run_cross_checks()
+    if self.options.semiring.max_product: # AUTOGENERATED MAX-PRODUCT BLOCK
+        (C_init, l, l_BP, K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        Z_final = self.Z_final
+        if not ligated[((i - 1))%N]:
+            if Z_linear.Q[i%N][(i-1)%N] > Z_final.Q[i%N]:
+                Z_final.Q[i%N], Z_final.backpointer[i%N] = Z_linear.Q[i%N][(i-1)%N], [(Z_linear,i%N,(i-1)%N)]
+        else:
+            if C_eff_no_coax_singlet.Q[i%N][(i-1)%N] * l / C_std > Z_final.Q[i%N]:
+                Z_final.Q[i%N], Z_final.backpointer[i%N] = C_eff_no_coax_singlet.Q[i%N][(i-1)%N] * l / C_std, [(C_eff_no_coax_singlet,i%N,(i-1)%N)]
+            for c in range( i, i + N - 1):
+                if Z_linear.Q[i%N][c%N] * Z_linear.Q[(c+1)%N][(i-1)%N] > Z_final.Q[i%N]:
+                    if not ligated[c%N]: Z_final.Q[i%N], Z_final.backpointer[i%N] = Z_linear.Q[i%N][c%N] * Z_linear.Q[(c+1)%N][(i-1)%N], [(Z_linear,i%N,c%N), (Z_linear,(c+1)%N,(i-1)%N)]
+            for j in range( i+1, (i + N - 1) ):
+                if ligated[j%N]:
+                    if Z_BP.val(i,j) > 0.0 and Z_BP.val(j+1,i-1) > 0.0:
+                        for base_pair_type in self.params.base_pair_types:
+                            if self.Z_BPq[base_pair_type].val(i,j) == 0.0: continue
+                            for base_pair_type2 in self.params.base_pair_types:
+                                if self.Z_BPq[base_pair_type2].val(j+1,i-1) == 0.0: continue
+                                Z_BPq1 = self.Z_BPq[base_pair_type]
+                                Z_BPq2 = self.Z_BPq[base_pair_type2]
+                                if self.params.C_eff_stack[base_pair_type2.flipped][base_pair_type] * Z_BPq2.Q[(j+1)%N][(i-1)%N] * Z_BPq1.Q[i%N][j%N] > Z_final.Q[i%N]:
+                                    Z_final.Q[i%N], Z_final.backpointer[i%N] = self.params.C_eff_stack[base_pair_type2.flipped][base_pair_type] * Z_BPq2.Q[(j+1)%N][(i-1)%N] * Z_BPq1.Q[i%N][j%N], [(Z_BPq2,(j+1)%N,(i-1)%N), (Z_BPq1,i%N,j%N)]
+            if K_coax > 0:
+                C_eff_for_coax = C_eff if allow_strained_3WJ else C_eff_no_BP_singlet
+                for j in range( i + 1, i + N - 2):
+                    for k in range( j + 2, i + N - 1):
+                        if not ligated[j%N]: continue
+                        if not ligated[(k-1)%N]: continue
+                        if Z_BP.val(i,j) == 0: continue
+                        if Z_BP.val(k,i-1) == 0: continue
+                        if Z_BP.Q[i%N][j%N] * C_eff_for_coax.Q[(j+1)%N][(k-1)%N] * Z_BP.Q[k%N][(i-1)%N] * l * l * l_coax * K_coax > Z_final.Q[i%N]:
+                            Z_final.Q[i%N], Z_final.backpointer[i%N] = Z_BP.Q[i%N][j%N] * C_eff_for_coax.Q[(j+1)%N][(k-1)%N] * Z_BP.Q[k%N][(i-1)%N] * l * l * l_coax * K_coax, [(Z_BP,i%N,j%N), (C_eff_for_coax,(j+1)%N,(k-1)%N), (Z_BP,k%N,(i-1)%N)]
+                    for k in range( j + 1, i + N - 1):
+                        if Z_BP.val(i,j) == 0: continue
+                        if Z_BP.val(k,i-1) == 0: continue
+                        if (k-j)%N == 1 and ligated[j%N]: continue
+                        if Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax > Z_final.Q[i%N]:
+                            Z_final.Q[i%N], Z_final.backpointer[i%N] = Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax, [(Z_BP,i%N,j%N), (Z_cut,j%N,k%N), (Z_BP,k%N,(i-1)%N)]
+        return
+
     (C_init, l, l_BP, K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
      sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
 
@@ -694,13 +977,13 @@ def update_Z_final( self, i ):
         Z_final = self.Z_final
         if not ligated[((i - 1))%N]:
             if Z_linear.Q[i%N][(i-1)%N] > 0:
-                Z_final.contribs[i%N] +=  [ (Z_linear.Q[i%N][(i-1)%N], [(Z_linear,i%N,(i-1)%N)] ) ]
+                Z_final.contribs[i%N] +=  [ (Z_linear.Q[i%N][(i-1)%N], [(Z_linear,i%N,(i-1)%N)], ( (0,0,0,0,0), None ) ) ]
         else:
             if C_eff_no_coax_singlet.Q[i%N][(i-1)%N] * l / C_std > 0:
-                Z_final.contribs[i%N] +=  [ (C_eff_no_coax_singlet.Q[i%N][(i-1)%N] * l / C_std, [(C_eff_no_coax_singlet,i%N,(i-1)%N)] ) ]
+                Z_final.contribs[i%N] +=  [ (C_eff_no_coax_singlet.Q[i%N][(i-1)%N] * l / C_std, [(C_eff_no_coax_singlet,i%N,(i-1)%N)], ( (0,1,0,0,0), None ) ) ]
             for c in range( i, i + N - 1):
                 if Z_linear.Q[i%N][c%N] * Z_linear.Q[(c+1)%N][(i-1)%N] > 0:
-                    if not ligated[c%N]: Z_final.contribs[i%N] +=  [ (Z_linear.Q[i%N][c%N] * Z_linear.Q[(c+1)%N][(i-1)%N], [(Z_linear,i%N,c%N), (Z_linear,(c+1)%N,(i-1)%N)] ) ]
+                    if not ligated[c%N]: Z_final.contribs[i%N] +=  [ (Z_linear.Q[i%N][c%N] * Z_linear.Q[(c+1)%N][(i-1)%N], [(Z_linear,i%N,c%N), (Z_linear,(c+1)%N,(i-1)%N)], ( (0,0,0,0,0), None ) ) ]
             for j in range( i+1, (i + N - 1) ):
                 if ligated[j%N]:
                     if Z_BP.val(i,j) > 0.0 and Z_BP.val(j+1,i-1) > 0.0:
@@ -711,7 +994,7 @@ def update_Z_final( self, i ):
                                 Z_BPq1 = self.Z_BPq[base_pair_type]
                                 Z_BPq2 = self.Z_BPq[base_pair_type2]
                                 if self.params.C_eff_stack[base_pair_type2.flipped][base_pair_type] * Z_BPq2.Q[(j+1)%N][(i-1)%N] * Z_BPq1.Q[i%N][j%N] > 0:
-                                    Z_final.contribs[i%N] +=  [ (self.params.C_eff_stack[base_pair_type2.flipped][base_pair_type] * Z_BPq2.Q[(j+1)%N][(i-1)%N] * Z_BPq1.Q[i%N][j%N], [(Z_BPq2,(j+1)%N,(i-1)%N), (Z_BPq1,i%N,j%N)] ) ]
+                                    Z_final.contribs[i%N] +=  [ (self.params.C_eff_stack[base_pair_type2.flipped][base_pair_type] * Z_BPq2.Q[(j+1)%N][(i-1)%N] * Z_BPq1.Q[i%N][j%N], [(Z_BPq2,(j+1)%N,(i-1)%N), (Z_BPq1,i%N,j%N)], ( (0,0,0,0,0), (base_pair_type2.flipped,base_pair_type) ) ) ]
             if K_coax > 0:
                 C_eff_for_coax = C_eff if allow_strained_3WJ else C_eff_no_BP_singlet
                 for j in range( i + 1, i + N - 2):
@@ -721,13 +1004,54 @@ def update_Z_final( self, i ):
                         if Z_BP.val(i,j) == 0: continue
                         if Z_BP.val(k,i-1) == 0: continue
                         if Z_BP.Q[i%N][j%N] * C_eff_for_coax.Q[(j+1)%N][(k-1)%N] * Z_BP.Q[k%N][(i-1)%N] * l * l * l_coax * K_coax > 0:
-                            Z_final.contribs[i%N] +=  [ (Z_BP.Q[i%N][j%N] * C_eff_for_coax.Q[(j+1)%N][(k-1)%N] * Z_BP.Q[k%N][(i-1)%N] * l * l * l_coax * K_coax, [(Z_BP,i%N,j%N), (C_eff_for_coax,(j+1)%N,(k-1)%N), (Z_BP,k%N,(i-1)%N)] ) ]
+                            Z_final.contribs[i%N] +=  [ (Z_BP.Q[i%N][j%N] * C_eff_for_coax.Q[(j+1)%N][(k-1)%N] * Z_BP.Q[k%N][(i-1)%N] * l * l * l_coax * K_coax, [(Z_BP,i%N,j%N), (C_eff_for_coax,(j+1)%N,(k-1)%N), (Z_BP,k%N,(i-1)%N)], ( (0,2,0,1,1), None ) ) ]
                     for k in range( j + 1, i + N - 1):
                         if Z_BP.val(i,j) == 0: continue
                         if Z_BP.val(k,i-1) == 0: continue
                         if (k-j)%N == 1 and ligated[j%N]: continue
                         if Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax > 0:
-                            Z_final.contribs[i%N] +=  [ (Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax, [(Z_BP,i%N,j%N), (Z_cut,j%N,k%N), (Z_BP,k%N,(i-1)%N)] ) ]
+                            Z_final.contribs[i%N] +=  [ (Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax, [(Z_BP,i%N,j%N), (Z_cut,j%N,k%N), (Z_BP,k%N,(i-1)%N)], ( (0,0,0,1,0), None ) ) ]
+
+    if self.options.calc_loop_counts: # AUTOGENERATED LOOP COUNTS BLOCK
+        self.loop_counts.cells_counted += 1
+        (C_init, l, l_BP, K_coax, l_coax, C_std, min_loop_length, allow_strained_3WJ, N, \
+         sequence, ligated, all_ligated, Z_BP, C_eff_basic, C_eff_no_BP_singlet, C_eff_no_coax_singlet, C_eff, Z_linear, Z_cut, Z_coax ) = unpack_variables( self )
+        Z_final = self.Z_final
+        if not ligated[((i - 1))%N]:
+            pass
+        else:
+            pass
+            for c in range( i, i + N - 1):
+                self.loop_counts.start( 0 )
+                if not ligated[c%N]: self.loop_counts.add( Z_linear.Q[i%N][c%N] * Z_linear.Q[(c+1)%N][(i-1)%N] )
+            for j in range( i+1, (i + N - 1) ):
+                self.loop_counts.start( 0 )
+                if ligated[j%N]:
+                    if Z_BP.val(i,j) > 0.0 and Z_BP.val(j+1,i-1) > 0.0:
+                        for base_pair_type in self.params.base_pair_types:
+                            if self.Z_BPq[base_pair_type].val(i,j) == 0.0: continue
+                            for base_pair_type2 in self.params.base_pair_types:
+                                if self.Z_BPq[base_pair_type2].val(j+1,i-1) == 0.0: continue
+                                Z_BPq1 = self.Z_BPq[base_pair_type]
+                                Z_BPq2 = self.Z_BPq[base_pair_type2]
+                                self.loop_counts.add( self.params.C_eff_stack[base_pair_type2.flipped][base_pair_type] * Z_BPq2.Q[(j+1)%N][(i-1)%N] * Z_BPq1.Q[i%N][j%N] )
+            if K_coax > 0:
+                C_eff_for_coax = C_eff if allow_strained_3WJ else C_eff_no_BP_singlet
+                for j in range( i + 1, i + N - 2):
+                    self.loop_counts.start( 0 )
+                    for k in range( j + 2, i + N - 1):
+                        self.loop_counts.start( 1 )
+                        if not ligated[j%N]: continue
+                        if not ligated[(k-1)%N]: continue
+                        if Z_BP.val(i,j) == 0: continue
+                        if Z_BP.val(k,i-1) == 0: continue
+                        self.loop_counts.add( Z_BP.Q[i%N][j%N] * C_eff_for_coax.Q[(j+1)%N][(k-1)%N] * Z_BP.Q[k%N][(i-1)%N] * l * l * l_coax * K_coax )
+                    for k in range( j + 1, i + N - 1):
+                        self.loop_counts.start( 1 )
+                        if Z_BP.val(i,j) == 0: continue
+                        if Z_BP.val(k,i-1) == 0: continue
+                        if (k-j)%N == 1 and ligated[j%N]: continue
+                        self.loop_counts.add( Z_BP.Q[i%N][j%N] * Z_cut.Q[j%N][k%N] * Z_BP.Q[k%N][(i-1)%N] * K_coax )
 
 ##################################################################################################
 def unpack_variables( self ):
@@ -741,3 +1065,6 @@ def unpack_variables( self ):
              self.Z_BP,self.C_eff_basic,self.C_eff_no_BP_singlet,self.C_eff_no_coax_singlet,self.C_eff,\
              self.Z_linear,self.Z_cut,self.Z_coax )
 
+
+# recursions with an AUTOGENERATED LOOP COUNTS BLOCK, see util/profiling.py
+recursions_with_loop_counts = ['update_Z_cut', 'update_Z_BPq', 'update_Z_coax', 'update_C_eff_basic', 'update_Z_linear', 'update_Z_final']
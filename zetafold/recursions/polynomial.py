@@ -0,0 +1,75 @@
+##################################################################################################
+# The recursions never need anything but +, * and division by Kd (or C_std), and comparisons to zero.
+#  So the values in the dynamic programming matrices can be truncated polynomials in a variable x
+#  instead of floats, and the same code (explicit_recursions.py or recursions.py) fills them.
+#
+# If one energy parameter is replaced by x, coefficient k of Z is the summed Boltzmann weight of
+#  all structures with exactly k copies of the feature controlled by that parameter, with the
+#  parameter itself factored out. See polynomial_partition.py.
+##################################################################################################
+import numpy as np
+
+class Polynomial:
+    '''
+    Truncated polynomial  sum_k coeffs[k] x^k,  k = 0 ... max_degree
+    x0 is the value of x for the parameters in use, which gives float( polynomial ).
+    '''
+    def __init__( self, coeffs, max_degree, x0 = 1.0 ):
+        self.coeffs = np.array( coeffs[ : max_degree+1 ], dtype = float )
+        self.max_degree = max_degree
+        self.x0 = x0
+
+    def evaluate( self, x ):
+        return np.polyval( self.coeffs[::-1], x )
+
+    def __float__( self ): return float( self.evaluate( self.x0 ) )
+
+    def __add__( self, other ):
+        if isinstance( other, Polynomial ):
+            (a, b) = (self.coeffs, other.coeffs) if len( self.coeffs ) >= len( other.coeffs ) else (other.coeffs, self.coeffs)
+            coeffs = a.copy()
+            coeffs[ :len(b) ] += b
+        else:
+            coeffs = self.coeffs.copy()
+            coeffs[ 0 ] += other
+        return Polynomial( coeffs, self.max_degree, self.x0 )
+
+    def __mul__( self, other ):
+        if isinstance( other, Polynomial ):
+            if len( self.coeffs ) == 0 or len( other.coeffs ) == 0: return Polynomial( [0.0], self.max_degree, self.x0 )
+            return Polynomial( np.convolve( self.coeffs, other.coeffs ), self.max_degree, self.x0 )
+        return Polynomial( self.coeffs * other, self.max_degree, self.x0 )
+
+    def __truediv__( self, other ):
+        if isinstance( other, Reciprocal ): return self * other.x
+        return self * ( 1.0/other )
+
+    def __pow__( self, n ):
+        assert( isinstance( n, int ) and n >= 0 )
+        prod = 1.0
+        for m in range( n ): prod = self * prod
+        return prod
+
+    # comparisons are only used to check for zero weights (coefficients are never negative)
+    def is_zero( self ): return not np.any( self.coeffs )
+    def __eq__( self, other ): return self.is_zero() if other == 0 else float( self ) == other
+    def __ne__( self, other ): return not self.__eq__( other )
+    def __gt__( self, other ): return ( not self.is_zero() ) if other == 0 else float( self ) > other
+    def __nonzero__( self ): return not self.is_zero()
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+    __div__ = __truediv__
+    __bool__ = __nonzero__
+
+class Reciprocal:
+    '''
+    Stand-in for a parameter like Kd that only shows up in the recursions as (something)/Kd.
+    Dividing by it multiplies by the polynomial x ( = 1/Kd ).
+    '''
+    def __init__( self, x ):
+        self.x = x
+
+    def __rtruediv__( self, other ): return other * self.x
+
+    __rdiv__ = __rtruediv__
@@ -0,0 +1,67 @@
+##################################################################################################
+# The recursions in recursions.py (and explicit_recursions.py) only ever 'add' alternatives for
+#  a sub-region and 'multiply' independent pieces together. So they can be evaluated in any
+#  semiring, not just the usual sum-product that gives the partition function:
+#
+#   sum_product = partition function Z (default)
+#   max_product = Boltzmann weight of the minimum free energy structure, with backpointers
+#                  stored at each (i,j) so that the MFE structure can be read off in O(N)
+#   counting_states = number of states in the ensemble (every Boltzmann weight replaced by 1)
+#   counting    = number of distinct secondary structures. The energy model has more than one state
+#                  for some sets of base pairs: with or without a coaxial stack, and adjacent pairs as a
+#                  stacked pair or as a loop with no linkers. So K_coax and C_eff_stack are set to 0
+#                  as well, leaving one state per structure. (With three or more strands, the
+#                  recursions can still reach a structure in more than one way.)
+#
+# In all of these 'multiply' is ordinary multiplication, so only 'add' and the map applied to
+#  the Boltzmann weights of the energy model need to be specified.
+##################################################################################################
+
+class Semiring:
+    def __init__( self, name, max_product = False, weight = None, no_stacks = False ):
+        '''
+        name        = tag used by partition( semiring = ... )
+        max_product = 'add' is max(), and the winning contribution is recorded as backpointer
+        weight      = function applied to each Boltzmann weight in the energy model (None = identity)
+        no_stacks   = drop coaxial stacks and stacked pairs (K_coax and C_eff_stack set to 0)
+        '''
+        self.name = name
+        self.max_product = max_product
+        self.weight = weight
+        self.no_stacks = no_stacks
+
+    def plus( self, x, y ):
+        if self.max_product: return max( x, y )
+        return x + y
+
+    def weighted_params( self, params ):
+        '''
+        Copy of AlphaFoldParams with weight() applied to every Boltzmann weight.
+        Kd and C_std appear in the recursions as 1/Kd and C_std/Kd, so the weight is applied to those factors.
+        '''
+        if self.weight == None: return params
+        params = params.get_mutable_copy()
+        for tag in [ 'C_init', 'l', 'l_BP', 'K_coax', 'l_coax' ]: setattr( params, tag, self.weight( getattr( params, tag ) ) )
+        params.C_std = 1.0
+        if self.no_stacks: params.K_coax = 0.0
+        for bpt1 in params.base_pair_types:
+            bpt1.Kd = 1.0 / self.weight( 1.0 / bpt1.Kd )
+            for bpt2 in params.base_pair_types:
+                params.C_eff_stack[ bpt1 ][ bpt2 ] = 0.0 if self.no_stacks else self.weight( params.C_eff_stack[ bpt1 ][ bpt2 ] )
+        return params
+
+def count_weight( x ):
+    return 1.0 if x > 0.0 else 0.0
+
+SUM_PRODUCT = Semiring( 'sum_product' )
+MAX_PRODUCT = Semiring( 'max_product', max_product = True )
+COUNTING    = Semiring( 'counting', weight = count_weight, no_stacks = True )
+COUNTING_STATES = Semiring( 'counting_states', weight = count_weight )
+
+semirings = {}
+for semiring in [ SUM_PRODUCT, MAX_PRODUCT, COUNTING, COUNTING_STATES ]: semirings[ semiring.name ] = semiring
+
+def get_semiring( semiring ):
+    if isinstance( semiring, Semiring ): return semiring
+    assert( semiring in semirings.keys() )
+    return semirings[ semiring ]
@@ -0,0 +1,229 @@
+##################################################################################################
+# Forward-mode derivatives. As with polynomial.py, the values in the dynamic programming matrices
+#  can be any number type that supports +, *, division and comparisons to zero. Here each value
+#  carries, next to it, its log derivatives with respect to a list of P parameters:
+#
+#     Tangent( Q, dlogQ )    dlogQ[n] = d( log Q )/d( log parameter n )
+#
+# Seeding each selected parameter with its own unit tangent and filling the matrices once with
+#  the usual recursions gives d( log Z )/d( log parameter ) for all P parameters at the same time --
+#  through every recursion, including update_Z_final. See forward_derivs.py.
+#
+# Tangent2 carries second derivatives as well, for Hessians of log Z (see forward_log_hessian()).
+#  CrossTangent carries only the second derivatives mixed between the P parameters and K other
+#  directions, as needed for derivatives of observables (see observable_derivs.py), or for a
+#  Hessian-vector product, with the one other direction a move of the log parameters along v.
+#
+# Log derivatives, rather than dQ, since the recursions mostly multiply by parameters and other
+#  constants, which leaves dlogQ unchanged -- only sums, and products of two Tangents, touch the
+#  P-vector. Weights are never negative, so log derivatives are always defined (zero if Q is zero).
+##################################################################################################
+import numpy as np
+
+class Tangent:
+    '''
+    Value Q, and log derivatives dlogQ (array of length P, never changed in place) with respect to log of each selected parameter.
+    '''
+    def __init__( self, Q, dlogQ ):
+        self.Q  = Q if isinstance( Q, float ) else float( Q )
+        self.dlogQ = dlogQ
+
+    def __float__( self ): return self.Q
+
+    def __add__( self, other ):
+        if isinstance( other, Tangent ):
+            if other.Q == 0.0: return self
+            if self.Q == 0.0: return other
+            Q = self.Q + other.Q
+            return Tangent( Q, ( self.Q/Q ) * self.dlogQ + ( other.Q/Q ) * other.dlogQ )
+        if not is_number( other ): return NotImplemented # e.g., DynamicProgrammingData in recursions.py
+        if other == 0.0: return self
+        Q = self.Q + other
+        return Tangent( Q, ( self.Q/Q ) * self.dlogQ )
+
+    def __mul__( self, other ):
+        if isinstance( other, float ): return Tangent( self.Q * other, self.dlogQ ) # most common case, first
+        if isinstance( other, Tangent ): return Tangent( self.Q * other.Q, self.dlogQ + other.dlogQ )
+        if not is_number( other ): return NotImplemented
+        return Tangent( self.Q * other, self.dlogQ )
+
+    def __truediv__( self, other ):
+        if isinstance( other, Tangent ): return self * other.reciprocal()
+        if not is_number( other ): return NotImplemented
+        return Tangent( self.Q / other, self.dlogQ )
+
+    def __rtruediv__( self, other ):
+        return self.reciprocal() * other
+
+    def reciprocal( self ):
+        return Tangent( 1.0/self.Q, -self.dlogQ )
+
+    def __pow__( self, n ):
+        assert( isinstance( n, int ) and n >= 0 )
+        if n == 0: return 1.0
+        return Tangent( self.Q ** n, n * self.dlogQ )
+
+    # comparisons only look at the value (used for zero checks, K_coax > 0, etc.)
+    def __eq__( self, other ): return self.Q == float( other )
+    def __ne__( self, other ): return self.Q != float( other )
+    def __gt__( self, other ): return self.Q >  float( other )
+    def __ge__( self, other ): return self.Q >= float( other )
+    def __lt__( self, other ): return self.Q <  float( other )
+    def __le__( self, other ): return self.Q <= float( other )
+    def __nonzero__( self ): return self.Q != 0.0
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+    __div__  = __truediv__
+    __rdiv__ = __rtruediv__
+    __bool__ = __nonzero__
+    __hash__ = None
+
+class Tangent2( Tangent ):
+    '''
+    Tangent that also carries second log derivatives d2logQ (P x P array). For a sum Q = Qa + Qb,
+     with weights wa = Qa/Q and wb = Qb/Q,
+
+        d2logQ = wa d2logQa + wb d2logQb + wa wb ( dlogQa - dlogQb )( dlogQa - dlogQb )^T
+
+     so for Z, d2logQ is the covariance of the feature counts that the parameters control.
+    '''
+    def __init__( self, Q, dlogQ, d2logQ ):
+        Tangent.__init__( self, Q, dlogQ )
+        self.d2logQ = d2logQ
+
+    def __add__( self, other ):
+        if isinstance( other, Tangent2 ):
+            if other.Q == 0.0: return self
+            if self.Q == 0.0: return other
+            Q = self.Q + other.Q
+            ( wa, wb, diff ) = ( self.Q/Q, other.Q/Q, self.dlogQ - other.dlogQ )
+            return Tangent2( Q, wa * self.dlogQ + wb * other.dlogQ, wa * self.d2logQ + wb * other.d2logQ + ( wa * wb ) * np.outer( diff, diff ) )
+        if not is_number( other ): return NotImplemented
+        if other == 0.0: return self
+        Q = self.Q + other
+        ( wa, wb ) = ( self.Q/Q, other/Q )
+        return Tangent2( Q, wa * self.dlogQ, wa * self.d2logQ + ( wa * wb ) * np.outer( self.dlogQ, self.dlogQ ) )
+
+    def __mul__( self, other ):
+        if isinstance( other, float ): return Tangent2( self.Q * other, self.dlogQ, self.d2logQ )
+        if isinstance( other, Tangent2 ): return Tangent2( self.Q * other.Q, self.dlogQ + other.dlogQ, self.d2logQ + other.d2logQ )
+        if not is_number( other ): return NotImplemented
+        return Tangent2( self.Q * other, self.dlogQ, self.d2logQ )
+
+    def __truediv__( self, other ):
+        if isinstance( other, Tangent2 ): return self * other.reciprocal()
+        if not is_number( other ): return NotImplemented
+        return Tangent2( self.Q / other, self.dlogQ, self.d2logQ )
+
+    def reciprocal( self ):
+        return Tangent2( 1.0/self.Q, -self.dlogQ, -self.d2logQ )
+
+    def __pow__( self, n ):
+        assert( isinstance( n, int ) and n >= 0 )
+        if n == 0: return 1.0
+        return Tangent2( self.Q ** n, n * self.dlogQ, n * self.d2logQ )
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+    __div__  = __truediv__
+
+class CrossTangent( Tangent ):
+    '''
+    Tangent over P parameters that also carries first log derivatives with respect to K other directions e_k,
+     and their log derivatives with respect to the parameters -- the block of the Tangent2 Hessian over P + K
+     directions that mixes the two. All in one (K+1) x (P+1) array, never changed in place:
+
+        derivs[ 0, n+1 ]   = d( log Q )/d( log parameter n )
+        derivs[ k+1, 0 ]   = d( log Q )/d e_k
+        derivs[ k+1, n+1 ] = d2( log Q )/d e_k d( log parameter n )
+        derivs[ 0, 0 ]     = 0
+
+     For a sum, the Tangent2 term wa wb ( dlogQa - dlogQb )( dlogQa - dlogQb )^T restricted to the mixed block is
+     wa wb outer( D[:,0], D[0,:] ) with D = derivs_a - derivs_b, which is zero in row and column 0. The P x P and
+     K x K blocks are never needed for observables, so each operation is O( K P ), not O( (P+K)^2 ).
+    '''
+    def __init__( self, Q, derivs ):
+        self.Q  = Q if isinstance( Q, float ) else float( Q )
+        self.derivs = derivs
+
+    def __add__( self, other ):
+        if isinstance( other, CrossTangent ):
+            if other.Q == 0.0: return self
+            if self.Q == 0.0: return other
+            Q = self.Q + other.Q
+            ( wa, wb ) = ( self.Q/Q, other.Q/Q )
+            D = self.derivs - other.derivs
+            return CrossTangent( Q, other.derivs + wa * D + ( wa * wb ) * np.outer( D[ :, 0 ], D[ 0 ] ) )
+        if not is_number( other ): return NotImplemented
+        if other == 0.0: return self
+        Q = self.Q + other
+        ( wa, wb ) = ( self.Q/Q, other/Q )
+        return CrossTangent( Q, wa * self.derivs + ( wa * wb ) * np.outer( self.derivs[ :, 0 ], self.derivs[ 0 ] ) )
+
+    def __mul__( self, other ):
+        if isinstance( other, float ): return CrossTangent( self.Q * other, self.derivs )
+        if isinstance( other, CrossTangent ): return CrossTangent( self.Q * other.Q, self.derivs + other.derivs )
+        if not is_number( other ): return NotImplemented
+        return CrossTangent( self.Q * other, self.derivs )
+
+    def __truediv__( self, other ):
+        if isinstance( other, CrossTangent ): return self * other.reciprocal()
+        if not is_number( other ): return NotImplemented
+        return CrossTangent( self.Q / other, self.derivs )
+
+    def reciprocal( self ):
+        return CrossTangent( 1.0/self.Q, -self.derivs )
+
+    def __pow__( self, n ):
+        assert( isinstance( n, int ) and n >= 0 )
+        if n == 0: return 1.0
+        return CrossTangent( self.Q ** n, n * self.derivs )
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+    __div__  = __truediv__
+
+def is_number( x ): return isinstance( x, ( int, long, float ) )
+
+def get_seed( val, n, num_params, second_order = False ):
+    '''
+    val as a Tangent (or Tangent2) with unit log derivative with respect to parameter n, plus any tangents val already has.
+    '''
+    dlogQ = np.zeros( num_params )
+    if isinstance( val, Tangent ): dlogQ += val.dlogQ
+    dlogQ[ n ] += 1.0
+    if second_order: return Tangent2( val, dlogQ, val.d2logQ if isinstance( val, Tangent2 ) else np.zeros( ( num_params, num_params ) ) )
+    return Tangent( val, dlogQ )
+
+def get_cross_seed( val, n, num_params, num_directions, direction_weights = None ):
+    '''
+    val as a CrossTangent with unit log derivative with respect to parameter n, and room for num_directions other directions.
+    direction_weights = d( log parameter n )/d e_k for each direction, if the directions move the parameters too.
+    '''
+    derivs = np.zeros( ( num_directions + 1, num_params + 1 ) )
+    if isinstance( val, CrossTangent ): derivs += val.derivs
+    derivs[ 0, n+1 ] += 1.0
+    if direction_weights is not None: derivs[ 1:, 0 ] += direction_weights
+    return CrossTangent( val, derivs )
+
+def get_log_derivs_from_tangent( Z, num_params ):
+    '''
+    d( log Z )/d( log parameter ) for each parameter, from the Tangent Z (or a float, if no parameter ever entered Z).
+    '''
+    if not isinstance( Z, Tangent ) or Z.Q == 0.0: return [ 0.0 ] * num_params
+    return Z.dlogQ.tolist()
+
+def get_log_hessian_from_tangent( Z, num_params ):
+    '''
+    d2( log Z )/d( log parameter )^2, from the Tangent2 Z.
+    '''
+    if not isinstance( Z, Tangent2 ) or Z.Q == 0.0: return np.zeros( ( num_params, num_params ) )
+    return Z.d2logQ
+
+def get_cross_derivs_from_tangent( Z, num_params, num_directions ):
+    '''
+    ( d( log Z )/d e_k, d2( log Z )/d e_k d( log parameter n ) ) -- K values and K x P array -- from the CrossTangent Z.
+    '''
+    if not isinstance( Z, CrossTangent ) or Z.Q == 0.0: return ( [ 0.0 ] * num_directions, np.zeros( ( num_directions, num_params ) ) )
+    return ( Z.derivs[ 1:, 0 ].tolist(), Z.derivs[ 1:, 1: ] )
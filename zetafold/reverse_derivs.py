@@ -0,0 +1,275 @@
+from __future__ import print_function
+import copy
+import numpy as np
+from .parameters import get_Kd_base_pair_types, get_mutable_copy
+from .forward_derivs import set_tangent_parameter
+from .recursions.tangent import Tangent
+from .recursions.contribs_records import get_matrix_index, factor_params, max_branches
+
+##################################################################################################
+# Reverse mode (adjoint, or 'outside') derivatives of log Z.
+#
+# Every filled cell is a sum of contributions  weight = ( factor of parameters ) x product of Q of other
+#  cells ('branches'). Going back through the cells in the reverse of the order in which they were filled,
+#  starting from Z_final(0), each cell hands its adjoint  A = dZ/dQ  down to its branches:
+#
+#     A( branch ) += A( cell ) * weight / Q( branch )
+#
+#  and the same weight gives the derivative through the parameters in its factor. With
+#  explicit_dynamic_programming.py, that is all in the contribution records that sampling.py uses too
+#  (contribs_records.py), which carry the exponents of the parameters in their factor -- so the sweep is
+#  array arithmetic on cached records, with the derivatives of the parameters in factor_params and of
+#  the C_eff_stack entries looked up once. The simple recursions (dynamic_programming.py) do not give
+#  factors, so there contributions are recomputed with the selected parameters as Tangents (see
+#  recursions/tangent.py). The two factors that are in neither are added per cell: 1/Kd, which
+#  multiplies every contribution to Z_BPq, and C_init, which is the value of the C_eff diagonal.
+#
+# One sweep costs about as much as computing the contributions of every cell once, however many
+#  parameters there are. Needs only the cells that Z_final(0) depends on, so calc_all_elements is not required.
+#
+# Observables F_k = sum c_k(i,j) bpp(i,j) (see observable_derivs.py) are d( log Z )/d e_k when each
+#  base pair gets a factor exp( e_k c_k(i,j) ), and their log derivatives are d/d e_k of the gradient.
+#  So, with contribution records, the sweep can carry forward derivatives in the e_k as well: first
+#  D = d( log Q )/d e_k of every cell, in fill order through the same records, then dA/d e_k next to
+#  each adjoint A. That is O( K ) extra per record, not O( K P ).
+##################################################################################################
+class Adjoints:
+    '''
+    Outside sweep over filled Partition partition (sum_product), for parameters deriv_params.
+
+      log_derivs = d( log Z )/d( log parameter ) for each of deriv_params
+      get_cell_log_deriv( DP, i, j ) = d( log Z )/d( log Q ) of a cell, i.e. A * Q / Z
+
+    pair_weights = list of K dicts { (i,j): c(i,j) } of observables (needs contribution records), giving also
+
+      observables            = F_k = sum over base pairs of c_k(i,j) bpp(i,j)
+      observable_log_derivs  = dF_k/d( log parameter ) (K x P array)
+    '''
+    def __init__( self, partition, deriv_params, pair_weights = None ):
+        assert( not partition.options.semiring.max_product and not partition.options.semiring.weight )
+        self.partition = partition
+        self.deriv_params = deriv_params
+        self.matrix_index = get_matrix_index( partition )
+        N = partition.N
+        self.adjoint = np.zeros( ( len( self.matrix_index ), N, N ) ) # dZ/dQ of each cell, in get_all_matrices() order; Z_final(i) at [ -1, i, 0 ]
+        self.grad = np.zeros( len( deriv_params ) ) # dZ/d( log parameter )
+        self.tangent_partition = get_tangent_partition( partition, deriv_params )
+        ( self.factor_seeds, self.C_eff_stack_seeds ) = get_factor_seeds( self.tangent_partition.params, len( deriv_params ) )
+        self.Kd_seeds = get_Kd_seeds( partition.params, deriv_params )
+        self.C_init_seed = self.factor_seeds[ factor_params.index( 'C_init' ) ]
+        self.use_records = hasattr( partition.Z_final, 'get_contribs_records' )
+        if self.use_records: self.Q = np.array( [ DP.Q for DP in partition.Z_all ] )
+        else:                self.Q = np.array( [ [ [ DP.val( i, j ) for j in range( N ) ] for i in range( N ) ] for DP in partition.Z_all ] )
+        self.pair_weights = None
+        if pair_weights != None:
+            assert( self.use_records )
+            K = len( pair_weights )
+            self.pair_weights = get_pair_weight_table( pair_weights, N ) # K x N x N, symmetric
+            self.D = np.zeros( ( K, ) + self.adjoint.shape ) # d( log Q )/d e_k of each cell
+            self.adjoint_e = np.zeros( ( K, ) + self.adjoint.shape ) # d( dZ/dQ )/d e_k
+            self.grad_e = np.zeros( ( K, len( deriv_params ) ) )
+            run_directional_sweep( self )
+        run_outside_sweep( self )
+        Z = partition.Z_final.val( 0 )
+        self.log_derivs = ( self.grad / Z ).tolist() if Z > 0.0 else [ 0.0 ] * len( deriv_params )
+        if self.pair_weights is not None:
+            self.observables = self.D[ :, -1, 0, 0 ].tolist()
+            self.observable_log_derivs = ( self.grad_e - np.outer( self.D[ :, -1, 0, 0 ], self.grad ) ) / Z if Z > 0.0 else np.zeros( self.grad_e.shape )
+
+    def get_cell_adjoint( self, DP, i, j = None ):
+        '''
+        dZ/dQ of a cell of DP (a matrix in get_all_matrices( partition )), zero if Z does not depend on it.
+        '''
+        N = self.partition.N
+        return float( self.adjoint[ self.matrix_index[ id( DP ) ], i % N, 0 if j == None else j % N ] )
+
+    def get_cell_log_deriv( self, DP, i, j = None ):
+        Q = DP.val( i ) if j == None else DP.val( i, j )
+        return self.get_cell_adjoint( DP, i, j ) * Q / self.partition.Z_final.val( 0 )
+
+def get_adjoint_log_derivs( self, deriv_parameters ):
+    '''
+    d( log Z )/d( log parameter ), from one outside sweep. Same interface as _get_log_derivs() in derivatives.py.
+    '''
+    if deriv_parameters == None: return None
+    if deriv_parameters == []:
+        for tag in self.params.parameter_tags: deriv_parameters.append( tag )
+    return Adjoints( self, deriv_parameters ).log_derivs
+
+##################################################################################################
+def run_outside_sweep( self ):
+    '''
+    Cells in reverse order of the fill in Partition.run() -- Z_final, then segments from longest to
+     shortest, and at each (i,j) matrices in reverse order of Z_all -- so each cell's adjoint is complete
+     before it is passed on. Contributions only go to shorter segments or to earlier matrices of the same
+     segment, so all segments of one length are passed on together, a matrix at a time.
+    '''
+    p = self.partition
+    N = p.N
+    bpt_for_matrix = dict( ( self.matrix_index[ id( DP ) ], bpt ) for ( bpt, DP ) in p.Z_BPq.items() )
+    matrices = list( reversed( list( enumerate( p.Z_all ) ) ) )
+
+    self.adjoint[ -1, 0, 0 ] = 1.0
+    pass_adjoint( self, p.Z_final, [ ( 0, None ) ], np.ones( 1 ), None if self.pair_weights is None else np.zeros( ( len( self.pair_weights ), 1 ) ) )
+    rows = np.arange( N )
+    for offset in range( N-1, 0, -1 ):
+        cols = ( rows + offset ) % N
+        for ( m, DP ) in matrices:
+            adjoints = self.adjoint[ m, rows, cols ]
+            live = np.flatnonzero( adjoints )
+            if len( live ) == 0: continue
+            ( live_rows, live_cols ) = ( rows[ live ], cols[ live ] )
+            ( adjoints, Q ) = ( adjoints[ live ], self.Q[ m, live_rows, live_cols ] )
+            adjoints_e = None
+            if self.pair_weights is not None:
+                adjoints_e = self.adjoint_e[ :, m, live_rows, live_cols ]
+                if m in bpt_for_matrix:
+                    # Kd term below, with d( Q )/d e_k = Q D; contributions see the base pair factor, d/d e_k = c_k(i,j)
+                    self.grad_e -= np.outer( np.dot( adjoints_e + adjoints * self.D[ :, m, live_rows, live_cols ], Q ), self.Kd_seeds[ bpt_for_matrix[ m ] ] )
+                    adjoints_e = adjoints_e + adjoints * self.pair_weights[ :, live_rows, live_cols ]
+            pass_adjoint( self, DP, zip( live_rows.tolist(), live_cols.tolist() ), adjoints, adjoints_e )
+            if m in bpt_for_matrix: self.grad -= np.dot( adjoints, Q ) * self.Kd_seeds[ bpt_for_matrix[ m ] ]
+
+    # shortest segments: C_eff(i,i) = C_init
+    for DP in [ p.C_eff_basic, p.C_eff_no_BP_singlet, p.C_eff_no_coax_singlet, p.C_eff ]:
+        m = self.matrix_index[ id( DP ) ]
+        self.grad += np.dot( self.adjoint[ m, rows, rows ], self.Q[ m, rows, rows ] ) * self.C_init_seed
+        if self.pair_weights is not None: self.grad_e += np.outer( np.dot( self.adjoint_e[ :, m, rows, rows ], self.Q[ m, rows, rows ] ), self.C_init_seed )
+
+def pass_adjoint( self, DP, cells, adjoints, adjoints_e = None ):
+    '''
+    Add adjoints of cells [ ( i, j ), ... ] of DP (j = None for Z_final) to the cells that their
+     contributions multiply, and to the gradient -- and adjoints_e, their d/d e_k (K x cells), if observables are carried.
+    '''
+    if not self.use_records:
+        for ( ( i, j ), adjoint ) in zip( cells, adjoints.tolist() ): pass_adjoint_with_tangents( self, DP, adjoint, i, j )
+        return
+    N = self.partition.N
+    ( records, counts ) = get_records( self, DP, cells )
+    if len( records ) == 0: return
+    weights = np.repeat( adjoints, counts ) * records[ 'weight' ]
+    self.grad += np.dot( np.dot( weights, records[ 'factor' ] ), self.factor_seeds )
+    stack = records[ 'stack' ]
+    stacked = ( stack[ :, 0 ] >= 0 )
+    if stacked.any(): self.grad += np.dot( weights[ stacked ], self.C_eff_stack_seeds[ stack[ stacked, 0 ], stack[ stacked, 1 ] ] )
+    used = ( records[ 'matrix' ] >= 0 )
+    branch = ( records[ 'matrix' ][ used ], records[ 'i' ][ used ] % N, records[ 'j' ][ used ] % N )
+    branch_weights = np.repeat( weights, max_branches ).reshape( used.shape )[ used ]
+    np.add.at( self.adjoint, branch, branch_weights / self.Q[ branch ] )
+    if adjoints_e is None: return
+
+    # d/d e_k of all of the above: each weight changes by D summed over its branches
+    ( branch_D, D_sum ) = get_branch_D( self, records, used, branch )
+    weights_e = np.repeat( adjoints_e, counts, axis = 1 ) * records[ 'weight' ] + weights * D_sum
+    self.grad_e += np.dot( np.dot( weights_e, records[ 'factor' ] ), self.factor_seeds )
+    if stacked.any(): self.grad_e += np.dot( weights_e[ :, stacked ], self.C_eff_stack_seeds[ stack[ stacked, 0 ], stack[ stacked, 1 ] ] )
+    branch_weights_e = np.repeat( weights_e, max_branches, axis = 1 ).reshape( ( len( weights_e ), ) + used.shape )[ :, used ]
+    np.add.at( self.adjoint_e, ( slice( None ), ) + branch, ( branch_weights_e - branch_weights * branch_D ) / self.Q[ branch ] )
+
+def get_records( self, DP, cells ):
+    '''
+    Contribution records of cells [ ( i, j ), ... ] of DP, concatenated, and the number for each cell.
+    '''
+    records = [ DP.get_contribs_records( self.partition, i ) if j == None else DP.get_contribs_records( self.partition, i, j ) for ( i, j ) in cells ]
+    counts = [ len( cell_records ) for cell_records in records ]
+    return ( np.concatenate( records ), counts )
+
+def get_branch_D( self, records, used, branch ):
+    '''
+    D = d( log Q )/d e_k of the branches of records that are used (K x number used), and summed over the branches of each record (K x records).
+    '''
+    branch_D = self.D[ ( slice( None ), ) + branch ]
+    D_by_record = np.zeros( ( len( self.D ), ) + used.shape )
+    D_by_record[ :, used ] = branch_D
+    return ( branch_D, D_by_record.sum( axis = 2 ) )
+
+def run_directional_sweep( self ):
+    '''
+    D = d( log Q )/d e_k of each cell, in the order of the fill in Partition.run(): for a cell with contributions
+     of weight w, D = sum w ( D summed over branches ) / Q, plus c_k(i,j) for Z_BPq, which carries the base pair factor.
+    '''
+    p = self.partition
+    N = p.N
+    bpt_matrices = set( self.matrix_index[ id( DP ) ] for DP in p.Z_BPq.values() )
+    rows = np.arange( N )
+    for offset in range( 1, N ):
+        cols = ( rows + offset ) % N
+        for ( m, DP ) in enumerate( p.Z_all ):
+            Q = self.Q[ m, rows, cols ]
+            live = np.flatnonzero( Q )
+            if len( live ) == 0: continue
+            ( live_rows, live_cols ) = ( rows[ live ], cols[ live ] )
+            self.D[ :, m, live_rows, live_cols ] = get_directional_log_derivs( self, DP, zip( live_rows.tolist(), live_cols.tolist() ), Q[ live ] )
+            if m in bpt_matrices: self.D[ :, m, live_rows, live_cols ] += self.pair_weights[ :, live_rows, live_cols ]
+    self.D[ :, -1, 0, 0 ] = get_directional_log_derivs( self, p.Z_final, [ ( 0, None ) ], np.array( [ p.Z_final.val( 0 ) ] ) )[ :, 0 ]
+
+def get_directional_log_derivs( self, DP, cells, Q ):
+    '''
+    d( log Q )/d e_k (K x cells) of cells [ ( i, j ), ... ] of DP with values Q, from their contribution records.
+    '''
+    N = self.partition.N
+    ( records, counts ) = get_records( self, DP, cells )
+    dQ = np.zeros( ( len( cells ), len( self.D ) ) )
+    if len( records ) == 0: return dQ.T
+    used = ( records[ 'matrix' ] >= 0 )
+    branch = ( records[ 'matrix' ][ used ], records[ 'i' ][ used ] % N, records[ 'j' ][ used ] % N )
+    D_sum = get_branch_D( self, records, used, branch )[ 1 ]
+    np.add.at( dQ, np.repeat( np.arange( len( cells ) ), counts ), ( D_sum * records[ 'weight' ] ).T )
+    return dQ.T / Q
+
+def get_pair_weight_table( pair_weights, N ):
+    '''
+    c_k(i,j) of pair_weights (list of K dicts { (i,j): c }) as a K x N x N array, with c_k(j,i) = c_k(i,j).
+    '''
+    table = np.zeros( ( len( pair_weights ), N, N ) )
+    for ( k, weights ) in enumerate( pair_weights ):
+        for ( ( i, j ), c ) in weights.items(): table[ k, i, j ] = table[ k, j, i ] = c
+    return table
+
+def pass_adjoint_with_tangents( self, DP, adjoint, i, j ):
+    '''
+    pass_adjoint() of one cell, for matrices that do not give the factors of their contributions (dynamic_programming.py).
+    '''
+    N = self.partition.N
+    contribs = DP.compute_contribs( self.tangent_partition, i ) if j == None else DP.compute_contribs( self.tangent_partition, i, j )
+    for ( weight, branches ) in contribs:
+        weight_val = float( weight )
+        if weight_val == 0.0: continue
+        if isinstance( weight, Tangent ): self.grad += ( adjoint * weight_val ) * weight.dlogQ
+        for ( DP_branch, k, l ) in branches:
+            self.adjoint[ self.matrix_index[ id( DP_branch ) ], k % N, l % N ] += adjoint * weight_val / DP_branch.val( k, l )
+
+##################################################################################################
+def get_tangent_partition( partition, deriv_params ):
+    '''
+    Shallow copy of partition (same filled matrices), with parameters that are Tangents for deriv_params.
+    Kd are left alone, since they sit in base pair types shared with partition -- see get_Kd_seeds().
+    '''
+    params = get_mutable_copy( partition.params, deep = False )
+    params.C_eff_stack = dict( ( bpt1, dict( C_eff_stack ) ) for ( bpt1, C_eff_stack ) in partition.params.C_eff_stack.items() )
+    for n,param in enumerate( deriv_params ):
+        if param[:2] != 'Kd': set_tangent_parameter( params, param, n, len( deriv_params ) )
+    tangent_partition = copy.copy( partition )
+    tangent_partition.params = params
+    return tangent_partition
+
+def get_Kd_seeds( params, deriv_params ):
+    '''
+    For each base pair type, d( log Kd )/d( log parameter ) for each of deriv_params.
+    '''
+    Kd_seeds = dict( ( bpt, np.zeros( len( deriv_params ) ) ) for bpt in params.base_pair_types )
+    for n,param in enumerate( deriv_params ):
+        if param[:2] == 'Kd':
+            for bpt in get_Kd_base_pair_types( params, param ): Kd_seeds[ bpt ][ n ] += 1.0
+    return Kd_seeds
+
+def get_factor_seeds( params, num_params ):
+    '''
+    d( log value )/d( log parameter ) of factor_params ( len( factor_params ) x num_params ) and of the
+     C_eff_stack entries over params.base_pair_types ( T x T x num_params ), for params of get_tangent_partition().
+    '''
+    get_seed = lambda val: val.dlogQ if isinstance( val, Tangent ) else np.zeros( num_params )
+    factor_seeds = np.array( [ get_seed( getattr( params, name ) ) for name in factor_params ] )
+    bpts = params.base_pair_types
+    C_eff_stack_seeds = np.array( [ [ get_seed( params.C_eff_stack[ bpt1 ][ bpt2 ] ) for bpt2 in bpts ] for bpt1 in bpts ] )
+    return ( factor_seeds, C_eff_stack_seeds )
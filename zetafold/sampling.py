@@ -0,0 +1,327 @@
+from __future__ import print_function
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import os
+import random
+import numpy as np
+from .recursions.contribs_view import get_all_matrices
+from .recursions.contribs_records import get_matrix_index, encode_contribs
+
+##################################################################################################
+# High-volume Boltzmann sampling of structures, and traceback for backtrack() in backtrack.py.
+#
+# BoltzmannSampler builds an alias table for the contributions of each cell the first time a traceback
+#  visits it, and keeps it for all later tracebacks. Tables are built straight from the contribution
+#  records of the cell (see recursions/contribs_records.py) -- weights, and matrix index and cell of each
+#  branch -- with matrices looked up by index only when a branch is followed. Each draw is then O(1) per cell, and a structure
+#  is O(number of cells visited), walked with an explicit stack -- no Python recursion. Structures from
+#  sample() come out as rows of a pair table:
+#
+#    pair_tables[ n ][ i ] = partner of nucleotide i in sample n, or -1 if i is unpaired.
+#
+# With a seed, samples are drawn in blocks of sampling_block_size, each with its own random number
+#  stream derived from ( seed, block ). Blocks can go to worker processes, forked from the process
+#  holding the filled Partition, so they share its matrices read-only. Results are then the same for
+#  any number of workers.
+#
+# enumerate_best_first() streams structures in order of decreasing probability, with a priority queue
+#  of partial structures instead of a stack. Memory is held by that queue (the frontier), and a caller
+#  that stops after k structures, or below a probability cutoff, never expands the rest of the ensemble.
+##################################################################################################
+sampling_block_size = 100
+
+class BoltzmannSampler:
+    '''
+    Draws Boltzmann-weighted structures from a Partition that has been run (sum-product semiring).
+    seed = seed for this sampler's own random.Random, so that samples can be reproduced. Default None
+            uses the module-level random, like backtrack().
+    '''
+    def __init__( self, partition, seed = None ):
+        self.partition = partition
+        self.N = partition.N
+        self.matrices = get_all_matrices( partition )
+        self.matrix_index = get_matrix_index( partition )
+        Z_BPq_matrices = set( id( Z_BPq ) for Z_BPq in partition.Z_BPq.values() )
+        self.is_Z_BPq = [ id( DP ) in Z_BPq_matrices for DP in self.matrices ]
+        self.tables = {} # ( id( DP ), i, j ) -> SamplingTable
+        self.contribs_tables = {} # id( contribs ) -> ( contribs, SamplingTable ), for tracebacks from a given list of contributions
+        self.set_seed( seed )
+
+    def set_seed( self, seed ):
+        self.rng = random.Random( seed ) if seed != None else random
+
+    def get_table( self, DP, i, j = None ):
+        key = ( id( DP ), i, j )
+        table = self.tables.get( key )
+        if table == None:
+            table = SamplingTable( self.get_contribs_records( DP, i, j ), self.N, self.is_Z_BPq )
+            table.cell = ( DP, i, j )
+            table = self.tables.setdefault( key, table ) # first one in wins
+        return table
+
+    def get_contribs_table( self, contribs ):
+        ( cached_contribs, table ) = self.contribs_tables.get( id( contribs ), ( None, None ) )
+        if cached_contribs is not contribs:
+            table = SamplingTable( encode_contribs( contribs, self.matrix_index ), self.N, self.is_Z_BPq )
+            self.contribs_tables[ id( contribs ) ] = ( contribs, table )
+        return table
+
+    def get_contribs_records( self, DP, i, j = None ):
+        '''
+        Contribution records of cell (i,j) of DP (or i of Z_final), as cached by explicit_dynamic_programming.py --
+         or encoded from the lists that dynamic_programming.py caches.
+        '''
+        if hasattr( DP, 'get_contribs_records' ):
+            return DP.get_contribs_records( self.partition, i ) if j == None else DP.get_contribs_records( self.partition, i, j )
+        contribs = DP.get_contribs( self.partition, i ) if j == None else DP.get_contribs( self.partition, i, j )
+        return encode_contribs( contribs, self.matrix_index )
+
+    def get_children( self, table, idx ):
+        '''
+        ( base pairs, tables ) for the branches of contribution idx, looked up once and then linked from
+         table. Leaves are dropped, and cells with a single contribution are folded in -- their base pairs
+         are added, and their branches replace them -- since drawing from them is always the same. Stored
+         with one assignment, so that threads sampling from the same tables see all or nothing.
+        '''
+        children = []
+        base_pairs = table.base_pairs[ idx ][:]
+        branches = table.branches[ idx ][::-1]
+        while len( branches ) > 0:
+            ( m, i, j ) = branches.pop()
+            child = self.get_table( self.matrices[ m ], i, j )
+            if child.num_contribs == 0: continue
+            if child.num_contribs == 1:
+                base_pairs += child.base_pairs[ 0 ]
+                branches += child.branches[ 0 ][::-1]
+                continue
+            children.append( child )
+        table.children[ idx ] = ( base_pairs, children )
+        return table.children[ idx ]
+
+    def draw( self, table = None, mode = 'stochastic', rng = None ):
+        '''
+        One sampled structure, as ( list of base pairs, probability of the structure ), tracing back from
+         table (default: Z_final(0)). mode = 'stochastic', or 'mfe' to follow the contribution of maximum weight.
+        rng = random number generator for this draw (default: this sampler's).
+        '''
+        rng_random = ( rng if rng != None else self.rng ).random
+        follow_best = ( mode == 'mfe' )
+        bps = []
+        p = 1.0
+        stack = [ table if table != None else self.get_table( self.partition.Z_final, 0 ) ]
+        while len( stack ) > 0:
+            table = stack.pop()
+            if table.num_contribs == 0: continue
+            idx = table.best if follow_best else table.draw( rng_random )
+            p *= table.probability[ idx ]
+            children = table.children[ idx ]
+            if children == None: children = self.get_children( table, idx )
+            bps += children[0]
+            stack += children[1]
+        return ( bps, p )
+
+    def enumerate( self, table = None ):
+        '''
+        Generator over all structures from table (default: Z_final(0)), as ( list of base pairs, probability ),
+         in the order of backtrack( mode = 'enumerative' ). Each partial structure is ( p, base pairs, cells
+         left to trace back ), with base pairs and cells held as linked lists ( item, rest ), so that partial
+         structures share their common parts instead of copying them.
+        '''
+        if table == None: table = self.get_table( self.partition.Z_final, 0 )
+        partial_structures = [ ( 1.0, None, ( table, None ) ) ]
+        while len( partial_structures ) > 0:
+            ( p, bps, cells ) = partial_structures.pop()
+            if cells == None:
+                yield ( get_list( bps )[::-1], p )
+                continue
+            ( table, cells ) = cells
+            for idx in range( table.num_contribs - 1, -1, -1 ):
+                if table.probability[ idx ] == 0.0: continue
+                children = table.children[ idx ]
+                if children == None: children = self.get_children( table, idx )
+                ( new_bps, new_cells ) = ( bps, cells )
+                for base_pair in children[0]: new_bps = ( base_pair, new_bps )
+                for child in children[1][::-1]: new_cells = ( child, new_cells )
+                partial_structures.append( ( p * table.probability[ idx ], new_bps, new_cells ) )
+
+    def enumerate_best_first( self, max_product_partition, table = None, p_min = 0.0 ):
+        '''
+        Generator over structures from table (default: Z_final(0)), as ( list of base pairs, probability ), in
+         order of decreasing probability, down to p_min. Like enumerate(), but partial structures wait in a
+         priority queue, ordered by an upper bound on the probability of any structure they lead to:
+
+           p * ( product over cells left to trace back of get_best_completion( cell ) )
+
+         So the first complete structure out of the queue is the most probable one left. Partial structures
+         whose bound is below p_min are dropped. max_product_partition = same Partition, filled in the
+         max-product semiring, for the bounds.
+        '''
+        max_product_matrices = dict( ( DP.name, DP ) for DP in get_all_matrices( max_product_partition ) )
+        get_bound = lambda table: self.get_best_completion( table, max_product_matrices )
+        if table == None: table = self.get_table( self.partition.Z_final, 0 )
+        if table.num_contribs == 0: return
+        counter = itertools.count() # ties go first in, first out
+        frontier = [ ( -get_bound( table ), next( counter ), 1.0, get_bound( table ), None, ( table, None ) ) ]
+        while len( frontier ) > 0:
+            ( bound, _, p, bound_cells, bps, cells ) = heapq.heappop( frontier )
+            if -bound < p_min: return
+            if cells == None:
+                yield ( sorted( get_list( bps ) ), p )
+                continue
+            ( table, cells ) = cells
+            bound_cells /= get_bound( table )
+            for idx in range( table.num_contribs ):
+                new_p = p * table.probability[ idx ]
+                if new_p == 0.0: continue
+                children = table.children[ idx ]
+                if children == None: children = self.get_children( table, idx )
+                ( new_bps, new_cells, new_bound_cells ) = ( bps, cells, bound_cells )
+                for base_pair in children[0]: new_bps = ( base_pair, new_bps )
+                for child in children[1][::-1]:
+                    new_cells = ( child, new_cells )
+                    new_bound_cells *= get_bound( child )
+                if new_cells == None: new_bound_cells = 1.0 # no round-off left over from the divisions
+                if new_p * new_bound_cells < p_min: continue
+                heapq.heappush( frontier, ( -new_p * new_bound_cells, next( counter ), new_p, new_bound_cells, new_bps, new_cells ) )
+
+    def get_best_completion( self, table, max_product_matrices ):
+        '''
+        Highest probability of any traceback from table, relative to its cell: Q of the cell in the
+         max-product semiring over Q in the sum-product semiring. Cached in the table.
+        '''
+        if table.best_completion == None:
+            ( DP, i, j ) = table.cell
+            DP_max = max_product_matrices[ DP.name ]
+            ( Q, Q_max ) = ( DP.val( i ), DP_max.val( i ) ) if j == None else ( DP.val( i, j ), DP_max.val( i, j ) )
+            table.best_completion = min( Q_max / Q, 1.0 )
+        return table.best_completion
+
+    def sample( self, n_samples, rng = None ):
+        '''
+        Returns ( pair_tables, probabilities ): int16 array of shape ( n_samples, N ) and float array of length n_samples.
+        rng = random number generator for these samples (default: this sampler's). The sampler is shared
+               by everyone sampling from the same Partition, so a caller with its own seed passes its own rng.
+        '''
+        pair_tables = np.full( ( n_samples, self.N ), -1, dtype = np.int16 )
+        probabilities = np.zeros( n_samples )
+        unpaired = [ -1 ] * self.N
+        for n in range( n_samples ):
+            self.partition.check_interrupt()
+            ( bps, probabilities[ n ] ) = self.draw( rng = rng )
+            pair_table = unpaired[:]
+            for ( i, j ) in bps:
+                pair_table[ i ] = j
+                pair_table[ j ] = i
+            pair_tables[ n ] = pair_table
+        return ( pair_tables, probabilities )
+
+class SamplingTable:
+    '''
+    Alias table (Vose's method) over the contributions of one cell, from their records (contrib_dtype in
+     recursions/contribs_records.py). For each contribution, keeps
+     base_pairs = base pairs it adds (its Z_BPq branches),
+     branches   = ( matrix index, i%N, j%N ) of each branch, skipping branches with i == j, like backtrack().
+     children   = ( base pairs, SamplingTables ) of the branches, with cells that have a single contribution folded in;
+                   filled in by BoltzmannSampler the first time the contribution is drawn.
+    cell = ( DP, i, j ) the contributions came from, if known, and best_completion its bound for enumerate_best_first().
+    A cell without contributions of nonzero weight is a leaf (num_contribs = 0), as backtrack() skips it too.
+    is_Z_BPq = for each matrix index, whether its cells are base pairs.
+    '''
+    def __init__( self, records, N, is_Z_BPq ):
+        weights = records[ 'weight' ]
+        total = weights.sum()
+        if total == 0.0: records = weights = records[ :0 ]
+        self.probability = ( weights / total ).tolist() if len( weights ) > 0 else []
+        ( matrix, i, j ) = ( records[ 'matrix' ], records[ 'i' ], records[ 'j' ] )
+        used = ( ( matrix >= 0 ) & ( i != j ) ).tolist()
+        ( matrix, i, j ) = ( matrix.tolist(), ( i % N ).tolist(), ( j % N ).tolist() )
+        self.branches = [ [ ( m, a, b ) for ( m, a, b, u ) in zip( *row ) if u ] for row in zip( matrix, i, j, used ) ]
+        self.base_pairs = [ [ ( min( a, b ), max( a, b ) ) for ( m, a, b ) in branches if is_Z_BPq[ m ] ] for branches in self.branches ]
+        self.children = [ None ] * len( weights )
+        self.num_contribs = len( weights )
+        self.best = int( np.argmax( weights ) ) if self.num_contribs > 0 else None # first one wins ties
+        ( self.cutoff, self.alias ) = get_alias_table( self.probability )
+        self.cell = None
+        self.best_completion = None
+
+    def draw( self, rng_random ):
+        if self.num_contribs == 1: return 0
+        x = rng_random() * self.num_contribs
+        idx = int( x )
+        if idx == self.num_contribs: idx -= 1
+        return idx if ( x - idx ) < self.cutoff[ idx ] else self.alias[ idx ]
+
+def get_alias_table( probability ):
+    '''
+    Vose's alias method: column idx is kept with probability cutoff[idx], otherwise alias[idx] is used.
+    '''
+    n = len( probability )
+    if n == 0: return ( [], [] )
+    scaled = [ x * n for x in probability ]
+    cutoff = [ 1.0 ] * n
+    alias = list( range( n ) )
+    small = [ idx for idx in range( n ) if scaled[ idx ] < 1.0 ]
+    large = [ idx for idx in range( n ) if scaled[ idx ] >= 1.0 ]
+    while len( small ) > 0 and len( large ) > 0:
+        s = small.pop()
+        l = large.pop()
+        cutoff[ s ] = scaled[ s ]
+        alias[ s ] = l
+        scaled[ l ] = ( scaled[ l ] + scaled[ s ] ) - 1.0
+        if scaled[ l ] < 1.0: small.append( l )
+        else:                 large.append( l )
+    # leftovers are 1.0 up to round-off; a zero-weight contribution never keeps its own column
+    for idx in small + large:
+        if probability[ idx ] == 0.0: cutoff[ idx ] = 0.0; alias[ idx ] = probability.index( max( probability ) )
+    return ( cutoff, alias )
+
+def sample_blocks( partition, n_samples, seed, n_workers = 1 ):
+    '''
+    ( pair_tables, probabilities ) for n_samples, drawn block by block -- see top of file. Uses n_workers
+     processes if the platform can fork; otherwise (or if n_workers = 1) blocks are drawn here, in order.
+    '''
+    global worker_partition, worker_seed
+    blocks = [ ( block, min( sampling_block_size, n_samples - start ) ) for ( block, start ) in enumerate( range( 0, n_samples, sampling_block_size ) ) ]
+    if n_workers > 1 and len( blocks ) > 1 and hasattr( os, 'fork' ):
+        # first block here, so that workers inherit the tables of the cells most samples go through
+        results = [ sample_block( partition, seed, *blocks[0] ) ]
+        ( worker_partition, worker_seed ) = ( partition, seed ) # inherited by forked workers
+        context = multiprocessing.get_context( 'fork' ) if hasattr( multiprocessing, 'get_context' ) else multiprocessing
+        pool = context.Pool( min( n_workers, len( blocks ) - 1 ) )
+        try:
+            results += pool.map( sample_block_in_worker, blocks[1:], chunksize = 1 )
+        finally:
+            pool.close()
+            pool.join()
+            ( worker_partition, worker_seed ) = ( None, None )
+    else:
+        results = [ sample_block( partition, seed, block, n ) for ( block, n ) in blocks ]
+    if len( results ) == 0: return ( np.zeros( ( 0, partition.N ), dtype = np.int16 ), np.zeros( 0 ) )
+    return ( np.concatenate( [ result[0] for result in results ] ), np.concatenate( [ result[1] for result in results ] ) )
+
+def sample_block( partition, seed, block, n ):
+    return get_sampler( partition ).sample( n, random.Random( get_block_seed( seed, block ) ) )
+
+worker_partition = None
+worker_seed = None
+def sample_block_in_worker( block_and_n ): return sample_block( worker_partition, worker_seed, *block_and_n )
+
+def get_block_seed( seed, block ):
+    # same on every platform and Python version (unlike hash())
+    return int( hashlib.sha1( ( '%s:%d' % ( seed, block ) ).encode( 'ascii' ) ).hexdigest(), 16 )
+
+def get_sampler( partition ):
+    if partition.sampler == None: partition.sampler = BoltzmannSampler( partition )
+    return partition.sampler
+
+def get_list( linked_list ):
+    items = []
+    while linked_list != None:
+        ( item, linked_list ) = linked_list
+        items.append( item )
+    return items
+
+def bps_from_pair_table( pair_table ):
+    return [ ( i, int( partner ) ) for ( i, partner ) in enumerate( pair_table ) if partner > i ]
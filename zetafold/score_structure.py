@@ -1,26 +1,27 @@
 #!/usr/bin/python
 from __future__ import print_function
 import argparse
-from math import log,exp
+from math import log
 import sys
 import os
 if __package__ == None: sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from zetafold.partition import partition
-from zetafold.parameters import get_params
+from zetafold.parameters import get_params, get_params_snapshot
 from zetafold.util import sequence_util
 from zetafold.util import secstruct_util
 from zetafold.util.assert_equal import assert_equal
+from zetafold.util.deriv_check import check_log_derivs
 from zetafold.util.constants import KT_IN_KCAL
 from zetafold.util.output_util import show_derivs
 
-def score_structure( sequences, structure, circle = False, params = None, test_mode = False, deriv_params = None ):
+def score_structure( sequences, structure, circle = False, params = None, test_mode = False, deriv_params = None, deriv_method = 'analytic' ):
 
     # What we get if we parse out motifs
     structure = secstruct_util.get_structure_string( structure )
     bps_list  = secstruct_util.bps_from_secstruct( structure )
     motifs = secstruct_util.parse_motifs( structure )
     sequence, ligated, sequences = sequence_util.initialize_sequence_and_ligated( sequences, circle )
-    params = get_params( params, suppress_all_output = True )
+    if params == None or isinstance(params,str): params = get_params_snapshot( params, suppress_all_output = True )
     Kd_ref = params.base_pair_types[0].Kd # Kd[G-C], a la Turner rule convention
     C_std  = params.C_std
 
@@ -52,7 +53,7 @@ def score_structure( sequences, structure, circle = False, params = None, test_m
             motif_bps_list.append( (motif_res.index(i), motif_res.index(j)) )
         motif_structure = secstruct_util.secstruct_from_bps( motif_bps_list, len( motif_res ) )
 
-        p = partition( motif_sequences, circle = motif_circle, structure = motif_structure, params = params, suppress_all_output = True, deriv_params = deriv_params )
+        p = partition( motif_sequences, circle = motif_circle, structure = motif_structure, params = params, suppress_all_output = True, deriv_params = deriv_params, deriv_method = deriv_method )
         Z_motif = p.Z
         log_derivs_motif = p.log_derivs
 
@@ -130,23 +131,6 @@ if __name__=='__main__':
         dG_rpt = score_structure( args.sequences, args.structure, circle = args.circle, params = params )
         print( 'Check logZ value upon recomputation: ',logZ_val, 'vs', -dG_rpt/KT_IN_KCAL )
         assert_equal( logZ_val, -dG_rpt/KT_IN_KCAL )
-        analytic_grad_val = log_derivs
-        epsilon = 1.0e-7
-        numerical_grad_val = []
-        for n,param in enumerate( args.deriv_params ):
-            save_val = params.get_parameter_value( param )
-            if save_val == 0.0:
-                numerical_grad_val.append( 0.0 )
-                continue
-            params.set_parameter( param,  exp( log(save_val) + epsilon ) )
-            dG_shift = score_structure( args.sequences, args.structure, circle = args.circle, params = params )
-            numerical_grad_val.append( ( -dG_shift/KT_IN_KCAL - logZ_val ) / epsilon )
-            params.set_parameter( param, save_val )
-        print()
-        print( '%20s %25s %25s' % ('','','d(logZ)/d(log parameter)' ) )
-        print( '%20s %25s %25s %25s' % ('parameter','analytic','numerical', 'diff' ) )
-        for i,parameter in enumerate(args.deriv_params):
-               print( '%20s %25.12f %25.12f %25.12f' % (parameter, analytic_grad_val[i], numerical_grad_val[i], analytic_grad_val[i] - numerical_grad_val[i] ) )
-        for val1,val2 in zip(analytic_grad_val,numerical_grad_val): assert_equal( val1, val2 )
-        print()
+        log_Z = lambda params: -score_structure( args.sequences, args.structure, circle = args.circle, params = params )/KT_IN_KCAL
+        check_log_derivs( log_Z, params, args.deriv_params, log_derivs, tolerance = 1.0e-5 )
 
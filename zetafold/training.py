@@ -6,8 +6,10 @@ import os
 from .parameters import get_params
 from .partition import partition
 from .score_structure import score_structure
+from .forward_derivs import forward_log_hessian, forward_log_hessian_vector_product
+from .observable_derivs import unpaired_log_derivs
 from .util.constants import KT_IN_KCAL
-from scipy.optimize import check_grad
+from .util.deriv_check import check_grad
 
 def calc_dG_gap( training_example ):
     ( sequence, structure, force_base_pairs, params, train_parameters ) = ( training_example.sequence, training_example.structure, training_example.force_base_pairs, training_example.params, training_example.train_parameters )
@@ -20,21 +22,58 @@ def calc_dG_gap( training_example ):
 
 def calc_dG_gap_deriv( training_example ):
     ( sequence, structure, force_base_pairs, params, train_parameters ) = ( training_example.sequence, training_example.structure, training_example.force_base_pairs, training_example.params, training_example.train_parameters )
-    (dG_structure, log_derivs_structure ) = score_structure( sequence, structure, params = params, deriv_params = train_parameters )
-    p = partition( sequence, params = params, suppress_all_output = True, mfe = True, force_base_pairs = force_base_pairs, deriv_params = train_parameters )
+    deriv_method = training_example.deriv_method # 'analytic', 'adjoint' or 'forward' -- see partition()
+    (dG_structure, log_derivs_structure ) = score_structure( sequence, structure, params = params, deriv_params = train_parameters, deriv_method = deriv_method )
+    p = partition( sequence, params = params, suppress_all_output = True, mfe = True, force_base_pairs = force_base_pairs, deriv_params = train_parameters, deriv_method = deriv_method )
     log_derivs = p.log_derivs
     dG_gap = dG_structure - p.dG
     print(p.struct_MFE, training_example.name, dG_gap, ' in deriv' )
     return KT_IN_KCAL * ( np.array( log_derivs ) - np.array( log_derivs_structure ) )
 
-def pack_variables( x, params, train_parameters, training_examples = None):
-    for n,param_tag in enumerate(train_parameters):
-        assert( param_tag in params.parameter_tags )
-        params.set_parameter( param_tag, np.exp(x[n]))
+def calc_dG_gap_hessian( training_example ):
+    '''
+    Hessian of dG_gap with respect to log of train_parameters: KT times the difference between the covariance of feature
+     counts over all structures, and over the structures allowed by the target structure (e.g., different coaxial stacks).
+    '''
+    ( sequence, structure, force_base_pairs, params, train_parameters ) = ( training_example.sequence, training_example.structure, training_example.force_base_pairs, training_example.params, training_example.train_parameters )
+    ( hessian, log_derivs, Z ) = forward_log_hessian( sequence, train_parameters, params = params, force_base_pairs = force_base_pairs, suppress_all_output = True )
+    ( hessian_structure, log_derivs_structure, Z_structure ) = forward_log_hessian( sequence, train_parameters, params = params, structure = structure, suppress_all_output = True )
+    return KT_IN_KCAL * ( hessian - hessian_structure )
+
+def calc_dG_gap_hessp( training_example ):
+    '''
+    Same Hessian times training_example.direction, from two fills with O( P ) work per operation (no Hessian formed).
+    '''
+    ( sequence, structure, force_base_pairs, params, train_parameters, v ) = ( training_example.sequence, training_example.structure, training_example.force_base_pairs, training_example.params, training_example.train_parameters, training_example.direction )
+    ( hessp, log_derivs, Z ) = forward_log_hessian_vector_product( sequence, train_parameters, v, params = params, force_base_pairs = force_base_pairs, suppress_all_output = True )
+    ( hessp_structure, log_derivs_structure, Z_structure ) = forward_log_hessian_vector_product( sequence, train_parameters, v, params = params, structure = structure, suppress_all_output = True )
+    return KT_IN_KCAL * ( hessp - hessp_structure )
+
+def calc_fisher_matrix( training_example ):
+    '''
+    Covariance of the feature counts controlled by train_parameters, over all structures.
+    '''
+    ( sequence, force_base_pairs, params, train_parameters ) = ( training_example.sequence, training_example.force_base_pairs, training_example.params, training_example.train_parameters )
+    return forward_log_hessian( sequence, train_parameters, params = params, force_base_pairs = force_base_pairs, suppress_all_output = True )[0]
+
+def calc_unpaired_loss_deriv( training_example, loss_derivs ):
+    '''
+    Derivatives with respect to log of train_parameters of a loss over unpaired probabilities (e.g., a fit to chemical
+     mapping reactivities), given loss_derivs = d(loss)/d(unpaired probability) of each nucleotide. One fill, however
+     many nucleotides are probed (see observable_derivs.py).
+    '''
+    ( sequence, force_base_pairs, params, train_parameters ) = ( training_example.sequence, training_example.force_base_pairs, training_example.params, training_example.train_parameters )
+    return unpaired_log_derivs( sequence, train_parameters, weights = loss_derivs, params = params, force_base_pairs = force_base_pairs, suppress_all_output = True )[1]
+
+def pack_variables( x, params, train_parameters, training_examples = None, deriv_method = 'analytic' ):
+    for param_tag in train_parameters: assert( param_tag in params.parameter_tags )
+    params.set_from_log_vector( x, train_parameters )
     if not training_examples: return
+    snapshot = params.get_snapshot() # read-only copy for the workers; params itself stays the working copy
     for training_example in training_examples:
-        training_example.params = params
+        training_example.params = snapshot
         training_example.train_parameters = train_parameters
+        training_example.deriv_method = deriv_method
 
 def free_energy_gap( x, params, train_parameters, training_examples, pool, outfile ):
     pack_variables( x, params, train_parameters, training_examples )
@@ -45,11 +84,22 @@ def free_energy_gap( x, params, train_parameters, training_examples, pool, outfi
     output_info( outfile, x, sum_dG_gap )
     return sum_dG_gap
 
-def free_energy_gap_deriv( x, params, train_parameters, training_examples, pool ):
-    pack_variables( x, params, train_parameters, training_examples )
+def free_energy_gap_deriv( x, params, train_parameters, training_examples, pool, deriv_method = 'analytic' ):
+    pack_variables( x, params, train_parameters, training_examples, deriv_method )
     all_dG_gap_deriv = pool.map( calc_dG_gap_deriv, training_examples )
     return sum( all_dG_gap_deriv )
 
+def free_energy_gap_hessian( x, params, train_parameters, training_examples, pool ):
+    pack_variables( x, params, train_parameters, training_examples )
+    all_dG_gap_hessian = pool.map( calc_dG_gap_hessian, training_examples )
+    return sum( all_dG_gap_hessian )
+
+def free_energy_gap_hessp( x, v, params, train_parameters, training_examples, pool ):
+    pack_variables( x, params, train_parameters, training_examples )
+    for training_example in training_examples: training_example.direction = np.array( v, dtype = float )
+    all_dG_gap_hessp = pool.map( calc_dG_gap_hessp, training_examples )
+    return sum( all_dG_gap_hessp )
+
 def output_info( outfile, x, sum_dG_gap ):
     if outfile == None: return
     fid = open( outfile, 'a' )
@@ -66,21 +116,7 @@ def create_outfile( outfile, params, training_params ):
 
 
 def train_deriv_check( x0, loss, grad, train_parameters ):
-    # Not enough output from scipy.check_grad, so I wrote my own deriv_check
-    #print( 'Deriv error: ', check_grad( loss, grad, x0 ) )
-    loss_val = loss( x0 )
-    analytic_grad_val = grad( x0 )
-    numerical_grad_val = []
-    epsilon = 1.0e-8
-    for n in range( len(x0) ):
-        x = np.array( x0 ) # need to make an actual copy
-        x[ n ] += epsilon
-        numerical_grad_val.append( ( loss( x ) - loss_val ) / epsilon )
-    print()
-    print( '%20s %25s' % ('','-dG/d(log parameter)' ) )
-    print( '%20s %25s %25s %25s' % ('parameter','analytic','numerical','diff' ) )
-    for i,parameter in enumerate(train_parameters):
-           print( '%20s %25.12f %25.12f %25.12f' % (parameter, analytic_grad_val[i], numerical_grad_val[i], analytic_grad_val[i] - numerical_grad_val[i]  ) )
-    print()
-
+    # Not enough output from scipy.check_grad, so I wrote my own deriv_check -- report only. loss already uses the
+    #  training pool, so shifted losses are evaluated one after another here.
+    check_grad( loss, x0, [ ( 'analytic', grad( x0 ) ) ], train_parameters, 'dG_gap/d(log parameter)', tolerance = None, n_workers = 1 )
     exit()
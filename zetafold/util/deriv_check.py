@@ -0,0 +1,121 @@
+from __future__ import print_function
+import os
+import random
+import multiprocessing
+from math import log, exp
+
+##################################################################################################
+# Numerical check of derivatives with respect to log parameters, shared by partition( deriv_check = True ),
+#  score_structure.py and train_zetafold.py.
+#
+# Central differences, ( f( x + e ) - f( x - e ) )/2e, with error O(e^2) rather than O(e). Each shifted point is
+#  evaluated on its own copy of the parameters, so the caller's params are never touched, and the 2P evaluations
+#  are spread over forked worker processes (as in sampling.py). A random subset of the parameters can be
+#  checked in place of all of them.
+##################################################################################################
+def check_log_derivs( func, params, deriv_params, analytic_derivs, other_derivs = None, label = 'd(logZ)/d(log parameter)',
+                      epsilon = 1.0e-5, tolerance = 1.0e-3, n_sample = None, seed = None, n_workers = None ):
+    '''
+    Compare analytic_derivs (one per deriv_params) with central differences of func( params ) in log of each
+     parameter, print a table, and assert agreement (relative, within tolerance) wherever the derivative is
+     not tiny. Parameters with value zero have log derivative zero. func gets a shifted copy of params.
+
+    other_derivs = { name: derivs } to show, and check, next to analytic_derivs (e.g., forward-mode).
+    n_sample     = check a random subset of this many parameters (seed for the choice).
+
+    Returns numerical derivatives (None for parameters not checked).
+    '''
+    x0 = []
+    for param in deriv_params:
+        val = params.get_parameter_value( param )
+        x0.append( None if val == 0.0 else log( val ) )
+    shifted_func = lambda x: func( get_shifted_params( params, deriv_params, x, x0 ) )
+    derivs = [ ( 'analytic', analytic_derivs ) ] + sorted( ( other_derivs or {} ).items() )
+    return check_grad( shifted_func, x0, derivs, deriv_params, label, epsilon, tolerance, n_sample, seed, n_workers )
+
+def check_grad( func, x0, derivs, labels, label = 'derivative', epsilon = 1.0e-5, tolerance = 1.0e-3, n_sample = None, seed = None, n_workers = None ):
+    '''
+    Same for any function of a vector x0 (e.g., a training loss of log parameters). Entries of x0 that are None
+     are not shifted (numerical derivative zero). derivs = [ ( name, values ), ... ], first one is the reference.
+    tolerance = None only reports the errors.
+    '''
+    indices = [ n for n in range( len( x0 ) ) ]
+    if n_sample != None and n_sample < len( indices ): indices = sorted( random.Random( seed ).sample( indices, n_sample ) )
+    numerical = [ None ] * len( x0 )
+    shifts = []
+    for n in indices:
+        if x0[ n ] == None:
+            numerical[ n ] = 0.0
+            continue
+        shifts += [ ( n, epsilon ), ( n, -epsilon ) ]
+    vals = map_shifts( func, x0, shifts, n_workers )
+    for k in range( 0, len( shifts ), 2 ):
+        n = shifts[ k ][ 0 ]
+        numerical[ n ] = ( vals[ k ] - vals[ k+1 ] ) / ( 2 * epsilon )
+
+    show_deriv_check( labels, derivs, numerical, indices, label )
+    if tolerance == None: return numerical
+    for n in indices:
+        for ( name, values ) in derivs:
+            if abs( values[ n ] ) > 0.001: # seeing numerical issues for very small vals
+                rel_error = get_rel_error( values[ n ], numerical[ n ] )
+                if rel_error > tolerance: print( 'ISSUE!!', labels[ n ], name, values[ n ], numerical[ n ] )
+                assert rel_error <= tolerance, 'derivative mismatch for %s (%s): %s vs. numerical %s' % ( labels[ n ], name, values[ n ], numerical[ n ] )
+    return numerical
+
+def get_rel_error( val, num ):
+    '''
+    |val - num|/|num| -- inf if num is zero and val is not.
+    '''
+    abs_error = abs( val - num )
+    if num == 0.0: return float( 'inf' ) if abs_error > 0.0 else 0.0
+    return abs_error/abs( num )
+
+def show_deriv_check( labels, derivs, numerical, indices, label ):
+    print()
+    print( '%20s %s' % ( '', label ) )
+    print( '%20s' % 'parameter' + ''.join( '%20s' % name for ( name, values ) in derivs ) + '%20s %14s %14s' % ( 'numerical', 'abs error', 'rel error' ) )
+    for n in indices:
+        ( val, num ) = ( derivs[ 0 ][ 1 ][ n ], numerical[ n ] )
+        rel_error = get_rel_error( val, num )
+        print( '%20s' % labels[ n ] + ''.join( '%20.12f' % values[ n ] for ( name, values ) in derivs ) + '%20.12f %14.3e %14.3e' % ( num, abs( val - num ), rel_error ) )
+    print()
+
+##################################################################################################
+def get_shifted_params( params, deriv_params, x, x0 ):
+    '''
+    Copy of params with each of deriv_params whose log value in x differs from x0 set to exp( x ).
+    '''
+    params = params.get_mutable_copy()
+    for ( param, log_val, log_val0 ) in zip( deriv_params, x, x0 ):
+        if log_val != log_val0: params.set_parameter( param, exp( log_val ) )
+    return params
+
+def map_shifts( func, x0, shifts, n_workers = None ):
+    '''
+    func( x0 shifted by delta in entry n ) for each ( n, delta ) in shifts -- in n_workers forked processes
+     (default: one per CPU) if the platform can fork.
+    '''
+    global worker_func, worker_x0
+    if n_workers == None: n_workers = multiprocessing.cpu_count()
+    if n_workers > 1 and len( shifts ) > 1 and hasattr( os, 'fork' ):
+        ( worker_func, worker_x0 ) = ( func, x0 ) # inherited by forked workers
+        context = multiprocessing.get_context( 'fork' ) if hasattr( multiprocessing, 'get_context' ) else multiprocessing
+        pool = context.Pool( min( n_workers, len( shifts ) ) )
+        try:
+            return pool.map( eval_shift_in_worker, shifts, chunksize = 1 )
+        finally:
+            pool.close()
+            pool.join()
+            ( worker_func, worker_x0 ) = ( None, None )
+    return [ eval_shift( func, x0, shift ) for shift in shifts ]
+
+def eval_shift( func, x0, shift ):
+    ( n, delta ) = shift
+    x = list( x0 )
+    x[ n ] += delta
+    return func( x )
+
+worker_func = None
+worker_x0 = None
+def eval_shift_in_worker( shift ): return eval_shift( worker_func, worker_x0, shift )
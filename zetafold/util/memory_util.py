@@ -0,0 +1,124 @@
+from __future__ import print_function
+import sys
+from ..parameters import AlphaFoldParams
+from ..base_pair_types import BasePairType
+from ..recursions import dynamic_programming, explicit_dynamic_programming
+try:
+    import resource
+except ImportError:
+    resource = None # e.g., Windows -- no peak RSS
+
+dynamic_programming_classes = ( dynamic_programming.DynamicProgrammingMatrix, dynamic_programming.DynamicProgrammingList,
+                                explicit_dynamic_programming.DynamicProgrammingMatrix, explicit_dynamic_programming.DynamicProgrammingList )
+
+##################################################################################################
+def get_object_bytes( obj, seen = None, follow_dynamic_programming = True ):
+    '''
+    Bytes held by obj, following lists, tuples, dicts and objects defined in zetafold, and counting
+     shared objects (ids in seen) once. Parameters are not followed (they exist before and after the fold).
+    follow_dynamic_programming = False stops at dynamic programming matrices, e.g., the ones referenced
+     by contributions and backpointers.
+    '''
+    if seen == None: seen = set()
+    if id( obj ) in seen: return 0
+    seen.add( id( obj ) )
+    if isinstance( obj, ( AlphaFoldParams, BasePairType ) ): return 0
+    if not follow_dynamic_programming and isinstance( obj, dynamic_programming_classes ): return 0
+    num_bytes = sys.getsizeof( obj )
+    if isinstance( obj, ( list, tuple ) ):
+        for x in obj: num_bytes += get_object_bytes( x, seen, follow_dynamic_programming )
+    elif isinstance( obj, dict ):
+        for key, x in obj.items(): num_bytes += get_object_bytes( key, seen, follow_dynamic_programming ) + get_object_bytes( x, seen, follow_dynamic_programming )
+    elif hasattr( obj, '__dict__' ) and obj.__class__.__module__.startswith( 'zetafold' ):
+        num_bytes += get_object_bytes( obj.__dict__, seen, follow_dynamic_programming )
+    return num_bytes
+
+def get_peak_rss():
+    '''
+    Peak resident set size of this process so far, in bytes (None if not available).
+    '''
+    if resource == None: return None
+    peak_rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024 # kilobytes on Linux
+
+##################################################################################################
+class MemoryReport:
+    '''
+    Bytes held by each part of a Partition after it has run, and peak RSS before and after each phase,
+     projected to target_N.
+
+      entries     = list of ( name, bytes, exponent ); name is e.g. 'Z_BP.Q' or 'bpp'
+      projected   = bytes * ( target_N / N )^exponent for each entry.
+                     exponent = 2 for N x N arrays, 3 for contributions cached in N x N arrays by backtracking
+                     (each holds O(N) contributions), and one less for Z_final and per-nucleotide lists.
+      peak_rss    = list of ( phase, peak RSS before, peak RSS after ) in bytes
+      projected_peak_rss = peak RSS at start of run, plus growth of peak RSS during the run scaled like the total bytes
+    '''
+    def __init__( self, partition, target_N = None ):
+        self.N = partition.N
+        self.target_N = target_N if target_N != None else self.N
+        self.entries = []
+        seen = set()
+        for DP in partition.Z_all + [ partition.Z_final ]:
+            is_list = ( DP is partition.Z_final )
+            for ( field, num_bytes ) in get_dynamic_programming_bytes( DP, seen ):
+                exponent = ( 3 if field == 'contribs' else 2 ) - is_list
+                self.entries.append( ( DP.name + '.' + field, num_bytes, exponent ) )
+        for ( name, exponent ) in [ ( 'ligated', 1 ), ( 'all_ligated', 2 ), ( 'allow_base_pair', 2 ), ( 'in_forced_base_pair', 1 ), ( 'bpp', 2 ) ]:
+            self.entries.append( ( name, get_object_bytes( getattr( partition, name ), seen, False ), exponent ) )
+
+        scale = float( self.target_N ) / self.N
+        self.projected = [ num_bytes * scale ** exponent for ( name, num_bytes, exponent ) in self.entries ]
+        self.total_bytes = sum( entry[1] for entry in self.entries )
+        self.projected_total_bytes = sum( self.projected )
+
+        self.peak_rss = partition.peak_rss
+        self.projected_peak_rss = None
+        if len( self.peak_rss ) > 0 and self.peak_rss[0][1] != None and self.total_bytes > 0:
+            start_rss = self.peak_rss[0][1]
+            end_rss = max( entry[2] for entry in self.peak_rss )
+            self.projected_peak_rss = start_rss + ( end_rss - start_rss ) * self.projected_total_bytes / self.total_bytes
+
+    def get_bytes_by_field( self ):
+        '''
+        Totals over all matrices for each field ('Q', 'dQ', 'contribs', ...), and for each other structure.
+        '''
+        bytes_by_field = {}
+        for ( name, num_bytes, exponent ) in self.entries:
+            field = name.split( '.' )[ -1 ]
+            bytes_by_field[ field ] = bytes_by_field.get( field, 0 ) + num_bytes
+        return bytes_by_field
+
+    def show_results( self ):
+        print( 'Memory held by Partition with N = %d, and projection to N = %d:' % ( self.N, self.target_N ) )
+        print( '%40s %15s %18s' % ( 'name', 'bytes', 'projected bytes' ) )
+        for ( ( name, num_bytes, exponent ), projected ) in zip( self.entries, self.projected ):
+            if num_bytes > 0: print( '%40s %15d %18d' % ( name, num_bytes, projected ) )
+        print( '%40s %15d %18d' % ( 'total', self.total_bytes, self.projected_total_bytes ) )
+        print()
+        print( 'By field:' )
+        for ( field, num_bytes ) in sorted( self.get_bytes_by_field().items() ): print( '%40s %15d' % ( field, num_bytes ) )
+        print()
+        if len( self.peak_rss ) > 0 and self.peak_rss[0][1] != None:
+            print( '%40s %15s %18s' % ( 'phase', 'peak RSS before', 'peak RSS after' ) )
+            for ( phase, rss_before, rss_after ) in self.peak_rss: print( '%40s %15d %18d' % ( phase, rss_before, rss_after ) )
+            print( '%40s %15s %18d' % ( 'projected peak RSS', '', self.projected_peak_rss ) )
+            print()
+
+def get_dynamic_programming_bytes( DP, seen ):
+    '''
+    ( field, bytes ) for each field of a DynamicProgrammingMatrix or DynamicProgrammingList. In
+     explicit_dynamic_programming.py, fields are N x N lists; in dynamic_programming.py, they are held
+     in a DynamicProgrammingData object for each cell, and 'data' is the bytes of those objects themselves.
+    '''
+    if not hasattr( DP, 'data' ):
+        return [ ( field, get_object_bytes( getattr( DP, field ), seen, False ) ) for field in ( 'Q', 'dQ', 'contribs', 'backpointer', 'contribs_updated' ) ]
+    cells = DP.data.data
+    if len( cells ) > 0 and not isinstance( cells[0], dynamic_programming.DynamicProgrammingData ):
+        cells = [ cell for row in cells for cell in row.data ]
+    field_bytes = []
+    for field in ( 'Q', 'dQ', 'contribs', 'backpointer', 'info' ):
+        field_bytes.append( ( field, sum( get_object_bytes( getattr( cell, field ), seen, False ) for cell in cells ) ) )
+    field_bytes.append( ( 'contribs_updated', get_object_bytes( DP.contribs_updated, seen, False ) ) )
+    field_bytes.append( ( 'data', get_object_bytes( DP.data, seen, False ) ) )
+    return field_bytes
@@ -0,0 +1,143 @@
+from __future__ import print_function
+import copy
+import json
+import time
+from .memory_util import get_peak_rss
+from ..recursions.contribs_view import ContribsView
+from ..recursions.explicit_dynamic_programming import DynamicProgrammingMatrix, DynamicProgrammingList, ShadowMatrix, ShadowList
+from ..recursions.explicit_recursions import recursions_with_loop_counts
+
+##################################################################################################
+# Opt-in profiling of Partition: wall time and calls of each recursion and of post-processing,
+#  plus inner-loop iterations and zero-skips of the recursions.
+#
+# Nothing here is touched unless the user asks for it -- the update_func of each dynamic programming
+#  matrix is only wrapped when profile = True. Inner-loop counts come from the recursions themselves:
+#  create_explicit_recursions.py gives each recursion with loops over positions an AUTOGENERATED LOOP
+#  COUNTS BLOCK, which follows the same loops and conditions and hands each term to a LoopCounts. After
+#  the timed update, the cell is updated again with calc_loop_counts on, on a stand-in for the matrix
+#  (as for contributions, see contribs_view.py). That runs outside the timed region of each recursion,
+#  but inside 'fill'; its time is reported as 'profiling_overhead'.
+#
+#  inner_iterations = iterations of the loops over positions -- split points k, cut points c, ...
+#  zero_skips       = iterations that add no nonzero term -- e.g., Z_BP (or Z_coax) at the split is zero,
+#                      or the connection needed at the split is a chainbreak
+#  cells_skipped    = (i,j) updates that return right away, e.g. no possible base pair for Z_BPq
+#
+# Loop counts need explicit_recursions.py; with use_simple_recursions, only times and calls are recorded.
+##################################################################################################
+class PartitionStats:
+    '''
+    Available as p.stats after partition( ..., profile = True ).
+    records = dict from name ('update_Z_BPq', ..., 'fill', 'get_bpp_matrix', 'calc_mfe', ...) to dict of counters
+    '''
+    def __init__( self ):
+        self.records = {}
+
+    def add( self, name, seconds, calls = 1, inner_iterations = 0, zero_skips = 0, cells_skipped = 0 ):
+        if name not in self.records:
+            self.records[ name ] = { 'seconds': 0.0, 'calls': 0, 'inner_iterations': 0, 'zero_skips': 0, 'cells_skipped': 0 }
+        record = self.records[ name ]
+        record[ 'seconds' ] += seconds
+        record[ 'calls' ] += calls
+        record[ 'inner_iterations' ] += inner_iterations
+        record[ 'zero_skips' ] += zero_skips
+        record[ 'cells_skipped' ] += cells_skipped
+
+    def __getitem__( self, name ): return self.records[ name ]
+
+    def to_json( self, filename = None ):
+        '''
+        JSON string of records; also written to filename, if given.
+        '''
+        json_string = json.dumps( self.records, indent = 2, sort_keys = True )
+        if filename != None:
+            with open( filename, 'w' ) as f: f.write( json_string + '\n' )
+        return json_string
+
+    def show( self ):
+        print( '%30s %12s %10s %16s %12s %12s' % ( 'name', 'seconds', 'calls', 'inner_iterations', 'zero_skips', 'cells_skipped' ) )
+        for name in sorted( self.records.keys(), key = lambda name: -self.records[ name ][ 'seconds' ] ):
+            r = self.records[ name ]
+            print( '%30s %12.6f %10d %16d %12d %12d' % ( name, r[ 'seconds' ], r[ 'calls' ], r[ 'inner_iterations' ], r[ 'zero_skips' ], r[ 'cells_skipped' ] ) )
+        print()
+
+class LoopCounts:
+    '''
+    Counters for one update, filled in by an AUTOGENERATED LOOP COUNTS BLOCK of explicit_recursions.py.
+    start( depth ) opens an iteration of a loop inside depth other loops; add( term ) marks the open iterations
+     as adding something, if term is nonzero; finish() closes what is still open.
+    '''
+    def __init__( self ):
+        self.inner_iterations = 0
+        self.zero_skips = 0
+        self.cells_counted = 0
+        self.adds_term = [] # for each open iteration, from outer loop to inner, whether it adds a nonzero term
+
+    def start( self, depth ):
+        self.finish( depth )
+        self.inner_iterations += 1
+        self.adds_term.append( False )
+
+    def add( self, term ):
+        if term > 0.0: self.adds_term = [ True ] * len( self.adds_term )
+
+    def finish( self, depth = 0 ):
+        while len( self.adds_term ) > depth:
+            if not self.adds_term.pop(): self.zero_skips += 1
+
+##################################################################################################
+def install_profiling( self ):
+    '''
+    Wrap update_func of each dynamic programming matrix of Partition self with a timer and loop counts.
+    '''
+    self.stats = PartitionStats()
+    for DP in self.Z_all + [ self.Z_final ]:
+        name = 'update_Z_BPq' if DP.name[:5] == 'Z_BPq' else recursion_names.get( DP.name, 'update_' + DP.name )
+        DP.update_func = get_profiled_update_func( self.stats, name, DP )
+
+recursion_names = { 'C_eff_basic_no_BP_singlet':   'update_C_eff_no_BP_singlet',
+                    'C_eff_basic_no_coax_singlet': 'update_C_eff_no_coax_singlet' }
+
+def get_profiled_update_func( stats, name, DP ):
+    update_func = DP.update_func
+    count_loops = ( name in recursions_with_loop_counts ) and isinstance( DP, ( DynamicProgrammingMatrix, DynamicProgrammingList ) )
+    def profiled_update_func( partition, *args ):
+        start_time = time.time()
+        update_func( partition, *args )
+        seconds = time.time() - start_time
+        if not count_loops:
+            stats.add( name, seconds )
+            return
+        start_time = time.time()
+        loop_counts = get_loop_counts( partition, DP, update_func, args )
+        stats.add( 'profiling_overhead', time.time() - start_time )
+        stats.add( name, seconds, 1, loop_counts.inner_iterations, loop_counts.zero_skips, 1 - loop_counts.cells_counted )
+    return profiled_update_func
+
+def get_loop_counts( partition, DP, update_func, args ):
+    '''
+    LoopCounts of update_func( partition, *args ) for a cell of DP (explicit_dynamic_programming.py), from the
+     update run again with calc_loop_counts on a stand-in for DP, so the filled matrices are not touched.
+    '''
+    options = copy.copy( partition.options )
+    ( options.calc_contrib, options.calc_deriv_DP, options.calc_loop_counts ) = ( False, False, True )
+    shadow = ShadowMatrix( DP, args[0] ) if len( args ) == 2 else ShadowList( DP )
+    shadow.update_func = update_func
+    view = ContribsView( partition, { id( DP ): shadow }, options )
+    view.loop_counts = LoopCounts()
+    shadow.update( view, *args )
+    view.loop_counts.finish()
+    return view.loop_counts
+
+def run_profiled( self, name, func, *args ):
+    '''
+    Run func( self, *args ), recording peak RSS before and after in self.peak_rss, and
+     if self is being profiled, its time under name.
+    '''
+    peak_rss_before = get_peak_rss()
+    start_time = time.time()
+    result = func( self, *args )
+    if self.stats != None: self.stats.add( name, time.time() - start_time )
+    self.peak_rss.append( ( name, peak_rss_before, get_peak_rss() ) )
+    return result
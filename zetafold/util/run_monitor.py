@@ -0,0 +1,93 @@
+import threading
+import time
+
+##################################################################################################
+# Progress reports, cooperative cancellation and wall-clock timeouts for Partition.run().
+##################################################################################################
+class PartitionInterrupted( Exception ):
+    '''
+    Dynamic programming was stopped before it finished. progress holds the last PartitionProgress.
+    '''
+    def __init__( self, message, progress = None ):
+        Exception.__init__( self, message )
+        self.progress = progress
+
+class PartitionCancelled( PartitionInterrupted ): pass
+
+class PartitionTimeout( PartitionInterrupted ): pass
+
+class CancellationToken:
+    '''
+    Shared between the caller (e.g., another thread of a service) and a running Partition.
+    Calling cancel() makes the partition function calculation raise PartitionCancelled at its next check.
+    '''
+    def __init__( self ):
+        self.event = threading.Event()
+
+    def cancel( self ): self.event.set()
+    def is_cancelled( self ): return self.event.is_set()
+
+class PartitionProgress:
+    '''
+    Passed to progress_callback after each anti-diagonal ( offset = j - i ) of the dynamic programming matrices.
+    fraction_done counts inner-loop work, which grows with offset, so it is a better basis for eta than cells.
+    '''
+    def __init__( self, offset, num_offsets, cells_done, num_cells, fraction_done, elapsed ):
+        self.offset        = offset
+        self.num_offsets   = num_offsets
+        self.cells_done    = cells_done
+        self.num_cells     = num_cells
+        self.fraction_done = fraction_done
+        self.elapsed       = elapsed
+        self.eta = elapsed * ( 1.0 - fraction_done ) / fraction_done if fraction_done > 0.0 else None
+
+    def __str__( self ):
+        eta = '%.2fs' % self.eta if self.eta != None else '?'
+        return 'offset %d/%d cells %d/%d (%.1f%%) elapsed %.2fs eta %s' % ( self.offset, self.num_offsets, self.cells_done, self.num_cells, 100.0 * self.fraction_done, self.elapsed, eta )
+
+class RunMonitor:
+    '''
+    Fires progress_callback and checks cancel_token and deadline during dynamic programming.
+    progress_step = only fire progress_callback when another progress_step of the work (e.g., 0.01 for every 1%) is done.
+                    Default 0.0 fires after every anti-diagonal.
+    '''
+    def __init__( self, N, calc_all_elements, progress_callback = None, progress_step = 0.0, cancel_token = None, deadline = None ):
+        self.N = N
+        self.calc_all_elements = calc_all_elements
+        self.progress_callback = progress_callback
+        self.progress_step = progress_step
+        self.cancel_token = cancel_token
+        self.deadline = deadline
+        self.start_time = time.time()
+        self.num_cells = sum( self.get_num_cells( offset ) for offset in range( 1, N ) )
+        self.total_work = sum( self.get_num_cells( offset ) * offset for offset in range( 1, N ) )
+        self.cells_done = 0
+        self.work_done = 0
+        self.next_report = 0.0
+        self.progress = None
+
+    def get_num_cells( self, offset ): return self.N if self.calc_all_elements else self.N - offset
+
+    def check( self ): check_interrupt( self.cancel_token, self.deadline, self.progress )
+
+    def finished_diagonal( self, offset ):
+        num_cells = self.get_num_cells( offset )
+        self.cells_done += num_cells
+        self.work_done  += num_cells * offset
+        fraction_done = float( self.work_done ) / self.total_work
+        self.progress = PartitionProgress( offset, self.N - 1, self.cells_done, self.num_cells, fraction_done, time.time() - self.start_time )
+        if self.progress_callback != None and ( fraction_done >= self.next_report or offset == self.N - 1 ):
+            self.progress_callback( self.progress )
+            if self.progress_step > 0.0:
+                while self.next_report <= fraction_done: self.next_report += self.progress_step
+        self.check()
+
+def check_interrupt( cancel_token, deadline, progress = None ):
+    if cancel_token != None and cancel_token.is_cancelled():
+        raise PartitionCancelled( 'Partition function calculation cancelled', progress )
+    if deadline != None and time.time() > deadline:
+        raise PartitionTimeout( 'Partition function calculation timed out', progress )
+
+def get_deadline( timeout ):
+    if timeout == None: return None
+    return time.time() + timeout